@@ -0,0 +1,82 @@
+"""
+Benchmark de codificacion de paginas (pdf_to_png.save_page)
+Mide tiempo de guardado y tamano de archivo de cada combinacion de
+formato / color / compresion frente al guardado anterior (PNG optimize=True).
+
+Uso:
+    python benchmarks/bench_encode.py [pagina.png] [repeticiones]
+
+Sin imagen se usa una pagina A4 sintetica a 300 DPI (texto + ruido de escaner).
+"""
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from pdf_to_png import output_options, save_page
+
+CASES = [
+    ("png color c1", output_options("png", "color", 1)),
+    ("png color c6", output_options("png", "color", 6)),
+    ("png gray c1", output_options("png", "gray", 1)),
+    ("png gray c6", output_options("png", "gray", 6)),
+    ("png bw c6", output_options("png", "bw", 6)),
+    ("tiff-g4", output_options("tiff-g4")),
+    ("webp gray c0", output_options("webp", "gray", 0)),
+    ("webp gray c6", output_options("webp", "gray", 6)),
+]
+
+
+def synthetic_page(width=2480, height=3508):
+    """Pagina A4 a 300 DPI con lineas de texto y ruido leve de escaner"""
+    page = Image.new("RGB", (width, height), (250, 248, 244))
+    draw = ImageDraw.Draw(page)
+    try:
+        font = ImageFont.load_default(size=38)
+    except TypeError:
+        font = ImageFont.load_default()
+    line = "RESOLUCION COACTIVA N 0230071234567  RUC 20100070970  S/. 12,450.00"
+    for y in range(200, height - 200, 70):
+        draw.text((180, y), line, fill=(30, 30, 30), font=font)
+    noise = np.random.default_rng(0).normal(0, 4, (height, width, 1))
+    pixels = np.clip(np.asarray(page, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def measure(encode, repeat):
+    """Mejor tiempo de `repeat` codificaciones y tamano resultante"""
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        encode(buffer)
+        best = min(best, time.perf_counter() - start)
+        size = buffer.tell()
+    return best, size
+
+
+def main():
+    args = sys.argv[1:]
+    repeat = int(args.pop()) if args and args[-1].isdigit() else 3
+    page = Image.open(args[0]).convert("RGB") if args else synthetic_page()
+    print(f"Pagina {page.width}x{page.height}, mejor de {repeat}")
+
+    base_time, base_size = measure(lambda buf: page.save(buf, "PNG", optimize=True), repeat)
+    print(f"{'opcion':<16}{'ms':>9}{'KB':>10}{'x tiempo':>10}{'% tamano':>10}")
+    print(f"{'png optimize':<16}{base_time * 1000:>9.0f}{base_size / 1024:>10.0f}{1.0:>10.1f}{100:>10.0f}")
+
+    for name, output in CASES:
+        elapsed, size = measure(lambda buf: save_page(page, buf, output), repeat)
+        print(f"{name:<16}{elapsed * 1000:>9.0f}{size / 1024:>10.0f}"
+              f"{base_time / elapsed:>10.1f}{size * 100 / base_size:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Micro-benchmark de extract_data_from_text
+Compara el motor de extraccion por tabla con la implementacion anterior
+(regex ad-hoc + 20 str.replace por limpieza) y verifica que la salida sea identica.
+Los RUCs se comparan contra los valores esperados: la implementacion anterior
+los buscaba en el texto ya sin separadores y nunca los encontraba.
+
+Resultado de referencia (Python 3.11, mejor de 7 repeticiones alternadas):
+entre 1.2x y 1.5x segun la carga de la maquina, ~1.3x tipico. La ganancia
+es modesta: el tiempo se va sobre todo en las regex de cada campo, que
+ambas versiones ejecutan igual.
+
+Uso:
+    python benchmarks/bench_extract.py [iteraciones]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import extract_data_from_text, validate_ruc
+
+SAMPLE_TEXTS = [
+    """SUPERINTENDENCIA NACIONAL DE ADUANAS Y DE ADMINISTRACION TRIBUTARIA
+EXPEDIENTE SIGAD 045-2O24-0123-1234567-8  045-SGD-2024-1234567-8
+RESOLUCION COACTIVA N° 0231O0456789O
+EXPEDIENTE NÚMERO: 023-0456789
+Lima, 12 de Marzo del 2024
+DEUDOR: COMERCIALIZADORA ANDINA S.A.C.
+RUC 20100047218
+USUARIO RUC 20512345671 - BANCO DE CREDITO DEL PERU
+Se ordena la retención hasta por la suma de S/. 12,450.00 ( 1245O.00 )
+FECHA: 15/03/2024
+CHEQUE 12345678-9 de fecha 20/03/2024""",
+    """Resolución de Ejecución Coactiva
+Numero 1330230045612
+FECHA
+03-04-2023
+CONTRIBUYENTE
+JUAN PEREZ LOPEZ
+Monto Soles 300.50
+""",
+    "texto sin campos reconocibles " * 40,
+]
+# RUCs esperados de cada texto de muestra
+SAMPLE_RUCS = [
+    {"ruc_contribuyente": "20100047218", "ruc_tercero": "20512345671"},
+    {},
+    {},
+]
+RUC_FIELDS = ("ruc_contribuyente", "ruc_tercero")
+
+# --- Implementacion anterior (referencia) ---
+def legacy_clean_ocr_number(text):
+    replacements = {
+        'O': '0', 'o': '0', 'Q': '0', 'D': '0', 'C': '0',
+        'I': '1', 'l': '1', '|': '1', '!': '1', 'i': '1', 'L': '1',
+        'Z': '2', 'E': '3', 'A': '4', 'S': '5', '$': '5',
+        'G': '6', 'T': '7', 'B': '8', 'g': '9'
+    }
+    cleaned = text
+    for char, digit in replacements.items():
+        cleaned = cleaned.replace(char, digit)
+    return re.sub(r'\D', '', cleaned)
+
+def legacy_extract_data_from_text(text):
+    data = {}
+    text_clean = re.sub(r'  +', ' ', text)
+
+    exp_sigad_match = re.search(r'\b(\d{3}-[A-Z0-9]+-\d{4}-\d+-\d)\b', text)
+    if exp_sigad_match:
+        data["exp_sigad"] = exp_sigad_match.group(1)
+
+    res_match = re.search(r'(?i)(?:RESOLUCI[ÓO]N|RES\.?)\s*(?:COACTIVA)?\s*(?:N[º°])?\s*([\dOIZSB]+)', text)
+    if res_match:
+        raw = legacy_clean_ocr_number(res_match.group(1))
+        if len(raw) >= 10: data["res_coactiva"] = raw
+    else:
+        possibles = re.findall(r'\b(133\d{10})\b', legacy_clean_ocr_number(text))
+        if possibles: data["res_coactiva"] = possibles[0]
+
+    exp_rc_match = re.search(r'(?i)EXPEDIENTE\s+(?:N[ÚU]MERO|N[º°])\s*[:\.]?\s*([\dOIZSB]+)', text)
+    if exp_rc_match:
+        data["expediente_rc"] = legacy_clean_ocr_number(exp_rc_match.group(1))
+
+    all_numbers = re.findall(r'\b\d{11}\b', legacy_clean_ocr_number(text))
+    valid_rucs = []
+    seen = set()
+    for num in all_numbers:
+        if validate_ruc(num) and num not in seen:
+            valid_rucs.append(num)
+            seen.add(num)
+    if valid_rucs:
+        data["ruc_contribuyente"] = valid_rucs[0]
+        if len(valid_rucs) > 1:
+            data["ruc_tercero"] = valid_rucs[-1]
+
+    lines = text_clean.split('\n')
+    for i, line in enumerate(lines):
+        if "DEUDOR" in line.upper() or "CONTRIBUYENTE" in line.upper():
+            match = re.search(r'[:\.]\s*(.*)', line)
+            if match:
+                val = match.group(1).strip()
+                if len(val) > 4: data["nombre_contribuyente"] = val
+            elif i + 1 < len(lines):
+                data["nombre_contribuyente"] = lines[i+1].strip()
+            break
+
+    for i, line in enumerate(lines):
+        if "USUARIO" in line.upper():
+            parts = line.split("RUC")
+            if len(parts) > 1:
+                name = re.sub(r'[\d\s:-]+', ' ', parts[1]).strip()
+                if len(name) > 4: data["nombre_tercero"] = name
+            elif i + 1 < len(lines):
+                if "nombre_tercero" not in data:
+                    data["nombre_tercero"] = lines[i+1].strip()
+
+    monto_paren = re.search(r'\(\s*([\dOIZSB]{1,6}[\.,]\d{2})\s*\)', text)
+    if monto_paren:
+        data["monto"] = monto_paren.group(1).replace('O','0').replace('S','5')
+    monto_soles = re.search(r'(?:S/|Soles)\.?\s*([\d\.,]+)', text)
+    if monto_soles and "monto" not in data:
+        data["monto"] = monto_soles.group(1)
+
+    all_dates = re.findall(r'\b(\d{1,2})[/-](\d{1,2})[/-](20\d{2})\b', text)
+    fecha_label_match = re.search(r'(?i)FECHA\s*[:\.]?[\s\n]*(\d{1,2}[/-]\d{1,2}[/-]20\d{2})', text)
+    if fecha_label_match:
+        data["fecha_recepcion"] = fecha_label_match.group(1).replace('-', '/')
+    elif all_dates:
+        d, m, y = all_dates[0]
+        data["fecha_recepcion"] = f"{d}/{m}/{y}"
+
+    meses_pattern = r'(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre)'
+    date_text_match = re.search(rf'(\d{{1,2}})\s+de\s+{meses_pattern}\s+del?\s+(20\d{{2}})', text, re.IGNORECASE)
+    if date_text_match:
+        d = date_text_match.group(1)
+        m_txt = date_text_match.group(2).lower()
+        y = date_text_match.group(3)
+        meses_map = {
+            "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
+            "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
+            "septiembre": "09", "setiembre": "09", "octubre": "10",
+            "noviembre": "11", "diciembre": "12"
+        }
+        data["fecha_rc"] = f"{d.zfill(2)}/{meses_map[m_txt]}/{y}"
+
+    if "fecha_rc" not in data and len(all_dates) > 1:
+        d, m, y = all_dates[1]
+        curr = f"{d}/{m}/{y}"
+        if curr != data.get("fecha_recepcion"):
+            data["fecha_rc"] = curr
+
+    cheque_match = re.search(r'\b(\d{8}-\d)\b', text)
+    if cheque_match:
+        data["cheque_boleta"] = cheque_match.group(1)
+
+    return data
+
+
+def bench(fns, number, repeat=7):
+    """Mejor tiempo de cada funcion, alternandolas en cada repeticion para que el ruido de la maquina afecte a todas por igual."""
+    best = [float("inf")] * len(fns)
+    for _ in range(repeat):
+        for i, fn in enumerate(fns):
+            best[i] = min(best[i], timeit.timeit(lambda: [fn(t) for t in SAMPLE_TEXTS], number=number))
+    return best
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    for text, rucs in zip(SAMPLE_TEXTS, SAMPLE_RUCS):
+        legacy = {k: v for k, v in legacy_extract_data_from_text(text).items() if k not in RUC_FIELDS}
+        current = extract_data_from_text(text)
+        current_rucs = {k: current.pop(k) for k in RUC_FIELDS if k in current}
+        if legacy != current or list(legacy) != list(current):
+            print("❌ Salida distinta")
+            print("   anterior:", legacy)
+            print("   actual:  ", current)
+            sys.exit(1)
+        if current_rucs != rucs:
+            print("❌ RUCs distintos")
+            print("   esperado:", rucs)
+            print("   actual:  ", current_rucs)
+            sys.exit(1)
+    print("✅ Salida idéntica en todos los textos de muestra")
+
+    t_legacy, t_current = bench([legacy_extract_data_from_text, extract_data_from_text], number)
+    per_call = len(SAMPLE_TEXTS) * number
+
+    print(f"Anterior: {t_legacy / per_call * 1e6:8.1f} µs/texto")
+    print(f"Actual:   {t_current / per_call * 1e6:8.1f} µs/texto")
+    print(f"Speedup:  {t_legacy / t_current:8.2f}x")
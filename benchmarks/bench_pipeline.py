@@ -0,0 +1,154 @@
+"""
+Benchmark del pipeline de escaneo con documentos sinteticos
+Mide la latencia de cada etapa (decode, exif_transpose, recorte,
+preprocess_image, orientacion, plantillas, la cascada de resoluciones,
+cada pase de OCR y extract_data_from_text), el /upload completo via el
+cliente de pruebas de Flask y la precision por campo contra los valores
+conocidos.
+
+Uso:
+    python benchmarks/bench_pipeline.py [documentos] [--seed N] [--no-e2e]
+
+La fila "texto fuente" aplica extract_data_from_text al texto con el que se
+dibujo el documento: es el techo de precision sin errores de OCR.
+"""
+
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Historial en un archivo temporal y sin cache en disco: no ensucia la
+# base real y cada documento pasa por el pipeline completo
+os.environ["SCAN_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_scans_"), "scans.db")
+os.environ.pop("OCR_CACHE_DIR", None)
+
+import main
+from synthetic_docs import generate
+
+
+class StageTimer:
+    """Acumula duraciones (ms) por etapa"""
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def run(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.samples[stage].append((time.perf_counter() - start) * 1000)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            return self.run(stage, fn, *args, **kwargs)
+        return timed
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_stages(doc, timer):
+    """Pipeline de process_scan etapa por etapa (mismo orden y mismas funciones)"""
+    gray, orientation = timer.run("decode", main.decode_image, doc["image"])
+    image = timer.run("exif_transpose", main.apply_exif_orientation, gray, orientation)
+    document = timer.run("crop_document", main.crop_document, image)
+    processed = timer.run("preprocess_image", main.preprocess_image, document)
+    candidates, osd_confident = timer.run("orientation", main.orientation_candidates, processed)
+    zones = timer.run("layout_zones", main.read_layout_zones, processed, candidates[0])
+    zone_data = zones.data
+    if zones.resolves_page:
+        return zone_data
+    data, text, _, _ = timer.run("ocr_ladder", main.ocr_ladder, processed, candidates, osd_confident, zones.anchor_text)
+    timer.run("extract_data_from_text", main.extract_data_from_text, text)
+    for field, value in zone_data.items():
+        data.setdefault(field, value)
+    return data
+
+
+def run_end_to_end(docs, timer):
+    """POST /upload y espera al trabajo en el JobQueue (procesos reales)"""
+    client = main.app.test_client()
+    main.job_queue.start()
+    results = []
+    for doc in docs:
+        start = time.perf_counter()
+        response = client.post("/upload", data={"file": (io.BytesIO(doc["image"]), "doc.jpg")},
+                               content_type="multipart/form-data")
+        body = response.get_json()
+        if response.status_code == 202:
+            try:
+                data = main.job_queue.future(body["job_id"]).result()["data"]
+            except Exception as e:
+                data = {"error": str(e)}
+        else:
+            data = body.get("data") or {"error": body.get("message")}
+        timer.samples["upload (e2e)"].append((time.perf_counter() - start) * 1000)
+        results.append(data)
+    return results
+
+
+def accuracy(docs, results):
+    """Aciertos exactos por campo"""
+    hits = defaultdict(int)
+    for doc, data in zip(docs, results):
+        for field, expected in doc["expected"].items():
+            hits[field] += (data or {}).get(field) == expected
+    return {field: hits[field] / len(docs) for field in main.SCAN_FIELDS}
+
+
+def main_bench():
+    args = sys.argv[1:]
+    seed = 0
+    if "--seed" in args:
+        index = args.index("--seed")
+        seed = int(args[index + 1])
+        del args[index:index + 2]
+    end_to_end = "--no-e2e" not in args
+    args = [arg for arg in args if arg != "--no-e2e"]
+    count = int(args[0]) if args else 12
+
+    docs = list(generate(count, seed=seed))
+    print(f"{count} documentos sinteticos (semilla {seed}), OCR: "
+          f"{'tesserocr' if main.tesserocr is not None else 'pytesseract'}")
+
+    timer = StageTimer()
+    # Cada pase de OCR por separado (la carrera de rotaciones los llama por este nombre)
+    main._ocr_at_angle = timer.wrap("ocr pass", main._ocr_at_angle)
+
+    columns = {"texto fuente": [main.extract_data_from_text(doc["text"]) for doc in docs]}
+    pipeline_results, errors = [], 0
+    for doc in docs:
+        try:
+            pipeline_results.append(run_stages(doc, timer))
+        except Exception as e:
+            errors += 1
+            pipeline_results.append({})
+            print(f"  error en pipeline: {e}")
+    columns["pipeline"] = pipeline_results
+    if end_to_end:
+        columns["/upload"] = run_end_to_end(docs, timer)
+
+    print(f"\n{'etapa':<24}{'n':>5}{'media ms':>11}{'p50':>9}{'p95':>9}")
+    for stage, values in timer.samples.items():
+        print(f"{stage:<24}{len(values):>5}{statistics.mean(values):>11.1f}"
+              f"{percentile(values, 0.5):>9.1f}{percentile(values, 0.95):>9.1f}")
+
+    reports = {name: accuracy(docs, results) for name, results in columns.items()}
+    print(f"\n{'campo':<24}" + "".join(f"{name:>14}" for name in reports))
+    for field in main.SCAN_FIELDS:
+        print(f"{field:<24}" + "".join(f"{report[field]:>14.0%}" for report in reports.values()))
+    print(f"{'promedio':<24}" + "".join(f"{statistics.mean(report.values()):>14.0%}" for report in reports.values()))
+    if errors:
+        print(f"\n{errors} documento(s) con error en el pipeline")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,165 @@
+"""
+Generador de resoluciones coactivas sinteticas para benchmarks.
+
+Cada documento se dibuja con PIL a partir de valores conocidos (RUCs con
+digito verificador Modulo 11 valido, expediente SIGAD, montos y fechas) y
+se "fotografia": hoja sobre fondo oscuro, rotacion, desenfoque y ruido.
+Devuelve los bytes JPEG y los valores esperados de cada campo.
+"""
+
+import io
+import os
+import random
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import validate_ruc
+
+MESES = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+         "agosto", "setiembre", "octubre", "noviembre", "diciembre"]
+NOMBRES = ["COMERCIALIZADORA ANDINA S.A.C.", "INVERSIONES DEL SUR E.I.R.L.", "TRANSPORTES CHAVIN S.A.",
+           "AGROINDUSTRIAS PIURA S.A.C.", "CONSTRUCTORA LOS ANDES S.R.L.", "IMPORTACIONES LIMA NORTE S.A."]
+BANCOS = ["BANCO DE CREDITO DEL PERU", "BANCO INTERNACIONAL DEL PERU", "SCOTIABANK PERU",
+          "BANCO BBVA PERU", "CAJA MUNICIPAL DE AREQUIPA"]
+
+# Hoja A4 a 200 DPI y margen de fondo alrededor (la "foto")
+PAGE_SIZE = (1654, 2339)
+BACKGROUND_MARGIN = 120
+FONT_SIZE = 30
+
+
+def make_ruc(rng, prefix="20"):
+    """RUC de 11 digitos con digito verificador Modulo 11 valido"""
+    body = prefix + "".join(str(rng.randrange(10)) for _ in range(10 - len(prefix)))
+    for check in range(10):
+        if validate_ruc(body + str(check)):
+            return body + str(check)
+    raise AssertionError("sin digito verificador")  # no ocurre: siempre hay uno
+
+
+def make_fields(rng):
+    """Valores de un documento: texto (lineas) y campos esperados"""
+    year = rng.randrange(2019, 2026)
+    rec_day, rec_month = rng.randrange(1, 29), rng.randrange(1, 13)
+    rc_day, rc_month = rng.randrange(1, 29), rng.randrange(1, 13)
+    amount = f"{rng.randrange(100, 99999)}.{rng.randrange(100):02d}"
+    ruc_deudor = make_ruc(rng, "20")
+    ruc_banco = make_ruc(rng, "20")
+    while ruc_banco == ruc_deudor:
+        ruc_banco = make_ruc(rng, "20")
+
+    expected = {
+        "exp_sigad": f"{rng.randrange(100, 1000)}-SGD-{year}-{rng.randrange(1000000, 9999999)}-{rng.randrange(10)}",
+        "fecha_recepcion": f"{rec_day:02d}/{rec_month:02d}/{year}",
+        "ruc_contribuyente": ruc_deudor,
+        "nombre_contribuyente": rng.choice(NOMBRES),
+        "res_coactiva": f"023{rng.randrange(10 ** 9, 10 ** 10)}",
+        "fecha_rc": f"{rc_day:02d}/{rc_month:02d}/{year}",
+        "expediente_rc": f"023{rng.randrange(10 ** 7, 10 ** 8)}",
+        "monto": amount,
+        "ruc_tercero": ruc_banco,
+        "nombre_tercero": rng.choice(BANCOS),
+        "cheque_boleta": f"{rng.randrange(10 ** 7, 10 ** 8)}-{rng.randrange(10)}",
+    }
+    lines = [
+        "SUPERINTENDENCIA NACIONAL DE ADUANAS Y DE",
+        "ADMINISTRACION TRIBUTARIA",
+        "",
+        f"EXPEDIENTE SIGAD {expected['exp_sigad']}",
+        f"FECHA: {expected['fecha_recepcion']}",
+        "",
+        f"RESOLUCION COACTIVA N° {expected['res_coactiva']}",
+        f"EXPEDIENTE NUMERO: {expected['expediente_rc']}",
+        f"Lima, {rc_day} de {MESES[rc_month - 1]} del {year}",
+        "",
+        f"DEUDOR: {expected['nombre_contribuyente']}",
+        f"RUC {expected['ruc_contribuyente']}",
+        f"USUARIO RUC {expected['ruc_tercero']} - {expected['nombre_tercero']}",
+        "",
+        "Se ordena la retencion hasta por la suma de",
+        f"S/. {amount} ( {amount} )",
+        f"CHEQUE {expected['cheque_boleta']}",
+    ]
+    return lines, expected
+
+
+def load_font(size=FONT_SIZE):
+    for name in ("DejaVuSans.ttf", "arial.ttf", "Arial.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def render_page(lines, font=None):
+    """Hoja blanca con el texto del documento"""
+    font = font or load_font()
+    page = Image.new("L", PAGE_SIZE, 250)
+    draw = ImageDraw.Draw(page)
+    y = 160
+    for line in lines:
+        draw.text((140, y), line, fill=20, font=font)
+        y += int(FONT_SIZE * 1.9)
+    return page
+
+
+def photograph(page, rng, rotation=0, skew=0.0, blur=0.0, noise=0.0, quality=85):
+    """
+    Simula la foto del celular: hoja sobre fondo oscuro, giro (multiplo de
+    90 mas una inclinacion leve), desenfoque gaussiano y ruido.
+    """
+    photo = Image.new("L", (page.width + 2 * BACKGROUND_MARGIN, page.height + 2 * BACKGROUND_MARGIN), 60)
+    photo.paste(page, (BACKGROUND_MARGIN, BACKGROUND_MARGIN))
+    if skew:
+        photo = photo.rotate(skew, resample=Image.BICUBIC, expand=True, fillcolor=60)
+    if rotation:
+        photo = photo.rotate(rotation, expand=True)
+    if blur:
+        photo = photo.filter(ImageFilter.GaussianBlur(blur))
+    if noise:
+        pixels = np.asarray(photo, dtype=np.float32)
+        pixels += np.random.default_rng(rng.randrange(2 ** 32)).normal(0, noise, pixels.shape)
+        photo = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    buffer = io.BytesIO()
+    photo.convert("RGB").save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def generate(count, seed=0, rotations=(0, 90, 180, 270), max_blur=1.2, max_noise=12.0):
+    """
+    Genera `count` documentos reproducibles (misma semilla, mismos bytes).
+
+    Yields:
+        dict: {"image": bytes JPEG, "text": texto fuente, "expected": campos,
+               "rotation", "blur", "noise"}
+    """
+    rng = random.Random(seed)
+    font = load_font()
+    for index in range(count):
+        lines, expected = make_fields(rng)
+        rotation = rotations[index % len(rotations)]
+        blur = round(rng.uniform(0, max_blur), 2)
+        noise = round(rng.uniform(0, max_noise), 1)
+        image = photograph(render_page(lines, font), rng, rotation=rotation,
+                           skew=rng.uniform(-1.5, 1.5), blur=blur, noise=noise)
+        yield {"image": image, "text": "\n".join(lines), "expected": expected,
+               "rotation": rotation, "blur": blur, "noise": noise}
+
+
+if __name__ == "__main__":
+    # Vuelca algunos documentos para inspeccionarlos a ojo
+    output_folder = sys.argv[1] if len(sys.argv) > 1 else "synthetic_docs"
+    os.makedirs(output_folder, exist_ok=True)
+    for number, doc in enumerate(generate(int(sys.argv[2]) if len(sys.argv) > 2 else 4), start=1):
+        path = os.path.join(output_folder, f"doc_{number:03d}_rot{doc['rotation']}.jpg")
+        with open(path, "wb") as f:
+            f.write(doc["image"])
+        print(path, doc["expected"]["ruc_contribuyente"], doc["expected"]["exp_sigad"])
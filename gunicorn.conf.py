@@ -0,0 +1,32 @@
+# Modo produccion con gunicorn (Linux):
+#   gunicorn -c gunicorn.conf.py main:app
+# Mismo esquema que `python main.py --prod`: un hub del bus de eventos y un
+# JobQueue por worker, pero el HTTP lo sirve gunicorn (worker gthread).
+import main
+
+bind = f"0.0.0.0:{main.SERVER_PORT}"
+workers = main.PROD_WORKERS  # o `-w N` en la linea de comandos
+# Cada WebSocket (escritorio o celular) ocupa un hilo mientras esta abierto
+worker_class = "gthread"
+threads = 32
+# Subir un PDF grande y partirlo en paginas puede tardar
+timeout = 120
+graceful_timeout = 30
+# La app se importa en el proceso padre, el mismo modulo que usan los hooks
+preload_app = True
+
+runtime = None
+
+def on_starting(server):
+    # Antes de que gunicorn instale sus senales: el hub hereda las normales
+    global runtime
+    runtime = main.prepare_production(server.cfg.workers)
+
+def post_fork(server, worker):
+    main.start_worker_services(runtime)
+
+def worker_exit(server, worker):
+    main.job_queue.shutdown()
+
+def on_exit(server):
+    main.stop_production(runtime)
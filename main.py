@@ -1,25 +1,255 @@
 import os
 import re
 import socket
+import sqlite3
+import sys
 import logging
+import subprocess
+import tempfile
 import io
 import base64
-from typing import List, Dict
+import csv
+import hashlib
+import inspect
+import json
+import queue
+import shutil
+import signal
+import unicodedata
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+from typing import Callable, List, Dict, NamedTuple, Optional, Tuple
 
 import cv2
 import numpy as np
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, g, has_request_context
 from flask_sock import Sock
 from simple_websocket.ws import Server as WebSocketServer
 
 import qrcode
-from PIL import Image, ImageOps
+from PIL import Image
 import pytesseract
 
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    import fitz  # PyMuPDF, para recibir PDFs directamente
+except ImportError:
+    fitz = None
+
+try:
+    import openpyxl  # Exportacion XLSX del historial
+except ImportError:
+    openpyxl = None
+
 # --- Configuración de Logs ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+class RequestIdFilter(logging.Filter):
+    """Agrega el ID del request HTTP en curso a cada linea de log ('-' fuera de un request)."""
+    def filter(self, record):
+        record.request_id = getattr(g, "request_id", "-") if has_request_context() else "-"
+        return True
+
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(RequestIdFilter())
+
+# --- Metricas (formato de texto de Prometheus) ---
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS: list = []
+
+def _label_str(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _label_values(labelnames: Tuple[str, ...], labels: dict) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                 for name in labelnames)
+
+class Counter:
+    """Contador monotono con etiquetas."""
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help_text, self.labelnames = name, help_text, labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_values(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, snapshots: Optional[List[dict]] = None) -> List[str]:
+        """snapshots: valores de varios procesos a sumar (por defecto, los de este)."""
+        values: Dict[Tuple[str, ...], float] = {}
+        for snapshot in snapshots if snapshots is not None else [self.snapshot()]:
+            for key, value in snapshot.items():
+                values[key] = values.get(key, 0.0) + value
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value:g}")
+        return lines
+
+class Histogram:
+    """Histograma con buckets fijos (acumulativos al exportar, como espera Prometheus)."""
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=STAGE_BUCKETS):
+        self.name, self.help_text, self.labelnames = name, help_text, labelnames
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value: float, **labels):
+        key = _label_values(self.labelnames, labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def render(self, snapshots: Optional[List[dict]] = None) -> List[str]:
+        series: Dict[Tuple[str, ...], list] = {}
+        for snapshot in snapshots if snapshots is not None else [self.snapshot()]:
+            for key, (counts, total, count) in snapshot.items():
+                merged = series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {count}")
+        return lines
+
+class Gauge:
+    """Valor instantaneo leido al exportar (p.ej. clientes conectados)."""
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name, self.help_text, self.read = name, help_text, read
+        METRICS.append(self)
+
+    def snapshot(self) -> float:
+        return self.read()
+
+    def render(self, snapshots: Optional[List[float]] = None) -> List[str]:
+        value = sum(snapshots) if snapshots is not None else self.read()
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value:g}"]
+
+def metrics_snapshot() -> dict:
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+def render_metrics(snapshots: Optional[List[dict]] = None) -> str:
+    """snapshots: metricas de todos los workers (modo produccion) a sumar; sin ellas, las de este proceso."""
+    if snapshots is None:
+        return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+    return "\n".join(line for metric in METRICS
+                     for line in metric.render([s[metric.name] for s in snapshots if metric.name in s])) + "\n"
+
+SCAN_STAGE_SECONDS = Histogram("scan_stage_seconds", "Duracion de cada etapa del pipeline de escaneo", ("stage",))
+OCR_PASS_SECONDS = Histogram("scan_ocr_pass_seconds", "Duracion de cada pase de OCR por rotacion", ("rotation",))
+JOB_SECONDS = Histogram("scan_job_seconds", "Tiempo desde que se encola un trabajo hasta que termina")
+HTTP_SECONDS = Histogram("http_request_seconds", "Latencia de las rutas HTTP", ("endpoint", "method", "status"))
+SCAN_ROTATION_TOTAL = Counter("scan_rotation_total", "Rotacion ganadora de cada escaneo", ("rotation",))
+SCAN_RESOLVED_TOTAL = Counter("scan_resolved_total", "Como se resolvio cada escaneo", ("by",))
+SCAN_RESOLVED_LEVEL_TOTAL = Counter("scan_resolved_level_total",
+                                    "Escala de OCR_LADDER que completo los campos clave (incomplete: ninguna)", ("level",))
+SCAN_EARLY_EXIT_TOTAL = Counter("scan_early_exit_total", "Escaneos resueltos sin probar todas las rotaciones")
+SCAN_ERRORS_TOTAL = Counter("scan_errors_total", "Errores del pipeline por etapa", ("stage",))
+UPLOADS_TOTAL = Counter("scan_uploads_total", "Archivos recibidos por resultado", ("result",))
+QUALITY_REJECTS_TOTAL = Counter("scan_quality_rejects_total", "Fotos rechazadas por el control de calidad", ("issue",))
+WS_DROPPED_TOTAL = Counter("ws_dropped_clients_total", "Clientes WebSocket desconectados por lentos o caidos")
+
+class ScanTimings:
+    """
+    Tiempos de un escaneo medidos dentro del worker. Un proceso del
+    JobQueue atiende un escaneo a la vez: las etapas del hilo principal
+    usan la instancia del escaneo en curso. Los hilos de rotacion reciben
+    la instancia del escaneo que los lanzo (y escriben con lock), asi un
+    pase que termina tarde no se suma al escaneo siguiente.
+    """
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.ocr_passes: List[Tuple[int, float]] = []
+        self.events: Dict[str, object] = {"early_exit": False}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def add_pass(self, angle: int, seconds: float):
+        with self._lock:
+            self.ocr_passes.append((angle, seconds))
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"stages": dict(self.stages), "ocr_passes": list(self.ocr_passes), **self.events}
+
+_scan_timings = ScanTimings()
+
+def begin_scan_timings() -> ScanTimings:
+    global _scan_timings
+    _scan_timings = ScanTimings()
+    return _scan_timings
+
+def timed_stage(name: str):
+    return _scan_timings.stage(name)
+
+def observe_scan(result: dict):
+    """Vuelca en las metricas del proceso principal los tiempos que trajo el worker."""
+    timings = result.pop("timings", None)
+    if not timings:
+        return
+    for name, seconds in timings["stages"].items():
+        SCAN_STAGE_SECONDS.observe(seconds, stage=name)
+    for angle, seconds in timings["ocr_passes"]:
+        OCR_PASS_SECONDS.observe(seconds, rotation=angle)
+    SCAN_ROTATION_TOTAL.inc(rotation=result.get("rotation"))
+    SCAN_RESOLVED_TOTAL.inc(by=timings.get("resolved_by", "ocr"))
+    if timings.get("resolved_by") != "text_layer":
+        level = timings.get("resolved_level")
+        SCAN_RESOLVED_LEVEL_TOTAL.inc(level="incomplete" if level is None else f"{level:g}")
+    if timings.get("early_exit"):
+        SCAN_EARLY_EXIT_TOTAL.inc()
+    return timings
+
+
 # --- Configuración Flask Application ---
 app = Flask(__name__, static_folder='static', template_folder='templates')
 sock = Sock(app)
@@ -43,6 +273,190 @@ if tesseract_cmd:
 else:
     logger.warning("Tesseract NO encontrado. El OCR fallará.")
 
+OCR_LANG = "eng"
+OCR_OEM = 3
+OCR_PSM = 6
+OCR_POOL_SIZE = os.cpu_count() or 1
+TESSDATA_PATH = os.path.join(os.path.dirname(tesseract_cmd), "tessdata") if tesseract_cmd else None
+
+# --- Pool de Motores OCR ---
+class OCRCancelled(Exception):
+    """La lectura se cancelo porque otra rotacion ya dio un resultado confiable."""
+
+class OCREnginePool:
+    """
+    Motores Tesseract persistentes. Con tesserocr cada motor carga los
+    modelos de idioma una sola vez y recibe las imagenes en memoria.
+    Sin tesserocr se usa pytesseract (un proceso por llamada).
+    preload indica cuantos motores se crean al arrancar; el resto se crea
+    bajo demanda hasta size.
+    """
+    def __init__(self, size: int = OCR_POOL_SIZE, lang: str = OCR_LANG, preload: Optional[int] = None):
+        self.size = size
+        self.lang = lang
+        self._engines: "queue.Queue" = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        if tesserocr is not None:
+            preload = size if preload is None else min(preload, size)
+            for _ in range(preload):
+                self._engines.put(self._new_engine())
+            self._created = preload
+            logger.info(f"Pool OCR: {preload}/{size} motor(es) tesserocr ({lang})")
+        else:
+            logger.info("Pool OCR: tesserocr no instalado, se usa pytesseract")
+
+    def _new_engine(self):
+        # OEM y PSM de tesserocr son constantes enteras, no enums invocables
+        kwargs = {"lang": self.lang, "oem": OCR_OEM}
+        if TESSDATA_PATH:
+            kwargs["path"] = TESSDATA_PATH
+        return tesserocr.PyTessBaseAPI(**kwargs)
+
+    @property
+    def persistent(self) -> bool:
+        return tesserocr is not None
+
+    @contextmanager
+    def engine(self):
+        try:
+            api = self._engines.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            api = self._new_engine() if grow else self._engines.get()
+        try:
+            yield api
+        finally:
+            self._engines.put(api)
+
+    @staticmethod
+    def _set_image(api, image):
+        """Pasa la imagen al motor; los arrays van como bytes crudos, sin pasar por PIL."""
+        if isinstance(image, np.ndarray):
+            image = np.ascontiguousarray(image)
+            height, width = image.shape[:2]
+            depth = 1 if image.ndim == 2 else image.shape[2]
+            api.SetImageBytes(image.tobytes(), width, height, depth, image.strides[0])
+        else:
+            api.SetImage(image)
+
+    def image_to_string(self, image, psm: int = OCR_PSM, whitelist: Optional[str] = None,
+                        cancel: Optional[threading.Event] = None) -> str:
+        """
+        image: array de NumPy (escala de grises) o imagen PIL.
+        cancel: si se activa, la lectura pendiente se descarta. Sin tesserocr
+        el proceso tesseract en curso se mata.
+        """
+        if not self.persistent:
+            config = f'--oem {OCR_OEM} --psm {psm}'
+            if whitelist:
+                config += f' -c tessedit_char_whitelist={whitelist}'
+            return self._run_cli(image, config, cancel)
+        if cancel is not None and cancel.is_set():
+            raise OCRCancelled()
+        with self.engine() as api:
+            if cancel is not None and cancel.is_set():
+                raise OCRCancelled()
+            api.SetPageSegMode(psm)
+            api.SetVariable("tessedit_char_whitelist", whitelist or "")
+            self._set_image(api, image)
+            return api.GetUTF8Text()
+
+    def _run_cli(self, image, config: str, cancel: Optional[threading.Event] = None) -> str:
+        """tesseract como subproceso que se puede matar si cancel se activa."""
+        if cancel is not None and cancel.is_set():
+            raise OCRCancelled()
+        fd, image_path = tempfile.mkstemp(suffix=".png")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(image, np.ndarray):
+                    # Compresion minima: el archivo vive lo que dura la llamada
+                    f.write(cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes())
+                else:
+                    image.save(f, format="PNG")
+            cmd = [pytesseract.pytesseract.tesseract_cmd, image_path, "stdout", "-l", self.lang] + config.split()
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            while True:
+                try:
+                    out, err = proc.communicate(timeout=0.05)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel is not None and cancel.is_set():
+                        proc.kill()
+                        proc.wait()
+                        proc.stdout.close()
+                        proc.stderr.close()
+                        raise OCRCancelled()
+            if proc.returncode != 0:
+                raise RuntimeError(err.decode("utf-8", errors="replace").strip())
+            return out.decode("utf-8", errors="replace")
+        finally:
+            os.remove(image_path)
+
+    def image_to_words(self, image, psm: int = 11) -> List[dict]:
+        """Palabras con su caja: [{"text", "left", "top", "width", "height"}]."""
+        if not self.persistent:
+            d = pytesseract.image_to_data(
+                image, lang=self.lang, config=f'--oem {OCR_OEM} --psm {psm}',
+                output_type=pytesseract.Output.DICT
+            )
+            return [
+                {"text": d["text"][i], "left": d["left"][i], "top": d["top"][i],
+                 "width": d["width"][i], "height": d["height"][i]}
+                for i in range(len(d["text"])) if d["text"][i].strip()
+            ]
+        words = []
+        level = tesserocr.RIL.WORD
+        with self.engine() as api:
+            api.SetPageSegMode(psm)
+            api.SetVariable("tessedit_char_whitelist", "")
+            self._set_image(api, image)
+            api.Recognize()
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                text = word.GetUTF8Text(level)
+                box = word.BoundingBox(level)
+                if text and text.strip() and box:
+                    x1, y1, x2, y2 = box
+                    words.append({"text": text, "left": x1, "top": y1, "width": x2 - x1, "height": y2 - y1})
+        return words
+
+    def detect_orientation(self, image):
+        """
+        OSD. Devuelve (angulo de giro antihorario, confianza).
+        """
+        if not self.persistent:
+            osd = pytesseract.image_to_osd(image, config='--psm 0', output_type=pytesseract.Output.DICT)
+            # OSD indica la rotacion horaria necesaria; PIL rota en sentido antihorario
+            return (360 - int(osd.get("rotate", 0))) % 360, float(osd.get("orientation_conf", 0))
+        with self.engine() as api:
+            api.SetPageSegMode(tesserocr.PSM.OSD_ONLY)
+            self._set_image(api, image)
+            osd = api.DetectOrientationScript()
+            if not osd:
+                return 0, 0.0
+            # orient_deg ya es el giro antihorario que endereza la pagina
+            return int(osd["orient_deg"]) % 360, float(osd["orient_conf"])
+
+    def close(self):
+        while not self._engines.empty():
+            api = self._engines.get()
+            if hasattr(api, "End"):
+                api.End()
+
+_ocr_pool: Optional[OCREnginePool] = None
+_ocr_pool_lock = threading.Lock()
+
+def get_ocr_pool() -> OCREnginePool:
+    global _ocr_pool
+    if _ocr_pool is None:
+        with _ocr_pool_lock:
+            if _ocr_pool is None:
+                _ocr_pool = OCREnginePool()
+    return _ocr_pool
+
 # --- Funciones Auxiliares ---
 def get_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -55,20 +469,28 @@ def get_ip():
         s.close()
     return IP
 
+OCR_DIGIT_FIXES = {
+    'O': '0', 'o': '0', 'Q': '0', 'D': '0', 'C': '0',
+    'I': '1', 'l': '1', '|': '1', '!': '1', 'i': '1', 'L': '1',
+    'Z': '2', 'E': '3', 'A': '4', 'S': '5', '$': '5',
+    'G': '6', 'T': '7', 'B': '8', 'g': '9'
+}
+# Una sola tabla: corrige las letras confundidas y borra el resto del ASCII no numerico
+OCR_DIGIT_TABLE = str.maketrans({
+    **{chr(c): (chr(c) if chr(c).isdigit() else None) for c in range(128)},
+    **OCR_DIGIT_FIXES
+})
+NON_DIGIT_RE = re.compile(r'\D')
+# Solo corrige las letras confundidas; conserva espacios y separadores
+OCR_DIGIT_FIX_TABLE = str.maketrans(OCR_DIGIT_FIXES)
+
 def clean_ocr_number(text: str) -> str:
     """
     Corrige errores comunes de OCR en números (ej: 'O'->'0', 'l'->'1').
     """
-    replacements = {
-        'O': '0', 'o': '0', 'Q': '0', 'D': '0', 'C': '0',
-        'I': '1', 'l': '1', '|': '1', '!': '1', 'i': '1', 'L': '1',
-        'Z': '2', 'E': '3', 'A': '4', 'S': '5', '$': '5',
-        'G': '6', 'T': '7', 'B': '8', 'g': '9'
-    }
-    cleaned = text
-    for char, digit in replacements.items():
-        cleaned = cleaned.replace(char, digit)
-    return re.sub(r'\D', '', cleaned)
+    cleaned = text.translate(OCR_DIGIT_TABLE)
+    # Lo que queda fuera del ASCII (tildes, °, º...) se filtra aparte
+    return cleaned if cleaned.isascii() else NON_DIGIT_RE.sub('', cleaned)
 
 def validate_ruc(ruc: str) -> bool:
     """Valida RUC peruano usando algoritmo Modulo 11"""
@@ -86,17 +508,153 @@ def validate_ruc(ruc: str) -> bool:
     digito = 0 if complemento == 10 else (1 if complemento == 11 else complemento)
     return digito == int(ruc[10])
 
-def preprocess_image(pil_image):
+# --- Recorte de Documento ---
+DOC_DETECT_SIDE = 800
+DOC_MIN_AREA_RATIO = 0.2
+DOC_PAPER_SHORT_SIDE_IN = 8.27  # A4
+OCR_TARGET_DPI = 300
+# El movil reduce y recomprime antes de subir (ver mobile.html). Una foto ya
+# reducida a este lado largo no se vuelve a redimensionar en el servidor.
+MOBILE_UPLOAD_LONG_SIDE = 3000
+MOBILE_UPLOAD_JPEG_QUALITY = 0.85
+# Un JPEG mas grande que esto (lado corto) se decodifica directo a 1/2, 1/4
+# u 1/8 con el draft de PIL; el margen cubre el fondo alrededor de la hoja
+DECODE_DRAFT_MARGIN = 1.25
+EXIF_ORIENTATION_TAG = 0x0112
+
+# Orientacion EXIF -> operacion equivalente a ImageOps.exif_transpose
+EXIF_TRANSPOSE = {
+    2: lambda a: cv2.flip(a, 1),
+    3: lambda a: cv2.rotate(a, cv2.ROTATE_180),
+    4: lambda a: cv2.flip(a, 0),
+    5: cv2.transpose,
+    6: lambda a: cv2.rotate(a, cv2.ROTATE_90_CLOCKWISE),
+    7: lambda a: cv2.rotate(cv2.transpose(a), cv2.ROTATE_180),
+    8: lambda a: cv2.rotate(a, cv2.ROTATE_90_COUNTERCLOCKWISE),
+}
+# Giro antihorario (convencion de PIL.rotate) -> cv2.rotate, sin interpolar
+CV2_ROTATIONS = {90: cv2.ROTATE_90_COUNTERCLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_CLOCKWISE}
+
+def decode_image(image_bytes: bytes, prescaled: bool = False) -> Tuple[np.ndarray, int]:
     """
-    Preprocesamiento "Sweet Spot" (Solo Adaptive Threshold).
-    Sin redimensionado ni erosion agresiva.
+    Decodifica la foto a un array en escala de grises sin pasar por RGB.
+    Los JPEG se decodifican con el draft de PIL (solo luminancia y, si la
+    foto es mucho mas grande de lo necesario, a escala reducida en la DCT);
+    el resto con cv2.imdecode. Devuelve (array, orientacion EXIF).
     """
-    open_cv_image = np.array(pil_image) 
-    
-    if len(open_cv_image.shape) == 2:
-         img_gray = open_cv_image
+    header = Image.open(io.BytesIO(image_bytes))
+    try:
+        orientation = int(header.getexif().get(EXIF_ORIENTATION_TAG, 1))
+    except Exception:
+        orientation = 1
+
+    if header.format == "JPEG":
+        size = None
+        if not prescaled:
+            width, height = header.size
+            ratio = DOC_PAPER_SHORT_SIDE_IN * OCR_TARGET_DPI * DECODE_DRAFT_MARGIN / min(width, height)
+            if ratio < 1:
+                size = (int(width * ratio), int(height * ratio))
+        header.draft("L", size)
+        if header.mode != "L":
+            header = header.convert("L")
+        return np.asarray(header), orientation
+
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION)
+    if gray is None:
+        # Formatos que OpenCV no lee (GIF, etc.)
+        gray = np.asarray(header.convert("L"))
+    return gray, orientation
+
+def apply_exif_orientation(gray: np.ndarray, orientation: int) -> np.ndarray:
+    transpose = EXIF_TRANSPOSE.get(orientation)
+    return transpose(gray) if transpose is not None else gray
+
+def rotate_image(image: np.ndarray, angle: int) -> np.ndarray:
+    """Giro antihorario multiplo de 90 (como PIL.rotate(angle, expand=True))."""
+    return image if angle % 360 == 0 else cv2.rotate(image, CV2_ROTATIONS[angle % 360])
+
+def as_gray_array(image) -> np.ndarray:
+    """Acepta imagenes PIL o arrays (gris o RGB) y devuelve un array en grises."""
+    if isinstance(image, Image.Image):
+        return np.asarray(image if image.mode == "L" else image.convert("L"))
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return image
+
+def order_quad(pts: np.ndarray) -> np.ndarray:
+    """Ordena 4 puntos como: sup-izq, sup-der, inf-der, inf-izq."""
+    pts = pts.reshape(4, 2).astype(np.float32)
+    sums = pts.sum(axis=1)
+    diffs = np.diff(pts, axis=1).ravel()
+    return np.array([
+        pts[np.argmin(sums)], pts[np.argmin(diffs)],
+        pts[np.argmax(sums)], pts[np.argmax(diffs)]
+    ], dtype=np.float32)
+
+def find_document_quad(gray: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Busca el contorno cuadrilatero de la hoja en una copia reducida.
+    Devuelve las 4 esquinas en coordenadas de la imagen original o None.
+    """
+    h, w = gray.shape[:2]
+    scale = DOC_DETECT_SIDE / max(h, w)
+    if scale < 1:
+        small = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
     else:
-         img_gray = cv2.cvtColor(open_cv_image, cv2.COLOR_RGB2GRAY)
+        scale = 1.0
+        small = gray
+
+    edges = cv2.Canny(cv2.GaussianBlur(small, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = DOC_MIN_AREA_RATIO * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_quad(approx) / scale
+    return None
+
+def crop_document(image, rescale=True):
+    """
+    Recorta la hoja (corrigiendo perspectiva) y normaliza a OCR_TARGET_DPI
+    asumiendo papel A4. Solo reduce: nunca agranda la imagen.
+    Con rescale=False (foto ya reducida por el cliente) conserva la escala.
+    Devuelve un array en escala de grises.
+    """
+    gray = as_gray_array(image)
+    quad = find_document_quad(gray)
+
+    if quad is None:
+        if not rescale:
+            return gray
+        h, w = gray.shape[:2]
+        target_short = DOC_PAPER_SHORT_SIDE_IN * OCR_TARGET_DPI
+        scale = min(1.0, target_short / min(h, w))
+        if scale >= 1.0:
+            return gray
+        return cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+    tl, tr, br, bl = quad
+    width = max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))
+    height = max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))
+    # El warp escribe directo al tamano final (sin copia intermedia a resolucion completa)
+    scale = min(1.0, DOC_PAPER_SHORT_SIDE_IN * OCR_TARGET_DPI / min(width, height)) if rescale else 1.0
+    out_w, out_h = max(1, int(width * scale)), max(1, int(height * scale))
+
+    dst = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(quad, dst)
+    return cv2.warpPerspective(gray, matrix, (out_w, out_h), flags=cv2.INTER_LINEAR)
+
+def preprocess_image(image):
+    """
+    Preprocesamiento "Sweet Spot" (Solo Adaptive Threshold).
+    Sin redimensionado ni erosion agresiva. Recibe y devuelve arrays.
+    """
+    img_gray = as_gray_array(image)
 
     # Median Blur suave
     img_blur = cv2.medianBlur(img_gray, 3)
@@ -111,141 +669,1919 @@ def preprocess_image(pil_image):
         15  # Constant
     )
     # Sin erosion/dilatacion ni resizing
-    return Image.fromarray(img_thresh)
+    return img_thresh
 
-def to_base64_img(pil_img):
+def to_jpeg_bytes(image) -> bytes:
+    if isinstance(image, np.ndarray):
+        return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes()
     buffered = io.BytesIO()
-    pil_img.save(buffered, format="JPEG", quality=70)
-    return base64.b64encode(buffered.getvalue()).decode()
+    image.save(buffered, format="JPEG", quality=70)
+    return buffered.getvalue()
 
-def extract_data_from_text(text: str) -> Dict[str, str]:
-    data = {}
-    
-    text_clean = re.sub(r'  +', ' ', text)
-
-    # 1. EXPEDIENTE SIGAD (Se mantiene lógica mejorada)
-    exp_sigad_match = re.search(r'\b(\d{3}-[A-Z0-9]+-\d{4}-\d+-\d)\b', text)
-    if exp_sigad_match:
-        data["exp_sigad"] = exp_sigad_match.group(1)
-
-    # 2. RESOLUCIÓN COACTIVA
-    # Intento 1: Regex explicito
-    res_match = re.search(r'(?i)(?:RESOLUCI[ÓO]N|RES\.?)\s*(?:COACTIVA)?\s*(?:N[º°])?\s*([\dOIZSB]+)', text)
-    if res_match:
-        raw = clean_ocr_number(res_match.group(1))
-        if len(raw) >= 10: data["res_coactiva"] = raw
-    else:
-        # Intento 2: Buscar numero largo 133...
-        possibles = re.findall(r'\b(133\d{10})\b', clean_ocr_number(text))
-        if possibles: data["res_coactiva"] = possibles[0]
+def shrink_to(image: np.ndarray, max_side: int) -> np.ndarray:
+    """Copia reducida para que el lado mayor no pase de max_side (como PIL.thumbnail)."""
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
 
-    # 3. EXPEDIENTE RC
-    exp_rc_match = re.search(r'(?i)EXPEDIENTE\s+(?:N[ÚU]MERO|N[º°])\s*[:\.]?\s*([\dOIZSB]+)', text)
-    if exp_rc_match:
-        data["expediente_rc"] = clean_ocr_number(exp_rc_match.group(1))
+# --- Motor de Extraccion de Campos ---
+MESES = {
+    "enero": "01", "febrero": "02", "marzo": "03", "abril": "04",
+    "mayo": "05", "junio": "06", "julio": "07", "agosto": "08",
+    "septiembre": "09", "setiembre": "09", "octubre": "10",
+    "noviembre": "11", "diciembre": "12"
+}
 
-    # 4. RUCs (Lógica robusta)
-    all_numbers = re.findall(r'\b\d{11}\b', clean_ocr_number(text))
-    valid_rucs = []
+MULTI_SPACE_RE = re.compile(r'  +')
+DATE_RE = re.compile(r'\b(\d{1,2})[/-](\d{1,2})[/-](20\d{2})\b')
+DATE_TEXT_RE = re.compile(
+    r'(\d{1,2})\s+de\s+(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre)\s+del?\s+(20\d{2})',
+    re.IGNORECASE
+)
+RUC_RE = re.compile(r'\b\d{11}\b')
+LABEL_VALUE_RE = re.compile(r'[:\.]\s*(.*)')
+NAME_JUNK_RE = re.compile(r'[\d\s:-]+')
+
+class FieldRule(NamedTuple):
+    """Un patron para un campo; transform(match) devuelve el valor o None para descartarlo."""
+    pattern: "re.Pattern"
+    transform: Callable[["re.Match"], Optional[str]] = lambda m: m.group(1)
+    source: str = "text"  # "text" (OCR crudo) o "digits" (clean_ocr_number del texto)
+
+class FieldSpec(NamedTuple):
+    """
+    Campo resuelto por reglas en orden de prioridad. La primera regla cuyo
+    patron coincide decide el campo (aunque su transform lo descarte).
+    """
+    name: str
+    rules: Tuple[FieldRule, ...]
+
+class ExtractionContext:
+    """Versiones del texto que comparten todos los campos, calculadas una sola vez."""
+    def __init__(self, text: str):
+        self.text = text
+        self.digits = clean_ocr_number(text)
+        self.number_text = text.translate(OCR_DIGIT_FIX_TABLE)
+        self.lines = MULTI_SPACE_RE.sub(' ', text).split('\n')
+        self.upper_lines = [line.upper() for line in self.lines]
+        self.all_dates = DATE_RE.findall(text)
+
+def _res_coactiva(match) -> Optional[str]:
+    raw = clean_ocr_number(match.group(1))
+    return raw if len(raw) >= 10 else None
+
+def _extract_rucs(ctx: ExtractionContext, data: Dict[str, str]):
+    # Sobre el texto con separadores: en ctx.digits todo queda pegado y \b
+    # nunca delimita 11 digitos. Los de lineas con "RUC" van primero (otro
+    # numero de 11 digitos, como el expediente, tambien puede pasar el Modulo 11)
+    labeled, others = [], []
     seen = set()
-    for num in all_numbers:
-        if validate_ruc(num) and num not in seen:
-            valid_rucs.append(num)
-            seen.add(num)
-    
+    for line, upper in zip(ctx.number_text.split('\n'), ctx.upper_lines):
+        for num in RUC_RE.findall(line):
+            if validate_ruc(num) and num not in seen:
+                (labeled if "RUC" in upper else others).append(num)
+                seen.add(num)
+    valid_rucs = labeled if len(labeled) > 1 else labeled + others
+
     if valid_rucs:
         data["ruc_contribuyente"] = valid_rucs[0]
         if len(valid_rucs) > 1:
             data["ruc_tercero"] = valid_rucs[-1]
 
-    # 5. NOMBRE CONTRIBUYENTE
-    lines = text_clean.split('\n')
-    for i, line in enumerate(lines):
-        if "DEUDOR" in line.upper() or "CONTRIBUYENTE" in line.upper():
-             match = re.search(r'[:\.]\s*(.*)', line)
-             if match:
-                 val = match.group(1).strip()
-                 if len(val) > 4: data["nombre_contribuyente"] = val
-             elif i + 1 < len(lines):
-                 data["nombre_contribuyente"] = lines[i+1].strip()
-             break
-
-    # 6. NOMBRE TERCERO
-    for i, line in enumerate(lines):
-        if "USUARIO" in line.upper():
-             parts = line.split("RUC")
-             if len(parts) > 1:
-                 name = re.sub(r'[\d\s:-]+', ' ', parts[1]).strip()
-                 if len(name) > 4: data["nombre_tercero"] = name
-             elif i + 1 < len(lines):
-                 if "nombre_tercero" not in data:
-                     data["nombre_tercero"] = lines[i+1].strip()
+def _extract_names(ctx: ExtractionContext, data: Dict[str, str]):
+    """Campos anclados a etiquetas, en una sola pasada sobre las lineas."""
+    lines = ctx.lines
+    contribuyente = None
+    contribuyente_done = False
+    tercero = None
 
-    # 7. MONTO
-    monto_paren = re.search(r'\(\s*([\dOIZSB]{1,6}[\.,]\d{2})\s*\)', text)
-    if monto_paren:
-        data["monto"] = monto_paren.group(1).replace('O','0').replace('S','5')
-    
-    monto_soles = re.search(r'(?:S/|Soles)\.?\s*([\d\.,]+)', text)
-    if monto_soles and "monto" not in data:
-         data["monto"] = monto_soles.group(1)
+    for i, (line, upper) in enumerate(zip(lines, ctx.upper_lines)):
+        if not contribuyente_done and ("DEUDOR" in upper or "CONTRIBUYENTE" in upper):
+            contribuyente_done = True
+            match = LABEL_VALUE_RE.search(line)
+            if match:
+                val = match.group(1).strip()
+                if len(val) > 4: contribuyente = val
+            elif i + 1 < len(lines):
+                contribuyente = lines[i+1].strip()
 
-    # 8. FECHAS
-    all_dates = re.findall(r'\b(\d{1,2})[/-](\d{1,2})[/-](20\d{2})\b', text)
-    fecha_label_match = re.search(r'(?i)FECHA\s*[:\.]?[\s\n]*(\d{1,2}[/-]\d{1,2}[/-]20\d{2})', text)
-    if fecha_label_match:
-        data["fecha_recepcion"] = fecha_label_match.group(1).replace('-', '/')
-    elif all_dates:
-        d, m, y = all_dates[0]
-        data["fecha_recepcion"] = f"{d}/{m}/{y}"
-
-    meses_pattern = r'(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre)'
-    date_text_match = re.search(rf'(\d{{1,2}})\s+de\s+{meses_pattern}\s+del?\s+(20\d{{2}})', text, re.IGNORECASE)
-    if date_text_match:
-        d = date_text_match.group(1)
-        m_txt = date_text_match.group(2).lower()
-        y = date_text_match.group(3)
-        meses_map = {
-            "enero": "01", "febrero": "02", "marzo": "03", "abril": "04", 
-            "mayo": "05", "junio": "06", "julio": "07", "agosto": "08", 
-            "septiembre": "09", "setiembre": "09", "octubre": "10", 
-            "noviembre": "11", "diciembre": "12"
-        }
-        data["fecha_rc"] = f"{d.zfill(2)}/{meses_map[m_txt]}/{y}"
-    
-    if "fecha_rc" not in data and len(all_dates) > 1:
-         d, m, y = all_dates[1]
-         curr = f"{d}/{m}/{y}"
-         if curr != data.get("fecha_recepcion"):
-             data["fecha_rc"] = curr
+        if "USUARIO" in upper:
+            parts = line.split("RUC")
+            if len(parts) > 1:
+                name = NAME_JUNK_RE.sub(' ', parts[1]).strip()
+                if len(name) > 4: tercero = name
+            elif i + 1 < len(lines):
+                if tercero is None:
+                    tercero = lines[i+1].strip()
+
+    if contribuyente is not None:
+        data["nombre_contribuyente"] = contribuyente
+    if tercero is not None:
+        data["nombre_tercero"] = tercero
 
+def _extract_fecha_rc(ctx: ExtractionContext, data: Dict[str, str]):
+    match = DATE_TEXT_RE.search(ctx.text)
+    if match:
+        d, m_txt, y = match.groups()
+        data["fecha_rc"] = f"{d.zfill(2)}/{MESES[m_txt.lower()]}/{y}"
+    elif len(ctx.all_dates) > 1:
+        d, m, y = ctx.all_dates[1]
+        curr = f"{d}/{m}/{y}"
+        if curr != data.get("fecha_recepcion"):
+            data["fecha_rc"] = curr
+
+# Orden de la tabla = orden de los campos en el resultado
+EXTRACTION_PLAN = [
+    # 1. EXPEDIENTE SIGAD
+    FieldSpec("exp_sigad", (
+        FieldRule(re.compile(r'\b(\d{3}-[A-Z0-9]+-\d{4}-\d+-\d)\b')),
+    )),
+    # 2. RESOLUCIÓN COACTIVA: regex explicito, si no numero largo 133...
+    FieldSpec("res_coactiva", (
+        FieldRule(re.compile(r'(?i)(?:RESOLUCI[ÓO]N|RES\.?)\s*(?:COACTIVA)?\s*(?:N[º°])?\s*([\dOIZSB]+)'), _res_coactiva),
+        FieldRule(re.compile(r'\b(133\d{10})\b'), source="digits"),
+    )),
+    # 3. EXPEDIENTE RC
+    FieldSpec("expediente_rc", (
+        FieldRule(re.compile(r'(?i)EXPEDIENTE\s+(?:N[ÚU]MERO|N[º°])\s*[:\.]?\s*([\dOIZSB]+)'),
+                  lambda m: clean_ocr_number(m.group(1))),
+    )),
+    # 4. RUCs (Lógica robusta)
+    _extract_rucs,
+    # 5-6. NOMBRE CONTRIBUYENTE / NOMBRE TERCERO
+    _extract_names,
+    # 7. MONTO
+    FieldSpec("monto", (
+        FieldRule(re.compile(r'\(\s*([\dOIZSB]{1,6}[\.,]\d{2})\s*\)'),
+                  lambda m: m.group(1).replace('O', '0').replace('S', '5')),
+        FieldRule(re.compile(r'(?:S/|Soles)\.?\s*([\d\.,]+)')),
+    )),
+    # 8. FECHAS
+    FieldSpec("fecha_recepcion", (
+        FieldRule(re.compile(r'(?i)FECHA\s*[:\.]?[\s\n]*(\d{1,2}[/-]\d{1,2}[/-]20\d{2})'),
+                  lambda m: m.group(1).replace('-', '/')),
+        FieldRule(DATE_RE, lambda m: f"{m.group(1)}/{m.group(2)}/{m.group(3)}"),
+    )),
+    _extract_fecha_rc,
     # 9. CHEQUE / BOLETA
-    cheque_match = re.search(r'\b(\d{8}-\d)\b', text)
-    if cheque_match:
-        data["cheque_boleta"] = cheque_match.group(1)
+    FieldSpec("cheque_boleta", (
+        FieldRule(re.compile(r'\b(\d{8}-\d)\b')),
+    )),
+]
+
+def extract_data_from_text(text: str) -> Dict[str, str]:
+    ctx = ExtractionContext(text)
+    sources = {"text": ctx.text, "digits": ctx.digits}
+    data = {}
+
+    for step in EXTRACTION_PLAN:
+        if not isinstance(step, FieldSpec):
+            step(ctx, data)
+            continue
+        for rule in step.rules:
+            match = rule.pattern.search(sources[rule.source])
+            if match:
+                value = rule.transform(match)
+                if value is not None:
+                    data[step.name] = value
+                break
 
     return data
 
+# --- Orientación y OCR ---
+ROTATIONS = [0, 180, 270, 90]
+KEY_FIELDS = ("exp_sigad", "ruc_contribuyente")
+OSD_MIN_CONFIDENCE = 2.0
+OSD_MAX_SIDE = 1600
+
+def score_ocr_data(data: Dict[str, str]) -> int:
+    """Puntaje de una lectura: campos ancla pesan mas que el resto."""
+    score = 0
+    if "exp_sigad" in data: score += 5
+    if "ruc_contribuyente" in data: score += 4
+    if "res_coactiva" in data: score += 4
+    score += len(data)
+    return score
+
+def has_key_fields(data: Dict[str, str]) -> bool:
+    return all(field in data for field in KEY_FIELDS)
+
+def detect_orientation_osd(image):
+    """
+    Tesseract OSD (--psm 0). Devuelve el angulo de giro antihorario
+    (rotate_image) o None si la confianza es baja o OSD no esta disponible.
+    """
+    small = shrink_to(image, OSD_MAX_SIDE)
+    try:
+        angle, conf = get_ocr_pool().detect_orientation(small)
+    except Exception as e:
+        logger.info(f"OSD no disponible: {e}")
+        return None
+    if conf < OSD_MIN_CONFIDENCE:
+        return None
+    return angle
+
+def detect_text_axis(image) -> bool:
+    """
+    Perfil de proyeccion: True si las lineas de texto son horizontales.
+    Se "unta" la tinta a lo largo de cada eje para fundir letras en lineas;
+    el eje de las lineas es el que produce mas alternancias tinta/blanco
+    en su perfil (una por renglon), mientras el otro queda casi uniforme.
+    """
+    gray = as_gray_array(shrink_to(image, 1200))
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    def transitions(profile):
+        above = profile > profile.max() * 0.5
+        return int(np.count_nonzero(np.diff(above.astype(np.int8))))
+
+    # Fundir letras en palabras y luego untar a lo largo de cada eje
+    ink = cv2.dilate(ink, np.ones((5, 5), np.uint8))
+    smear_h = cv2.dilate(ink, np.ones((1, 81), np.uint8))
+    smear_v = cv2.dilate(ink, np.ones((81, 1), np.uint8))
+    return transitions(smear_h.sum(axis=1)) >= transitions(smear_v.sum(axis=0))
+
+def orientation_candidates(image) -> Tuple[List[int], bool]:
+    """
+    Ordena ROTATIONS poniendo primero el angulo mas probable.
+    El segundo valor indica si OSD fue concluyente.
+    """
+    angle = detect_orientation_osd(image)
+    if angle is not None:
+        return [angle] + [a for a in ROTATIONS if a != angle], True
+    if detect_text_axis(image):
+        return [0, 180, 270, 90], False
+    return [90, 270, 0, 180], False
+
+ROTATION_WORKERS = min(len(ROTATIONS), OCR_POOL_SIZE)
+# Hilos del executor de rotaciones en este proceso (_init_ocr_worker lo ajusta)
+_rotation_threads = ROTATION_WORKERS
+_rotation_executor: Optional[ThreadPoolExecutor] = None
+# Escaneos en curso en todos los procesos OCR (multiprocessing.Value que
+# reparte el JobQueue); None fuera de ellos
+_busy_scans = None
+
+def rotation_threads_for(busy_scans: int) -> int:
+    """Rotaciones en paralelo por escaneo: los nucleos repartidos entre los escaneos en curso."""
+    return max(1, min(len(ROTATIONS), (os.cpu_count() or 1) // max(1, busy_scans)))
+
+def race_width() -> int:
+    """
+    Cuantas rotaciones compiten a la vez en este escaneo. Con la cola vacia
+    una pagina usa los nucleos libres (una rotacion por nucleo); con todos
+    los procesos ocupados se prueban en orden, sin sobresuscribir la CPU.
+    """
+    if _busy_scans is None:
+        return _rotation_threads
+    return rotation_threads_for(_busy_scans.value)
+
+def new_busy_counter():
+    """Contador de escaneos en curso compartido por los procesos OCR (y los workers de --prod)."""
+    return multiprocessing.Value("i", 0)
+
+def _run_counted(fn, *args):
+    """Corre un escaneo en un proceso OCR contandolo en _busy_scans (ver race_width)."""
+    if _busy_scans is None:
+        return fn(*args)
+    with _busy_scans.get_lock():
+        _busy_scans.value += 1
+    try:
+        return fn(*args)
+    finally:
+        with _busy_scans.get_lock():
+            _busy_scans.value -= 1
+
+def get_rotation_executor() -> ThreadPoolExecutor:
+    global _rotation_executor
+    if _rotation_executor is None:
+        with _ocr_pool_lock:
+            if _rotation_executor is None:
+                _rotation_executor = ThreadPoolExecutor(max_workers=_rotation_threads, thread_name_prefix="rotacion")
+    return _rotation_executor
+
+def is_confident(data: Dict[str, str]) -> bool:
+    return has_key_fields(data) or score_ocr_data(data) >= 15
+
+def _ocr_at_angle(processed_image, angle: int, cancel: Optional[threading.Event] = None,
+                  timings: Optional[ScanTimings] = None):
+    if timings is None:
+        timings = _scan_timings
+    start = time.perf_counter()
+    img_to_process = rotate_image(processed_image, angle)
+    text = get_ocr_pool().image_to_string(img_to_process, cancel=cancel)
+    timings.add_pass(angle, time.perf_counter() - start)
+    with timings.stage("extract_data_from_text"):
+        return text, extract_data_from_text(text)
+
+def race_rotations(processed_image, angles: List[int]):
+    """
+    Lanza las rotaciones en paralelo, puntua cada una al terminar y cancela
+    las demas en cuanto una es confiable (las que no empezaron no corren;
+    sin tesserocr los procesos tesseract en curso se matan).
+    Devuelve (datos, texto, angulo, score).
+    """
+    best = ({}, "", angles[0], -1)
+    cancel = threading.Event()
+    timings = _scan_timings
+    executor = get_rotation_executor()
+    width = race_width()
+    waiting = list(angles)
+    futures: Dict = {}
+    running = set()
+    try:
+        # Ventana de `width` rotaciones: cada una que termina sin resultado
+        # confiable deja lugar a la siguiente del orden de candidatos
+        while waiting or running:
+            while waiting and len(running) < width:
+                angle = waiting.pop(0)
+                future = executor.submit(_ocr_at_angle, processed_image, angle, cancel, timings)
+                futures[future] = angle
+                running.add(future)
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            confident = False
+            for future in done:
+                angle = futures[future]
+                try:
+                    text, data = future.result()
+                except OCRCancelled:
+                    continue
+                score = score_ocr_data(data)
+                logger.info(f"Rotación {angle}° - Score: {score} - Datos: {data}")
+                if score > best[3]:
+                    best = (data, text, angle, score)
+                confident = confident or is_confident(data)
+            if confident:
+                timings.events["early_exit"] = bool(waiting or running)
+                break
+    finally:
+        cancel.set()
+        for future in futures:
+            future.cancel()
+    return best
+
+def ocr_best_rotation(processed_image, candidates: Optional[List[int]] = None, osd_confident: bool = False,
+                      first: Optional[Tuple[str, Dict[str, str]]] = None):
+    """
+    Si OSD fue concluyente se hace OCR una sola vez en ese angulo. Si falta
+    algun campo clave (KEY_FIELDS), o si la orientacion es dudosa, las
+    rotaciones restantes compiten en paralelo. first: (texto, datos) ya
+    leidos en candidates[0] (pase de anclas); ese angulo no se repite.
+    Devuelve (datos, texto_crudo, angulo).
+    """
+    if candidates is None:
+        candidates, osd_confident = orientation_candidates(processed_image)
+
+    best = ({}, "", candidates[0], -1)
+    remaining = candidates
+    if osd_confident or first is not None:
+        text, data = first if first is not None else _ocr_at_angle(processed_image, candidates[0])
+        score = score_ocr_data(data)
+        logger.info(f"Rotación {candidates[0]}° - Score: {score} - Datos: {data}")
+        best = (data, text, candidates[0], score)
+        if is_confident(data):
+            _scan_timings.events["early_exit"] = len(candidates) > 1
+            return data, text, candidates[0]
+        remaining = candidates[1:]
+
+    if remaining:
+        raced = race_rotations(processed_image, remaining)
+        if raced[3] > best[3]:
+            best = raced
+    best_data, best_text, best_angle, _ = best
+    return best_data, best_text, best_angle
+
+# --- Cascada de Resoluciones ---
+# Escalas sobre la hoja a OCR_TARGET_DPI, de gruesa a fina. Se sube de nivel
+# solo si falta o no valida algun campo de LADDER_FIELDS que tenga ese tipo
+# de pagina (ZoneReading.ladder_fields); OCR_LADDER=1 deja una sola pasada a
+# resolucion completa.
+DEFAULT_OCR_LADDER = (0.5, 1.0)
+
+def parse_ocr_ladder(value: str) -> Tuple[float, ...]:
+    """
+    Escalas de OCR_LADDER ordenadas. Los valores invalidos se ignoran; si
+    no queda ninguno se usa DEFAULT_OCR_LADDER y si el ultimo nivel no
+    llega a resolucion completa se agrega 1: ninguna pagina queda sin OCR.
+    """
+    scales = set()
+    for item in value.split(","):
+        try:
+            scale = float(item)
+        except ValueError:
+            scale = 0.0
+        if scale > 0:
+            scales.add(scale)
+        elif item.strip():
+            logger.warning(f"OCR_LADDER: escala invalida {item.strip()!r}, se ignora")
+    if not scales:
+        logger.warning(f"OCR_LADDER sin escalas validas, se usa {','.join(f'{s:g}' for s in DEFAULT_OCR_LADDER)}")
+        return DEFAULT_OCR_LADDER
+    if max(scales) < 1:
+        scales.add(1.0)
+    return tuple(sorted(scales))
+
+OCR_LADDER = parse_ocr_ladder(os.environ.get("OCR_LADDER", "0.5,1"))
+LADDER_FIELDS = ("exp_sigad", "ruc_contribuyente", "res_coactiva")
+RUC_FIELDS = ("ruc_contribuyente", "ruc_tercero")
+
+def scale_image(image: np.ndarray, scale: float) -> np.ndarray:
+    if scale == 1:
+        return image
+    h, w = image.shape[:2]
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=interpolation)
+
+def field_is_valid(field: str, value: Optional[str]) -> bool:
+    if not value:
+        return False
+    if field in RUC_FIELDS:
+        return validate_ruc(value)
+    return True
+
+def missing_fields(data: Dict[str, str], fields: Tuple[str, ...] = LADDER_FIELDS) -> List[str]:
+    return [field for field in fields if not field_is_valid(field, data.get(field))]
+
+def merge_fields(coarse: Dict[str, str], fine: Dict[str, str]) -> Dict[str, str]:
+    """La lectura mas fina manda, salvo que su valor no valide y el anterior si."""
+    merged = dict(coarse)
+    for field, value in fine.items():
+        if field_is_valid(field, value) or not field_is_valid(field, merged.get(field)):
+            merged[field] = value
+    return merged
+
+def ocr_ladder(processed_image, candidates: List[int], osd_confident: bool = False,
+               anchor_text: Optional[str] = None, fields: Tuple[str, ...] = KEY_FIELDS):
+    """
+    OCR de pagina completa de grueso a fino. El primer nivel compite entre
+    rotaciones (ocr_best_rotation); los siguientes solo corren si falta
+    alguno de `fields` y, con la orientacion ya conocida, en un unico pase
+    en ese angulo.
+    anchor_text: lectura del pase de anclas (candidates[0] a
+    LAYOUT_ANCHOR_SCALE), que sustituye el OCR de ese angulo en ese nivel
+    solo si se leyo con el mismo psm que el OCR de pagina (OCR_PSM).
+    Devuelve (datos, texto, angulo, escala que resolvio o None).
+    """
+    data, text, angle = {}, "", candidates[0]
+    angle_known = False
+    for scale in OCR_LADDER:
+        image = scale_image(processed_image, scale)
+        with timed_stage(f"ocr_level_{scale:g}"):
+            if angle_known:
+                level_text, level_data = _ocr_at_angle(image, angle)
+            else:
+                first = None
+                if anchor_text is not None and scale == LAYOUT_ANCHOR_SCALE and LAYOUT_ANCHOR_PSM == OCR_PSM:
+                    _scan_timings.events["anchor_reused"] = True
+                    with timed_stage("extract_data_from_text"):
+                        first = (anchor_text, extract_data_from_text(anchor_text))
+                level_data, level_text, angle = ocr_best_rotation(image, candidates, osd_confident, first)
+                # Si no se reconocio nada la orientacion sigue en duda
+                angle_known = osd_confident or score_ocr_data(level_data) > 0
+                candidates = [angle] + [a for a in candidates if a != angle]
+        data = merge_fields(data, level_data)
+        text = level_text or text
+        missing = missing_fields(data, fields)
+        if not missing:
+            return data, text, angle, scale
+        logger.info(f"Escala {scale:g}: faltan {missing}")
+    return data, text, angle, None
+
+# --- Plantillas de Zonas (OCR por region) ---
+LAYOUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts")
+LAYOUT_ANCHOR_SCALE = 0.5
+# Texto disperso: encuentra las anclas sueltas por toda la hoja
+LAYOUT_ANCHOR_PSM = 11
+LAYOUT_ANCHOR_MAX_SHIFT = 0.15
+
+class LayoutZone(NamedTuple):
+    name: str
+    box: Tuple[float, float, float, float]  # x0, y0, x1, y1 en fracciones de la pagina
+    psm: int
+    whitelist: Optional[str]
+    pattern: "re.Pattern"
+    validate: Optional[str]
+    strip_spaces: bool
+
+class Layout(NamedTuple):
+    name: str
+    anchors: List[dict]
+    min_anchors: int
+    zones: List[LayoutZone]
+    source: str
+
+def load_layouts(directory: str = LAYOUT_DIR) -> List[Layout]:
+    """Carga las plantillas layouts/*.json (una por tipo de documento)."""
+    layouts = []
+    if not os.path.isdir(directory):
+        return layouts
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                source = f.read()
+            spec = json.loads(source)
+            zones = [
+                LayoutZone(
+                    name=name,
+                    box=tuple(zone["box"]),
+                    psm=zone.get("psm", 7),
+                    whitelist=zone.get("whitelist"),
+                    pattern=re.compile(zone.get("pattern", r".+")),
+                    validate=zone.get("validate"),
+                    strip_spaces=zone.get("strip_spaces", True)
+                )
+                for name, zone in spec["fields"].items()
+            ]
+            if not spec.get("enabled", True):
+                # Plantilla de ejemplo o sin calibrar: no se usa hasta activarla
+                logger.info(f"Plantilla {filename} desactivada (\"enabled\": false)")
+                continue
+            layouts.append(Layout(spec["name"], spec["anchors"], spec.get("min_anchors", 2), zones, source))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Plantilla invalida {filename}: {e}")
+    return layouts
+
+LAYOUTS = load_layouts()
+
+def normalize_word(text: str) -> str:
+    """Mayusculas sin tildes ni signos, para comparar anclas."""
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if c.isalnum()).upper()
+
+def locate_layout(words: List[dict], width: int, height: int):
+    """
+    Busca las anclas de cada plantilla entre las palabras del primer pase.
+    Devuelve (plantilla, dx, dy) con el desplazamiento mediano en fracciones
+    de pagina, o None si ninguna plantilla alcanza min_anchors.
+    """
+    index: Dict[str, List[dict]] = {}
+    for word in words:
+        index.setdefault(normalize_word(word["text"]), []).append(word)
+
+    best = None
+    for layout in LAYOUTS:
+        shifts = []
+        for anchor in layout.anchors:
+            ax, ay = anchor["at"]
+            hits = index.get(normalize_word(anchor["text"]), [])
+            centers = [
+                ((w["left"] + w["width"] / 2) / width, (w["top"] + w["height"] / 2) / height)
+                for w in hits
+            ]
+            if not centers:
+                continue
+            cx, cy = min(centers, key=lambda c: (c[0] - ax) ** 2 + (c[1] - ay) ** 2)
+            if abs(cx - ax) <= LAYOUT_ANCHOR_MAX_SHIFT and abs(cy - ay) <= LAYOUT_ANCHOR_MAX_SHIFT:
+                shifts.append((cx - ax, cy - ay))
+        if len(shifts) >= layout.min_anchors and (best is None or len(shifts) > best[1]):
+            best = (layout, len(shifts), float(np.median([s[0] for s in shifts])), float(np.median([s[1] for s in shifts])))
+
+    if best is None:
+        return None
+    layout, _, dx, dy = best
+    return layout, dx, dy
+
+class ZoneReading(NamedTuple):
+    """Resultado del OCR por zonas."""
+    data: Dict[str, str]
+    layout: Optional[str] = None
+    # Campos leidos que no pasaron una validacion propia (texto libre, formato dudoso)
+    unverified: Tuple[str, ...] = ()
+    # Texto del pase de anclas (LAYOUT_ANCHOR_SCALE, angulo pedido) para reusarlo en ocr_ladder
+    anchor_text: Optional[str] = None
+    # Campos que define la plantilla encontrada
+    fields: Tuple[str, ...] = ()
+
+    @property
+    def resolves_page(self) -> bool:
+        """Basta sin OCR de pagina completa: campos clave presentes y todo validado."""
+        return has_key_fields(self.data) and not self.unverified
+
+    @property
+    def ladder_fields(self) -> Tuple[str, ...]:
+        """
+        Campos que justifican subir de escala en ocr_ladder: los de
+        LADDER_FIELDS que tiene la plantilla o, sin plantilla, KEY_FIELDS.
+        Una pagina que no es una resolucion coactiva no escala buscando una.
+        """
+        return tuple(field for field in LADDER_FIELDS if field in self.fields) or KEY_FIELDS
+
+def is_valid_date(value: str) -> bool:
+    try:
+        time.strptime(value, "%d/%m/%Y")
+        return True
+    except ValueError:
+        return False
+
+def parse_zone_value(text: str, zone: LayoutZone) -> Tuple[Optional[str], bool]:
+    """
+    Valor de la region y si quedo validado. validate: "ruc" (Modulo 11),
+    "date" (fecha real) o "format" (la region entera es el valor, sin texto
+    de mas). Sin validate el valor se usa pero no se da por verificado.
+    """
+    text = re.sub(r'\s+', '' if zone.strip_spaces else ' ', text).strip()
+    match = zone.pattern.search(text)
+    if not match:
+        return None, False
+    value = match.group(0)
+    if zone.validate == "ruc":
+        return (value, True) if validate_ruc(value) else (None, False)
+    if zone.validate == "date":
+        return (value, True) if is_valid_date(value) else (None, False)
+    return value, zone.validate == "format" and value == text
+
+def words_to_text(words: List[dict]) -> str:
+    """Palabras sueltas (LAYOUT_ANCHOR_PSM) reagrupadas en lineas de arriba a abajo y de izquierda a derecha."""
+    lines: List[List[dict]] = []
+    for word in sorted(words, key=lambda w: w["top"] + w["height"] / 2):
+        center = word["top"] + word["height"] / 2
+        last = lines[-1][-1] if lines else None
+        if last is not None and abs(center - (last["top"] + last["height"] / 2)) <= max(word["height"], last["height"]) / 2:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return "\n".join(" ".join(w["text"] for w in sorted(line, key=lambda w: w["left"])) for line in lines)
+
+def read_layout_zones(processed_image, angle: int) -> ZoneReading:
+    """
+    OCR por zonas: un primer pase rapido a baja resolucion ubica las anclas
+    de la plantilla y luego cada region se lee por separado con su psm y
+    whitelist. Sin plantillas activas no se hace ningun OCR.
+    """
+    if not LAYOUTS:
+        return ZoneReading({})
+
+    upright = rotate_image(processed_image, angle)
+    height, width = upright.shape[:2]
+    small = cv2.resize(upright, (max(1, int(width * LAYOUT_ANCHOR_SCALE)), max(1, int(height * LAYOUT_ANCHOR_SCALE))),
+                       interpolation=cv2.INTER_AREA)
+
+    pool = get_ocr_pool()
+    try:
+        words = pool.image_to_words(small, psm=LAYOUT_ANCHOR_PSM)
+    except Exception as e:
+        logger.error(f"Error en el pase de anclas: {e}")
+        return ZoneReading({})
+    anchor_text = words_to_text(words)
+    located = locate_layout(words, small.shape[1], small.shape[0])
+    if located is None:
+        return ZoneReading({}, anchor_text=anchor_text)
+    layout, dx, dy = located
+
+    data = {}
+    unverified = []
+    levels = []
+    for zone in layout.zones:
+        x0, y0, x1, y1 = zone.box
+        left, right = max(0.0, x0 + dx), min(1.0, x1 + dx)
+        top, bottom = max(0.0, y0 + dy), min(1.0, y1 + dy)
+        if right <= left or bottom <= top:
+            continue
+        # Vista del array, sin copiar la region
+        crop = upright[int(top * height):int(bottom * height), int(left * width):int(right * width)]
+        # Cascada por region: solo las zonas que no se leyeron pasan a la escala siguiente
+        for scale in OCR_LADDER:
+            text = pool.image_to_string(scale_image(crop, scale), psm=zone.psm, whitelist=zone.whitelist)
+            value, verified = parse_zone_value(text, zone)
+            if value:
+                data[zone.name] = value
+                if not verified:
+                    unverified.append(zone.name)
+                levels.append(scale)
+                break
+
+    logger.info(f"Plantilla {layout.name} - Zonas: {data} - Sin validar: {unverified}")
+    if levels:
+        _scan_timings.events["zones_level"] = max(levels)
+    return ZoneReading(data, layout.name, tuple(unverified), anchor_text,
+                       tuple(zone.name for zone in layout.zones))
+
+# --- Control de Calidad de la Foto ---
+# Se mide sobre una copia reducida (draft de PIL) antes de encolar: una foto
+# ilegible se rechaza en milisegundos sin ocupar un worker de OCR.
+# Umbrales configurables por variables de entorno; QUALITY_CHECK=0 lo desactiva.
+QUALITY_CHECK_ENABLED = os.environ.get("QUALITY_CHECK", "1") != "0"
+QUALITY_CHECK_SIDE = 800
+QUALITY_TILE = 32
+QUALITY_TILE_EDGE_DENSITY = 0.04
+# Varianza del Laplaciano en las zonas con texto (enfoque)
+QUALITY_MIN_SHARPNESS = float(os.environ.get("QUALITY_MIN_SHARPNESS", 100))
+# Brillo medio minimo (0-255)
+QUALITY_MIN_BRIGHTNESS = float(os.environ.get("QUALITY_MIN_BRIGHTNESS", 40))
+# Fraccion de pixeles quemados (>= QUALITY_CLIP_LEVEL) a partir de la cual la
+# falta de contraste se atribuye a la sobreexposicion. El papel blanco de un
+# PDF o escaner esta todo en 255 y no es un problema si la tinta se ve.
+QUALITY_CLIP_LEVEL = 250
+QUALITY_MAX_CLIPPED = float(os.environ.get("QUALITY_MAX_CLIPPED", 0.25))
+# Diferencia entre la tinta y el papel (medias de las clases de Otsu en las celdas con texto)
+QUALITY_MIN_CONTRAST = float(os.environ.get("QUALITY_MIN_CONTRAST", 40))
+# Fraccion de celdas con bordes de texto
+QUALITY_MIN_TEXT_DENSITY = float(os.environ.get("QUALITY_MIN_TEXT_DENSITY", 0.01))
+
+QUALITY_MESSAGES = {
+    "blurry": "La foto está movida o desenfocada.",
+    "dark": "La foto está muy oscura.",
+    "overexposed": "La foto tiene demasiada luz o reflejos.",
+    "low_contrast": "El texto casi no se distingue del fondo.",
+    "no_text": "No se encontró texto en la foto.",
+}
+
+def quality_preview(image_bytes: bytes) -> np.ndarray:
+    """Copia en grises de QUALITY_CHECK_SIDE de lado mayor; los JPEG se decodifican ya reducidos."""
+    header = Image.open(io.BytesIO(image_bytes))
+    if header.format == "JPEG":
+        header.draft("L", (QUALITY_CHECK_SIDE, QUALITY_CHECK_SIDE))
+        gray = as_gray_array(header)
+    else:
+        gray, _ = decode_image(image_bytes)
+    return shrink_to(gray, QUALITY_CHECK_SIDE)
+
+def check_image_quality(image_bytes: bytes) -> dict:
+    """
+    Enfoque, exposicion, contraste y densidad de texto de la foto.
+    Devuelve {"ok", "issues": [codigos de QUALITY_MESSAGES], "metrics"}.
+    """
+    gray = quality_preview(image_bytes)
+    brightness = float(gray.mean())
+    clipped = float((gray >= QUALITY_CLIP_LEVEL).mean())
+
+    # Celdas con texto: densidad de bordes de Canny por celda
+    tile = QUALITY_TILE
+    rows, cols = gray.shape[0] // tile, gray.shape[1] // tile
+    edges = cv2.Canny(gray, 60, 180)[:rows * tile, :cols * tile]
+    density = edges.reshape(rows, tile, cols, tile).mean(axis=(1, 3)) / 255
+    text_tiles = density > QUALITY_TILE_EDGE_DENSITY
+    text_density = float(text_tiles.mean()) if text_tiles.size else 0.0
+
+    # Enfoque y contraste medidos solo donde hay texto: el papel liso (o la
+    # mesa alrededor de la hoja) no dice nada
+    sharpness = 0.0
+    contrast = 0
+    if text_tiles.any():
+        laplacian = cv2.Laplacian(gray, cv2.CV_32F)[:rows * tile, :cols * tile]
+        sharpness = float(laplacian.reshape(rows, tile, cols, tile).transpose(0, 2, 1, 3)[text_tiles].var())
+        # Tinta vs papel: Otsu separa las dos clases y se comparan sus medias
+        pixels = gray[:rows * tile, :cols * tile].reshape(rows, tile, cols, tile).transpose(0, 2, 1, 3)[text_tiles]
+        pixels = pixels.reshape(1, -1)
+        threshold, _ = cv2.threshold(pixels, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        ink, paper = pixels[pixels <= threshold], pixels[pixels > threshold]
+        if ink.size and paper.size:
+            contrast = int(round(float(paper.mean()) - float(ink.mean())))
+
+    issues = []
+    if text_density < QUALITY_MIN_TEXT_DENSITY:
+        issues.append("no_text")
+    elif sharpness < QUALITY_MIN_SHARPNESS:
+        issues.append("blurry")
+    if brightness < QUALITY_MIN_BRIGHTNESS:
+        issues.append("dark")
+    elif clipped > QUALITY_MAX_CLIPPED and contrast < QUALITY_MIN_CONTRAST:
+        # Mucho blanco quemado y la tinta no se distingue: la luz se comio el texto
+        issues.append("overexposed")
+    if contrast < QUALITY_MIN_CONTRAST and "no_text" not in issues:
+        issues.append("low_contrast")
+    # Sin texto por culpa de la exposicion: se informa la causa primero
+    if "no_text" in issues and ("dark" in issues or "overexposed" in issues):
+        issues.remove("no_text")
+        issues.append("no_text")
+
+    return {
+        "ok": not issues,
+        "issues": issues,
+        "metrics": {"sharpness": round(sharpness, 1), "brightness": round(brightness, 1),
+                    "clipped": round(clipped, 3), "contrast": contrast, "text_density": round(text_density, 3)},
+    }
+
+def quality_gate(image_bytes: bytes) -> Optional[dict]:
+    """
+    None si la foto pasa el control; si no, la respuesta "retake" para el
+    movil. Un error midiendo nunca bloquea la subida.
+    """
+    if not QUALITY_CHECK_ENABLED:
+        return None
+    start = time.perf_counter()
+    try:
+        report = check_image_quality(image_bytes)
+    except Exception as e:
+        logger.error(f"Error en el control de calidad: {e}")
+        return None
+    finally:
+        SCAN_STAGE_SECONDS.observe(time.perf_counter() - start, stage="quality_check")
+    if report["ok"]:
+        return None
+    for issue in report["issues"]:
+        QUALITY_REJECTS_TOTAL.inc(issue=issue)
+    logger.info(f"Foto rechazada por calidad: {report['issues']} {report['metrics']}")
+    return {
+        "status": "retake",
+        "message": QUALITY_MESSAGES[report["issues"][0]] + " Vuelve a tomarla.",
+        "issues": report["issues"],
+        "metrics": report["metrics"],
+    }
+
+# --- Pipeline de Escaneo ---
+SCAN_FIELDS = [
+    "exp_sigad", "fecha_recepcion", "ruc_contribuyente", "nombre_contribuyente",
+    "res_coactiva", "fecha_rc", "expediente_rc", "monto",
+    "ruc_tercero", "nombre_tercero", "cheque_boleta"
+]
+
+def process_scan(image_bytes: bytes, prescaled: bool = False) -> dict:
+    """
+    Pipeline completo de una foto: decode, preprocesado, OCR y extraccion.
+    Corre dentro de los procesos del JobQueue. prescaled indica que el
+    cliente ya redujo la foto y no hace falta normalizar la resolucion.
+    """
+    timings = begin_scan_timings()
+    with timed_stage("decode"):
+        gray, orientation = decode_image(image_bytes, prescaled)
+
+    with timed_stage("exif_transpose"):
+        image = apply_exif_orientation(gray, orientation)
+
+    # 1. Recorte de la hoja
+    with timed_stage("crop_document"):
+        document = crop_document(image, rescale=not prescaled)
+    result = scan_document(document)
+    result["timings"] = timings.as_dict()
+    return result
+
+def scan_document(document) -> dict:
+    """
+    Preprocesado, OCR y extraccion de una hoja ya recortada y a la
+    resolucion de OCR (fotos recortadas o paginas de PDF renderizadas).
+    """
+    # Preprocesamiento SIMPLE (El que funcionaba bien)
+    with timed_stage("preprocess_image"):
+        processed_image = preprocess_image(document)
+    
+    with timed_stage("jpeg_encode"):
+        img_jpeg = to_jpeg_bytes(processed_image)
+
+    # 2. OCR por zonas si la pagina coincide con una plantilla
+    with timed_stage("orientation"):
+        candidates, osd_confident = orientation_candidates(processed_image)
+    with timed_stage("layout_zones"):
+        zones = read_layout_zones(processed_image, candidates[0])
+    zone_data = zones.data
+
+    # Solo se omite el OCR de pagina completa si cada campo de las zonas valido
+    if zones.resolves_page:
+        _scan_timings.events["resolved_by"] = "layout"
+        _scan_timings.events["resolved_level"] = _scan_timings.events.get("zones_level")
+        best_data, angle = zone_data, candidates[0]
+        best_text = f"[Rotación {angle}° - Plantilla {zones.layout}]\n" + "\n".join(f"{k}: {v}" for k, v in zone_data.items())
+    else:
+        # 3. OCR de pagina completa, de baja a alta resolucion (rotaciones
+        #    extra y escalas mayores solo si faltan campos clave)
+        _scan_timings.events["resolved_by"] = "ocr"
+        with timed_stage("ocr_ladder"):
+            best_data, text, angle, level = ocr_ladder(processed_image, candidates, osd_confident,
+                                                       zones.anchor_text, zones.ladder_fields)
+        _scan_timings.events["resolved_level"] = level
+        for field, value in zone_data.items():
+            best_data.setdefault(field, value)
+        best_text = f"[Rotación {angle}°]\n" + text
+
+    final_data = {field: best_data.get(field, "") for field in SCAN_FIELDS}
+
+    return {
+        "data": final_data,
+        "raw_text": best_text,
+        "rotation": angle,
+        "processed_image": img_jpeg
+    }
+
+# --- PDF ---
+# Caracteres minimos para considerar que la pagina trae capa de texto
+PDF_TEXT_MIN_CHARS = 40
+# Las paginas con capa de texto solo se renderizan para la vista previa
+PDF_PREVIEW_DPI = 100
+
+def is_pdf(data: bytes) -> bool:
+    return b"%PDF-" in data[:1024]
+
+def split_pdf_pages(pdf_bytes: bytes) -> List[bytes]:
+    """
+    Separa el PDF en PDFs de una pagina, asi cada trabajo del JobQueue
+    recibe solo su pagina y no el documento entero.
+    """
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        if doc.page_count == 1:
+            return [pdf_bytes]
+        pages = []
+        for number in range(doc.page_count):
+            with fitz.open() as single:
+                single.insert_pdf(doc, from_page=number, to_page=number)
+                pages.append(single.tobytes(garbage=3, deflate=True))
+        return pages
+
+def pixmap_to_array(pix) -> np.ndarray:
+    """Pixmap en grises (csGRAY) como array, respetando el stride de cada fila."""
+    return np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+def process_pdf_page(page_bytes: bytes) -> dict:
+    """
+    Procesa un PDF de una pagina. Si trae capa de texto (PDF digital) el
+    texto va directo a extract_data_from_text sin OCR; si no, se renderiza
+    en memoria a OCR_TARGET_DPI y sigue el mismo camino que una foto.
+    """
+    timings = begin_scan_timings()
+    with fitz.open(stream=page_bytes, filetype="pdf") as doc:
+        page = doc[0]
+        with timed_stage("pdf_text"):
+            text = page.get_text()
+        if len(text.strip()) >= PDF_TEXT_MIN_CHARS:
+            timings.events["resolved_by"] = "text_layer"
+            with timed_stage("extract_data_from_text"):
+                data = extract_data_from_text(text)
+            with timed_stage("pdf_render"):
+                preview = pixmap_to_array(page.get_pixmap(dpi=PDF_PREVIEW_DPI, colorspace=fitz.csGRAY))
+            return {
+                "data": {field: data.get(field, "") for field in SCAN_FIELDS},
+                "raw_text": "[Capa de texto PDF]\n" + text,
+                "rotation": 0,
+                "processed_image": to_jpeg_bytes(preview),
+                "timings": timings.as_dict()
+            }
+        # Pagina escaneada: ya es la hoja completa, sin recorte de perspectiva
+        with timed_stage("pdf_render"):
+            rendered = pixmap_to_array(page.get_pixmap(dpi=OCR_TARGET_DPI, colorspace=fitz.csGRAY))
+    result = scan_document(rendered)
+    result["timings"] = timings.as_dict()
+    return result
+
+# --- Cache de Resultados OCR ---
+OCR_CACHE_SIZE = 256
+# Tope en bytes del LRU en memoria (la imagen procesada es casi todo el peso)
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR")
+
+# Etapas cuyo codigo entra en la huella de la cache
+PIPELINE_FUNCTIONS = (
+    decode_image, apply_exif_orientation, as_gray_array, crop_document, preprocess_image,
+    orientation_candidates, detect_text_axis, score_ocr_data, is_confident, ocr_best_rotation, scale_image,
+    merge_fields, ocr_ladder, read_layout_zones, words_to_text, parse_zone_value, extract_data_from_text,
+    process_scan, scan_document, process_pdf_page,
+)
+
+def pipeline_config() -> dict:
+    """Valores efectivos (constantes y variables de entorno) que cambian el resultado de un escaneo."""
+    return {
+        "tesseract": [OCR_LANG, OCR_OEM, OCR_PSM, "tesserocr" if tesserocr is not None else "cli"],
+        "document": [DOC_DETECT_SIDE, DOC_MIN_AREA_RATIO, DOC_PAPER_SHORT_SIDE_IN, OCR_TARGET_DPI,
+                     DECODE_DRAFT_MARGIN],
+        "orientation": [ROTATIONS, KEY_FIELDS, OSD_MIN_CONFIDENCE, OSD_MAX_SIDE],
+        "ladder": [OCR_LADDER, LADDER_FIELDS],
+        "layouts": [LAYOUT_ANCHOR_SCALE, LAYOUT_ANCHOR_PSM, LAYOUT_ANCHOR_MAX_SHIFT],
+        "pdf": [PDF_TEXT_MIN_CHARS, PDF_PREVIEW_DPI],
+    }
+
+def _source(obj) -> str:
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return getattr(obj, "__name__", repr(obj))
+
+def _pattern(pattern: "re.Pattern") -> str:
+    return f"{pattern.flags}:{pattern.pattern}"
+
+def extraction_fingerprint() -> List[str]:
+    """
+    Reglas del motor de extraccion: tablas, patrones y el codigo de cada
+    paso de EXTRACTION_PLAN (el repr de las reglas cambia en cada proceso).
+    """
+    parts = [json.dumps(OCR_DIGIT_FIXES, sort_keys=True), json.dumps(MESES, sort_keys=True)]
+    parts += [_pattern(p) for p in (MULTI_SPACE_RE, DATE_RE, DATE_TEXT_RE, RUC_RE, LABEL_VALUE_RE, NAME_JUNK_RE)]
+    for step in EXTRACTION_PLAN:
+        if isinstance(step, FieldSpec):
+            parts.append(step.name)
+            for rule in step.rules:
+                parts += [_pattern(rule.pattern), rule.source, _source(rule.transform)]
+        else:
+            parts.append(_source(step))
+    parts += [_source(obj) for obj in (ExtractionContext, clean_ocr_number, validate_ruc)]
+    return parts
+
+def pipeline_version() -> str:
+    """
+    Huella del pipeline: configuracion efectiva, contenido de las plantillas,
+    reglas de extraccion y codigo de las etapas. Cualquier cambio en
+    preprocess_image, --psm, OCR_LADDER, una plantilla, un patron de
+    EXTRACTION_PLAN, etc. invalida la cache.
+    """
+    parts = [json.dumps(pipeline_config(), sort_keys=True)]
+    parts += [_source(fn) for fn in PIPELINE_FUNCTIONS]
+    parts += extraction_fingerprint()
+    parts.extend(layout.source for layout in LAYOUTS)
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+class OCRCache:
+    """
+    Cache de resultados por hash del archivo subido. LRU en memoria acotado
+    por entradas y por bytes y, si se configura un directorio, copia en
+    disco que sobrevive reinicios (sin la imagen procesada, solo texto,
+    rotacion y campos).
+    """
+    def __init__(self, max_entries: int = OCR_CACHE_SIZE, directory: Optional[str] = OCR_CACHE_DIR,
+                 max_bytes: int = OCR_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = pipeline_version()
+        self.directory = os.path.join(directory, self.version) if directory else None
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, image_bytes: bytes, prescaled: bool = False, page: Optional[int] = None) -> str:
+        digest = hashlib.sha256(self.version.encode("ascii"))
+        digest.update(image_bytes)
+        if prescaled:
+            # La misma foto sin redimensionar en el servidor da otro resultado
+            digest.update(b"prescaled")
+        if page is not None:
+            # Pagina de un PDF (la clave es el PDF original, no el recorte)
+            digest.update(f"page:{page}".encode("ascii"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                return result
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: dict):
+        self._remember(key, result)
+        if not self.directory:
+            return
+        stored = {k: v for k, v in result.items() if k != "processed_image"}
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stored, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error guardando cache OCR: {e}")
+
+    @staticmethod
+    def entry_size(result: dict) -> int:
+        """Peso aproximado de un resultado: imagen procesada y textos."""
+        return (len(result.get("processed_image") or b"") + len(result.get("raw_text") or "")
+                + sum(len(str(value)) for value in (result.get("data") or {}).values()))
+
+    def _remember(self, key: str, result: dict):
+        size = self.entry_size(result)
+        if size > self.max_bytes and result.get("processed_image") is not None:
+            # Una imagen que no entra sola: se guardan solo los datos
+            result = {k: v for k, v in result.items() if k != "processed_image"}
+            size = self.entry_size(result)
+        with self._lock:
+            self.total_bytes -= self._sizes.pop(key, 0)
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self.total_bytes += size
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                              or self.total_bytes > self.max_bytes):
+                old_key, _ = self._entries.popitem(last=False)
+                self.total_bytes -= self._sizes.pop(old_key)
+
+ocr_cache = OCRCache()
+
+# --- Almacen de Imagenes Escaneadas ---
+SCAN_STORE_MAX_BYTES = 256 * 1024 * 1024
+SCAN_STORE_DIR = os.environ.get("SCAN_STORE_DIR")
+SCAN_STORE_ORIGINALS = False
+SCAN_CACHE_MAX_AGE = 86400
+THUMB_SIDE = 320
+
+class ScanImageStore:
+    """
+    Imagenes de cada escaneo (processed.jpg, thumb.jpg y opcionalmente
+    original) servidas por URL. LRU acotado por bytes; en memoria o, si se
+    configura SCAN_STORE_DIR, en disco. El contenido de un scan_id no cambia,
+    por eso el ETag es el hash del archivo y se cachea como immutable.
+    """
+    def __init__(self, max_bytes: int = SCAN_STORE_MAX_BYTES, directory: Optional[str] = SCAN_STORE_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries: "OrderedDict[Tuple[str, str], dict]" = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, scan_id: str, name: str) -> str:
+        return os.path.join(self.directory, scan_id, name)
+
+    def put(self, scan_id: str, name: str, data: bytes, mimetype: str = "image/jpeg"):
+        entry = {"mimetype": mimetype, "etag": hashlib.sha1(data).hexdigest(), "size": len(data)}
+        if self.directory:
+            path = self._path(scan_id, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        else:
+            entry["data"] = data
+
+        evicted = []
+        with self._lock:
+            old = self._entries.pop((scan_id, name), None)
+            if old is not None:
+                self._total -= old["size"]
+            self._entries[(scan_id, name)] = entry
+            self._total += entry["size"]
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                key, oldest = self._entries.popitem(last=False)
+                self._total -= oldest["size"]
+                evicted.append(key)
+        if self.directory:
+            for key in evicted:
+                try:
+                    os.remove(self._path(*key))
+                except OSError:
+                    pass
+
+    def get(self, scan_id: str, name: str):
+        """Devuelve (bytes, mimetype, etag) o None."""
+        with self._lock:
+            entry = self._entries.get((scan_id, name))
+            if entry is not None:
+                self._entries.move_to_end((scan_id, name))
+        if entry is None:
+            return self._get_shared(scan_id, name)
+        if not self.directory:
+            return entry["data"], entry["mimetype"], entry["etag"]
+        try:
+            with open(self._path(scan_id, name), "rb") as f:
+                return f.read(), entry["mimetype"], entry["etag"]
+        except OSError:
+            return None
+
+    def _get_shared(self, scan_id: str, name: str):
+        """
+        Imagen escrita en el mismo directorio por otro worker (modo
+        produccion): no esta en el indice de este proceso pero si en disco.
+        """
+        if not self.directory or os.sep in scan_id or os.sep in name or scan_id.startswith("."):
+            return None
+        try:
+            with open(self._path(scan_id, name), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        fmt = "jpeg" if name.endswith(".jpg") else (Image.open(io.BytesIO(data)).format or "JPEG").lower()
+        return data, f"image/{fmt}", hashlib.sha1(data).hexdigest()
+
+    def store_scan(self, scan_id: str, processed: Optional[bytes], original: Optional[bytes] = None) -> dict:
+        """Guarda las imagenes de un escaneo y devuelve sus URLs."""
+        urls = {}
+        if processed is not None:
+            self.put(scan_id, "processed.jpg", processed)
+            thumb = Image.open(io.BytesIO(processed))
+            thumb.thumbnail((THUMB_SIDE, THUMB_SIDE))
+            self.put(scan_id, "thumb.jpg", to_jpeg_bytes(thumb))
+            urls["image_url"] = f"/scans/{scan_id}/processed.jpg"
+            urls["thumb_url"] = f"/scans/{scan_id}/thumb.jpg"
+        if original is not None and SCAN_STORE_ORIGINALS:
+            fmt = (Image.open(io.BytesIO(original)).format or "JPEG").lower()
+            self.put(scan_id, "original", original, f"image/{fmt}")
+            urls["original_url"] = f"/scans/{scan_id}/original"
+        return urls
+
+scan_store = ScanImageStore()
+
+# --- Historial de Escaneos (SQLite) ---
+SCAN_DB_PATH = os.environ.get("SCAN_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scans.db"))
+SCAN_PAGE_LIMIT = 100
+EXPORT_FETCH_ROWS = 500
+# Columnas exportadas (cabecera, campo)
+EXPORT_COLUMNS = [
+    ("ID", "id"), ("FECHA", "created"), ("EXP SIGAD", "exp_sigad"), ("FECHA REC", "fecha_recepcion"),
+    ("RUC CONTRIB.", "ruc_contribuyente"), ("NOMBRE CONTRIB.", "nombre_contribuyente"),
+    ("RES. COAC.", "res_coactiva"), ("FECHA RC", "fecha_rc"), ("EXP. RC", "expediente_rc"),
+    ("MONTO", "monto"), ("RUC TERCERO", "ruc_tercero"), ("NOM TERCERO", "nombre_tercero"),
+    ("CHEQUE/BOL", "cheque_boleta"),
+]
+# Campos indexados por los que se busca
+SEARCH_FIELDS = ("ruc_contribuyente", "exp_sigad", "res_coactiva")
+
+class ScanDatabase:
+    """
+    Historial persistente: cada pagina escaneada (kind='page') y cada
+    documento guardado desde el escritorio (kind='document').
+    SQLite en modo WAL con una conexion por hilo: los callbacks del
+    JobQueue escriben mientras las rutas leen sin bloquearse.
+    """
+    def __init__(self, path: str = SCAN_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            fields = ", ".join(f"{field} TEXT NOT NULL DEFAULT ''" for field in SCAN_FIELDS)
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS scans (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    {fields},
+                    raw_text TEXT NOT NULL DEFAULT '',
+                    rotation INTEGER,
+                    image_url TEXT,
+                    pages TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_scans_kind_created ON scans (kind, created DESC, id DESC)")
+            for field in SEARCH_FIELDS:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_scans_{field} ON scans ({field})")
+
+    def reset_connections(self):
+        """Tras un fork las conexiones heredadas no se pueden usar: cada proceso abre las suyas."""
+        self._local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Conexion del hilo actual; commit al salir del bloque."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        with conn:
+            yield conn
+
+    def add(self, scan_id: str, kind: str, data: dict, raw_text: str = "", rotation: Optional[int] = None,
+            image_url: Optional[str] = None, pages: Optional[List[str]] = None) -> dict:
+        row = {"id": scan_id, "kind": kind, "created": time.time(),
+               **{field: data.get(field) or "" for field in SCAN_FIELDS},
+               "raw_text": raw_text or "", "rotation": rotation, "image_url": image_url,
+               "pages": json.dumps(pages) if pages is not None else None}
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{column}" for column in row)
+        with self.connection() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO scans ({columns}) VALUES ({placeholders})", row)
+        return {**row, "pages": pages or []}
+
+    @staticmethod
+    def _where(kind: Optional[str], filters: Dict[str, str], query: str) -> Tuple[str, list]:
+        """
+        Filtros por prefijo escritos como rango (col >= x AND col < x+U+FFFF)
+        para que SQLite use los indices en vez de recorrer la tabla.
+        """
+        clauses, params = [], []
+        if kind:
+            clauses.append("kind = ?")
+            params.append(kind)
+        for field, value in filters.items():
+            if value:
+                clauses.append(f"({field} >= ? AND {field} < ?)")
+                params += [value, value + "\uffff"]
+        if query:
+            clauses.append("(" + " OR ".join(f"({field} >= ? AND {field} < ?)" for field in SEARCH_FIELDS) + ")")
+            params += [query, query + "\uffff"] * len(SEARCH_FIELDS)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def search(self, kind: Optional[str] = None, filters: Optional[Dict[str, str]] = None, query: str = "",
+               limit: int = 50, before: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        Pagina de resultados, del mas nuevo al mas viejo. La paginacion es por
+        cursor ("created|id" de la ultima fila), asi cada pagina cuesta lo
+        mismo aunque haya decenas de miles de filas.
+        """
+        where, params = self._where(kind, filters or {}, query)
+        if before:
+            created, _, last_id = before.partition("|")
+            where += (" AND " if where else " WHERE ") + "(created < ? OR (created = ? AND id < ?))"
+            params += [float(created), float(created), last_id]
+        limit = max(1, min(limit, SCAN_PAGE_LIMIT))
+        with self.connection() as conn:
+            rows = conn.execute(f"SELECT * FROM scans{where} ORDER BY created DESC, id DESC LIMIT ?",
+                                params + [limit + 1]).fetchall()
+        items = [self._row_to_dict(row) for row in rows[:limit]]
+        next_cursor = f"{items[-1]['created']!r}|{items[-1]['id']}" if len(rows) > limit else None
+        return items, next_cursor
+
+    def iter_rows(self, kind: Optional[str] = None, filters: Optional[Dict[str, str]] = None, query: str = ""):
+        """Todas las filas que cumplen el filtro, leidas por bloques (para exportar)."""
+        where, params = self._where(kind, filters or {}, query)
+        # Conexion propia: el generador vive mientras se envia la respuesta
+        conn = self.connect()
+        try:
+            cursor = conn.execute(f"SELECT * FROM scans{where} ORDER BY created DESC, id DESC", params)
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._row_to_dict(row)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> dict:
+        item = dict(row)
+        item["pages"] = json.loads(item["pages"]) if item["pages"] else []
+        return item
+
+# Se abre con el primer uso: importar el modulo (tests, --scan) no crea scans.db
+_scan_db: Optional[ScanDatabase] = None
+_scan_db_lock = threading.Lock()
+
+def get_scan_db() -> ScanDatabase:
+    global _scan_db
+    if _scan_db is None:
+        with _scan_db_lock:
+            if _scan_db is None:
+                _scan_db = ScanDatabase()
+    return _scan_db
+
+def export_rows_csv(rows):
+    """CSV fila a fila (BOM para que Excel respete los acentos)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow([header for header, _ in EXPORT_COLUMNS])
+    for row in rows:
+        writer.writerow([format_export_value(key, row[key]) for _, key in EXPORT_COLUMNS])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_rows_xlsx(rows, chunk_size: int = 64 * 1024):
+    """
+    XLSX con openpyxl en modo write_only: las filas van a un archivo
+    temporal sin quedar en memoria y el .xlsx se envia por bloques.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Historial")
+    sheet.append([header for header, _ in EXPORT_COLUMNS])
+    for row in rows:
+        sheet.append([format_export_value(key, row[key]) for _, key in EXPORT_COLUMNS])
+    with tempfile.TemporaryFile() as tmp:
+        workbook.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+# Un valor leido del documento que empiece asi seria una formula en Excel
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def format_export_value(key: str, value):
+    if key == "created":
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(value))
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
 # --- WebSocket Helper ---
+WS_CLIENT_QUEUE_SIZE = 64
+
+class ClientChannel:
+    """
+    Cola de salida acotada de un escritorio, drenada por su propio hilo.
+    Un cliente lento solo retrasa su propia cola, nunca el /upload. Si un
+    envio falla se llama on_error(ws) para sacarlo del manager.
+    """
+    def __init__(self, ws: WebSocketServer, on_error: Callable[[WebSocketServer], None]):
+        self.ws = ws
+        self.on_error = on_error
+        self.queue: "queue.Queue" = queue.Queue(maxsize=WS_CLIENT_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._drain, name="ws-sender", daemon=True)
+        self.thread.start()
+
+    def offer(self, frame: str) -> bool:
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        # Corta el socket: desbloquea un send() colgado y el receive() del handler
+        try:
+            self.ws.sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, AttributeError):
+            pass
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _drain(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            try:
+                self.ws.send(frame)
+            except Exception as e:
+                logger.error(f"Error enviando WS: {e}")
+                WS_DROPPED_TOTAL.inc()
+                self.on_error(self.ws)
+                return
+
 class WebSocketManager:
     def __init__(self):
-        self.clients: List[WebSocketServer] = []
+        self.clients: Dict[WebSocketServer, ClientChannel] = {}
+        self._lock = threading.Lock()
     def register(self, ws: WebSocketServer):
-        self.clients.append(ws)
+        with self._lock:
+            self.clients[ws] = ClientChannel(ws, self.unregister)
     def unregister(self, ws: WebSocketServer):
-        if ws in self.clients: self.clients.remove(ws)
+        with self._lock:
+            channel = self.clients.pop(ws, None)
+        if channel is not None:
+            channel.close()
     def broadcast(self, message: dict):
-        self.clients = [client for client in self.clients if client.connected]
-        for client in self.clients:
+        """
+        Serializa una sola vez y encola en cada cliente como frame de texto.
+        Los clientes con la cola llena se desconectan (el escritorio reconecta).
+        """
+        frame = json.dumps(message)
+        with self._lock:
+            channels = list(self.clients.values())
+        for channel in channels:
+            if not channel.ws.connected or not channel.offer(frame):
+                logger.warning("Cliente WS lento o caido, se desconecta")
+                WS_DROPPED_TOTAL.inc()
+                self.unregister(channel.ws)
+ws_manager = WebSocketManager()
+Gauge("ws_clients", "Escritorios conectados por WebSocket", lambda: len(ws_manager.clients))
+
+# --- Cola de Trabajos OCR ---
+OCR_WORKERS = os.cpu_count() or 1
+JOB_QUEUE_LIMIT = OCR_WORKERS * 4
+JOB_RETENTION = 500
+
+def _init_ocr_worker(busy_scans=None):
+    """
+    Cada proceso del pool carga un motor OCR al arrancar y crece hasta uno
+    por rotacion solo cuando compiten varias. Cuantas compiten lo decide
+    race_width() en cada escaneo segun busy_scans (escaneos en curso en
+    todos los procesos).
+    """
+    global _ocr_pool, _ocr_pool_lock, _rotation_executor, _rotation_threads, _busy_scans
+    # Con fork el hijo hereda el executor de rotaciones (sin sus hilos) y el
+    # lock en el estado que tuviera: se empieza de cero en cada proceso
+    _ocr_pool_lock = threading.Lock()
+    _rotation_executor = None
+    _rotation_threads = len(ROTATIONS)
+    _busy_scans = busy_scans
+    _ocr_pool = OCREnginePool(size=len(ROTATIONS), preload=1)
+
+class JobQueue:
+    """
+    Cola acotada de escaneos servida por un ProcessPoolExecutor.
+    Guarda los ultimos JOB_RETENTION trabajos para consultar su estado.
+    Los resultados se entregan (on_done: cache, miniatura, SQLite, bus) en
+    un hilo propio, no en el hilo del executor que recoge los resultados.
+    """
+    def __init__(self, workers: int = OCR_WORKERS, limit: int = JOB_QUEUE_LIMIT, busy_scans=None):
+        self.workers = workers
+        self.limit = limit
+        # En --prod el supervisor pasa un contador comun a todos los workers
+        self.busy_scans = busy_scans
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._remote: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(limit)
+        self._done: "queue.Queue" = queue.Queue()
+        self._notifier: Optional[threading.Thread] = None
+        # Modo produccion: recibe los cambios de estado para los demas workers
+        self.publish: Optional[Callable[[dict], None]] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            if self.busy_scans is None:
+                self.busy_scans = new_busy_counter()
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_ocr_worker,
+                                                 initargs=(self.busy_scans,))
+        if self._notifier is None:
+            self._notifier = threading.Thread(target=self._deliver_results, name="job-done", daemon=True)
+            self._notifier.start()
+        return self._executor
+
+    def start(self):
+        self._get_executor()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._notifier is not None:
+            # Entrega lo que quedo pendiente antes de cerrar
+            self._done.put(None)
+            self._notifier.join()
+            self._notifier = None
+
+    def _deliver_results(self):
+        while True:
+            item = self._done.get()
+            if item is None:
+                return
+            self._finish(*item)
+
+    def _announce(self, info: dict):
+        if self.publish is not None:
             try:
-                import json
-                client.send(json.dumps(message))
+                self.publish({"type": "job", **info})
             except Exception as e:
-                logger.error(f"Error enviando WS: {e}")
-ws_manager = WebSocketManager()
+                logger.error(f"Error publicando estado de {info['job_id']}: {e}")
+
+    def remember(self, info: dict):
+        """Estado de un trabajo de otro worker, para responder /jobs/<id> desde cualquiera."""
+        info = {k: v for k, v in info.items() if k != "type"}
+        with self._lock:
+            self._remote[info["job_id"]] = {**self._remote.get(info["job_id"], {}), **info}
+            self._remote.move_to_end(info["job_id"])
+            while len(self._remote) > JOB_RETENTION:
+                self._remote.popitem(last=False)
+
+    def reserve(self) -> str:
+        """
+        job_id para un trabajo que se enviara despues con feed(). Mientras
+        espera cupo /jobs/<id> lo reporta como "queued".
+        """
+        job_id = uuid.uuid4().hex
+        created = time.time()
+        with self._lock:
+            self._jobs[job_id] = {"created": created, "future": None}
+            self._prune()
+        self._announce({"job_id": job_id, "created": created, "state": "queued"})
+        return job_id
+
+    def feed(self, fn, jobs):
+        """
+        Envia trabajos reservados (job_id, args, on_done) a medida que se
+        liberan cupos. Corre en un hilo del request: ninguno se descarta.
+        """
+        for job_id, args, on_done in jobs:
+            try:
+                self.submit(fn, *args, on_done=on_done, job_id=job_id, block=True)
+            except Exception as e:
+                SCAN_ERRORS_TOTAL.inc(stage="job")
+                logger.error(f"Error encolando trabajo {job_id}: {e}")
+                with self._lock:
+                    if job_id in self._jobs:
+                        self._jobs[job_id]["message"] = str(e)
+                self._announce({"job_id": job_id, "state": "error", "message": str(e)})
+
+    def submit(self, fn, *args, on_done=None, job_id: Optional[str] = None,
+               block: bool = False) -> Optional[str]:
+        """
+        Encola fn(*args). Devuelve el job_id o None si la cola esta llena;
+        con block=True espera a que se libere un cupo.
+        """
+        if not self._slots.acquire(blocking=block):
+            return None
+        reserved = job_id is not None
+        job_id = job_id or uuid.uuid4().hex
+        try:
+            future = self._get_executor().submit(_run_counted, fn, *args)
+        except BrokenProcessPool:
+            logger.error("Pool OCR caido, reiniciando procesos")
+            self._executor = None
+            try:
+                future = self._get_executor().submit(_run_counted, fn, *args)
+            except Exception:
+                self._slots.release()
+                raise
+        except Exception:
+            self._slots.release()
+            raise
+
+        submitted = time.perf_counter()
+        created = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id) if reserved else None
+            if job is not None:
+                job["future"] = future
+            else:
+                self._jobs[job_id] = {"created": created, "future": future}
+                self._prune()
+        if job is None:
+            self._announce({"job_id": job_id, "created": created, "state": "queued"})
+        future.add_done_callback(lambda f: self._completed(job_id, f, on_done, submitted))
+        return job_id
+
+    def _completed(self, job_id: str, future, on_done, submitted: float):
+        """Hilo del executor: libera el cupo y deja el resto al hilo de entrega."""
+        self._slots.release()
+        self._done.put((job_id, future, on_done, time.perf_counter() - submitted))
+
+    def _finish(self, job_id: str, future, on_done, elapsed: float):
+        if future.cancelled():
+            return
+        JOB_SECONDS.observe(elapsed)
+        error = future.exception()
+        if error is not None:
+            SCAN_ERRORS_TOTAL.inc(stage="job")
+            logger.error(f"Error procesando trabajo {job_id}: {error}")
+            self._announce({"job_id": job_id, "state": "error", "message": str(error)})
+            return
+        if on_done is not None:
+            try:
+                on_done(job_id, future.result())
+            except Exception as e:
+                SCAN_ERRORS_TOTAL.inc(stage="notify")
+                logger.error(f"Error notificando trabajo {job_id}: {e}")
+        self._announce({"job_id": job_id, "state": "done", "data": future.result()["data"]})
+
+    def _prune(self):
+        while len(self._jobs) > JOB_RETENTION:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest["future"] is None and "message" not in oldest:
+                break  # reservado, todavia esperando cupo
+            if oldest["future"] is not None and not oldest["future"].done():
+                break
+            del self._jobs[oldest_id]
+
+    def future(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job["future"] if job else None
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            remote = self._remote.get(job_id)
+        if job is None:
+            return dict(remote) if remote is not None else None
+        future = job["future"]
+        info = {"job_id": job_id, "created": job["created"]}
+        if future is None:
+            if "message" in job:
+                info["state"] = "error"
+                info["message"] = job["message"]
+            else:
+                info["state"] = "queued"
+        elif not future.done():
+            info["state"] = "processing" if future.running() else "queued"
+        elif future.cancelled():
+            info["state"] = "error"
+            info["message"] = "Cancelado"
+        elif future.exception() is not None:
+            info["state"] = "error"
+            info["message"] = str(future.exception())
+        else:
+            info["state"] = "done"
+            info["data"] = future.result()["data"]
+        return info
+
+job_queue = JobQueue()
+
+# --- Bus de Eventos entre Workers (modo produccion) ---
+BUS_CONNECT_ATTEMPTS = 50
+# Cada cuanto cada worker envia sus metricas al hub y el hub reparte la suma
+METRICS_SHARE_INTERVAL = float(os.environ.get("METRICS_SHARE_INTERVAL", "5"))
+
+# Metricas de todos los workers tal como las reparte el hub (None fuera del modo produccion)
+shared_metrics: Optional[List[dict]] = None
+
+def deliver_event(message: dict, local: bool = True):
+    """Entrega un evento del bus en este proceso."""
+    global shared_metrics
+    if message.get("type") == "job":
+        # El estado de los trabajos propios ya esta en el JobQueue local
+        if not local:
+            job_queue.remember(message)
+    elif message.get("type") == "metrics_all":
+        shared_metrics = message["snapshots"]
+    elif message.get("type") == "metrics":
+        pass  # Solo las consume el hub
+    else:
+        ws_manager.broadcast(message)
+
+class ScanBus:
+    """
+    Eventos (new_scan, estado de trabajos) compartidos entre los workers
+    HTTP del modo produccion. Cada worker se conecta a un hub local
+    (socket Unix de multiprocessing.connection) que reenvia cada evento a
+    todos, incluido el que lo publico, asi cada escritorio ve todos los
+    escaneos sin importar que worker atendio la subida. Sin hub (modo
+    desarrollo) publish entrega directo en el proceso.
+    """
+    def __init__(self):
+        self._conn = None
+        self._send_lock = threading.Lock()
+        self.origin = str(os.getpid())
+
+    def connect(self, address: str, authkey: bytes):
+        for _ in range(BUS_CONNECT_ATTEMPTS):
+            try:
+                self._conn = Client(address, family="AF_UNIX", authkey=authkey)
+                break
+            except (OSError, EOFError):
+                time.sleep(0.1)
+        else:
+            raise RuntimeError(f"No se pudo conectar al bus de eventos {address}")
+        self.origin = str(os.getpid())
+        threading.Thread(target=self._listen, name="bus", daemon=True).start()
+
+    def publish(self, message: dict):
+        conn = self._conn
+        if conn is None:
+            deliver_event(message)
+            return
+        try:
+            with self._send_lock:
+                conn.send({"origin": self.origin, "message": message})
+        except (OSError, ValueError) as e:
+            logger.error(f"Bus de eventos caido, se entrega solo en este worker: {e}")
+            self._conn = None
+            deliver_event(message)
+
+    def _listen(self):
+        conn = self._conn
+        while True:
+            try:
+                event = conn.recv()
+            except (EOFError, OSError):
+                logger.error("Bus de eventos cerrado")
+                self._conn = None
+                return
+            try:
+                deliver_event(event["message"], local=event["origin"] == self.origin)
+            except Exception as e:
+                logger.error(f"Error entregando evento del bus: {e}")
+
+scan_bus = ScanBus()
+
+def share_metrics():
+    """Worker: envia sus metricas al hub cada METRICS_SHARE_INTERVAL segundos."""
+    while True:
+        scan_bus.publish({"type": "metrics", "snapshot": metrics_snapshot()})
+        time.sleep(METRICS_SHARE_INTERVAL)
+
+# Eventos pendientes por worker en el hub; si un worker no lee, se descartan los nuevos
+BUS_PEER_QUEUE = 1000
+
+class HubPeer:
+    """
+    Conexion de un worker en el hub, con su propia cola y su hilo de envio:
+    un worker lento o trabado solo retrasa sus propios eventos.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self._outbox: "queue.Queue" = queue.Queue(maxsize=BUS_PEER_QUEUE)
+        self._dropped = 0
+        threading.Thread(target=self._send_loop, name="bus-send", daemon=True).start()
+
+    def offer(self, event: dict):
+        try:
+            self._outbox.put_nowait(event)
+        except queue.Full:
+            self._dropped += 1
+            if self._dropped == 1 or self._dropped % 100 == 0:
+                logger.warning(f"Worker del bus atrasado: {self._dropped} evento(s) descartados")
+
+    def _send_loop(self):
+        # Solo este hilo cierra la conexion: cerrarla desde otro a mitad de
+        # un send() rompe el envio. Tras un error se sigue vaciando la cola
+        # hasta que close() avise.
+        alive = True
+        while True:
+            event = self._outbox.get()
+            if event is None:
+                break
+            if alive:
+                try:
+                    self.conn.send(event)
+                except (OSError, ValueError):
+                    alive = False
+        self.conn.close()
+
+    def close(self):
+        """Cierra la conexion cuando el hilo de envio termine (llamar despues del ultimo recv)."""
+        # Despierta al hilo de envio aunque la cola este llena
+        while True:
+            try:
+                self._outbox.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    self._outbox.get_nowait()
+                except queue.Empty:
+                    pass
+
+def run_bus_hub(listener: Listener):
+    """
+    Hub del bus: reenvia cada evento recibido a todos los workers conectados.
+    Guarda ademas las ultimas metricas de cada worker y reparte el conjunto
+    a todos, asi /metrics muestra la misma suma la atienda quien la atienda.
+    """
+    peers: List[HubPeer] = []
+    snapshots: Dict[str, dict] = {}
+    gauges = {metric.name for metric in METRICS if isinstance(metric, Gauge)}
+    lock = threading.Lock()
+
+    def metrics_event() -> dict:
+        return {"origin": "hub", "message": {"type": "metrics_all", "snapshots": list(snapshots.values())}}
+
+    def broadcast(event: dict):
+        # Fuera del lock: cada peer encola y envia en su propio hilo
+        with lock:
+            targets = list(peers)
+        for target in targets:
+            target.offer(event)
+
+    def relay(peer: HubPeer):
+        origin = None
+        while True:
+            try:
+                event = peer.conn.recv()
+            except (EOFError, OSError):
+                break
+            if event["message"].get("type") == "metrics":
+                origin = event["origin"]
+                with lock:
+                    snapshots[origin] = event["message"]["snapshot"]
+                continue
+            broadcast(event)
+        with lock:
+            if peer in peers:
+                peers.remove(peer)
+            # Los contadores de un worker caido se siguen sumando para que no
+            # retrocedan; sus gauges (clientes conectados) ya no valen
+            if origin in snapshots:
+                snapshots[origin] = {name: data for name, data in snapshots[origin].items() if name not in gauges}
+        peer.close()
+
+    def share():
+        while True:
+            time.sleep(METRICS_SHARE_INTERVAL)
+            with lock:
+                event = metrics_event()
+            broadcast(event)
+
+    threading.Thread(target=share, name="bus-metrics", daemon=True).start()
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # Autenticacion fallida u otro cliente que no es un worker
+            logger.error(f"Conexion rechazada en el bus: {e}")
+            continue
+        peer = HubPeer(conn)
+        with lock:
+            peer.offer(metrics_event())
+            peers.append(peer)
+        threading.Thread(target=relay, args=(peer,), daemon=True).start()
 
 # --- Rutas ---
 
+@app.before_request
+def assign_request_id():
+    # Se respeta el ID que traiga un proxy para poder seguir el request de punta a punta
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def log_request(response):
+    elapsed = time.perf_counter() - g.get("request_start", time.perf_counter())
+    response.headers["X-Request-ID"] = g.get("request_id", "-")
+    endpoint = request.endpoint or "other"
+    HTTP_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    if endpoint not in ("static", "metrics", "job_status"):
+        logger.info(f"request method={request.method} path={request.path} status={response.status_code} "
+                    f"ms={elapsed * 1000:.1f}")
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Metricas en formato de texto de Prometheus (en produccion, la suma de todos los workers)."""
+    return Response(render_metrics(shared_metrics), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route("/", methods=["GET"])
 def index():
     ip = get_ip()
@@ -262,7 +2598,9 @@ def index():
 
 @app.route("/mobile", methods=["GET"])
 def mobile():
-    return render_template("mobile.html")
+    return render_template("mobile.html",
+                           upload_long_side=MOBILE_UPLOAD_LONG_SIDE,
+                           upload_jpeg_quality=MOBILE_UPLOAD_JPEG_QUALITY)
 
 @app.route("/scandoc", methods=["GET"])
 def scandoc():
@@ -281,6 +2619,59 @@ def desktop_sock(ws):
     finally:
         ws_manager.unregister(ws)
 
+def broadcast_scan(job_id: str, result: dict, original: Optional[bytes] = None):
+    message = {
+        "type": "new_scan",
+        "job_id": job_id,
+        "data": result["data"],
+        "raw_text": result["raw_text"]
+    }
+    # Solo las URLs: los escritorios piden la imagen cuando la necesitan
+    start = time.perf_counter()
+    message.update(scan_store.store_scan(job_id, result.get("processed_image"), original))
+    SCAN_STAGE_SECONDS.observe(time.perf_counter() - start, stage="store_images")
+    start = time.perf_counter()
+    try:
+        get_scan_db().add(job_id, "page", result["data"], result["raw_text"], result.get("rotation"),
+                    message.get("image_url"))
+    except sqlite3.Error as e:
+        SCAN_ERRORS_TOTAL.inc(stage="db")
+        logger.error(f"No se pudo guardar el escaneo {job_id}: {e}")
+    SCAN_STAGE_SECONDS.observe(time.perf_counter() - start, stage="db_insert")
+    start = time.perf_counter()
+    scan_bus.publish(message)
+    SCAN_STAGE_SECONDS.observe(time.perf_counter() - start, stage="ws_broadcast")
+
+def current_request_id() -> str:
+    return getattr(g, "request_id", "-") if has_request_context() else "-"
+
+def cache_and_broadcast(cache_key: str, original: bytes, request_id: Optional[str] = None):
+    # El callback corre fuera del request: el ID se captura al encolar
+    request_id = request_id or current_request_id()
+    def on_done(job_id: str, result: dict):
+        timings = observe_scan(result)
+        ocr_cache.put(cache_key, result)
+        broadcast_scan(job_id, result, original)
+        if timings:
+            stages = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings["stages"].items())
+            logger.info(f"scan job_id={job_id} request_id={request_id} rotation={result.get('rotation')} "
+                        f"resolved_by={timings.get('resolved_by', 'ocr')} level={timings.get('resolved_level')} ocr_passes={len(timings['ocr_passes'])} "
+                        f"early_exit={timings.get('early_exit')} {stages}")
+    return on_done
+
+def is_client_prescaled(header_image, long_side) -> bool:
+    """
+    El movil declara a que lado largo redujo la foto. Solo se confia en ello
+    si la imagen realmente cabe en ese tamano y no supera el del servidor.
+    """
+    try:
+        long_side = int(long_side or 0)
+    except ValueError:
+        return False
+    if long_side <= 0 or long_side > MOBILE_UPLOAD_LONG_SIDE:
+        return False
+    return max(header_image.size) <= long_side
+
 @app.route("/upload", methods=["POST"])
 def upload():
     if 'file' not in request.files:
@@ -290,84 +2681,431 @@ def upload():
     if file.filename == '':
         return jsonify({"status": "error", "message": "No selected file"}), 400
 
+    image_bytes = file.read()
+    if is_pdf(image_bytes):
+        return upload_pdf(image_bytes)
+
+    try:
+        # Solo valida la cabecera; el decode completo ocurre en el worker
+        header = Image.open(io.BytesIO(image_bytes))
+    except Exception as e:
+        logger.error(f"Imagen invalida: {e}")
+        UPLOADS_TOTAL.inc(result="invalid")
+        return jsonify({"status": "error", "message": "Imagen inválida"}), 400
+
+    prescaled = is_client_prescaled(header, request.form.get('client_long_side'))
+    cache_key = ocr_cache.key(image_bytes, prescaled)
+    cached = ocr_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Cache OCR: acierto {cache_key[:12]}")
+        UPLOADS_TOTAL.inc(result="cached")
+        broadcast_scan(uuid.uuid4().hex, cached, image_bytes)
+        return jsonify({"status": "success", "data": cached["data"], "cached": True})
+
+    # skip_quality_check=1: el operador decidio enviarla igual
+    retake = None if request.form.get('skip_quality_check') == '1' else quality_gate(image_bytes)
+    if retake is not None:
+        UPLOADS_TOTAL.inc(result="retake")
+        return jsonify(retake), 422
+
+    try:
+        job_id = job_queue.submit(process_scan, image_bytes, prescaled, on_done=cache_and_broadcast(cache_key, image_bytes))
+    except Exception as e:
+        logger.error(f"Error encolando imagen: {e}")
+        UPLOADS_TOTAL.inc(result="error")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    if job_id is None:
+        UPLOADS_TOTAL.inc(result="queue_full")
+        return jsonify({"status": "error", "message": "Cola de OCR llena, reintenta en unos segundos"}), 503
+
+    UPLOADS_TOTAL.inc(result="queued")
+    return jsonify({"status": "queued", "job_id": job_id}), 202
+
+def upload_pdf(pdf_bytes: bytes):
+    """
+    PDF subido a /upload: un trabajo por pagina. Las paginas con capa de
+    texto se resuelven en el worker sin OCR.
+    """
+    if fitz is None:
+        return jsonify({"status": "error", "message": "PyMuPDF no está instalado en el servidor"}), 415
     try:
+        pages = split_pdf_pages(pdf_bytes)
+    except Exception as e:
+        logger.error(f"PDF invalido: {e}")
+        UPLOADS_TOTAL.inc(result="invalid")
+        return jsonify({"status": "error", "message": "PDF inválido"}), 400
+
+    # Las paginas que no entran en la cola quedan reservadas y las envia un
+    # hilo propio de este request a medida que se liberan cupos
+    results = []
+    waiting = []
+    for number, page_bytes in enumerate(pages, start=1):
+        cache_key = ocr_cache.key(pdf_bytes, page=number)
+        cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            job_id = uuid.uuid4().hex
+            UPLOADS_TOTAL.inc(result="cached")
+            broadcast_scan(job_id, cached)
+            results.append({"page": number, "job_id": job_id, "status": "success",
+                            "data": cached["data"], "cached": True})
+            continue
+        on_done = cache_and_broadcast(cache_key, None)
+        job_id = None if waiting else job_queue.submit(process_pdf_page, page_bytes, on_done=on_done)
+        if job_id is None:
+            job_id = job_queue.reserve()
+            waiting.append((job_id, (page_bytes,), on_done))
+        UPLOADS_TOTAL.inc(result="queued")
+        results.append({"page": number, "job_id": job_id, "status": "queued"})
+
+    if waiting:
+        threading.Thread(target=job_queue.feed, args=(process_pdf_page, waiting),
+                         name="pdf-pages", daemon=True).start()
+    return jsonify({"status": "queued", "pages": results}), 202
+
+@app.route("/upload/batch", methods=["POST"])
+def upload_batch():
+    """
+    Varias fotos en un solo multipart (campo 'files'). Se procesan en
+    paralelo en el JobQueue y cada pagina se devuelve como una linea
+    NDJSON en cuanto termina (ademas del broadcast por WebSocket).
+    """
+    files = [f for f in request.files.getlist('files') if f.filename != '']
+    if not files:
+        return jsonify({"status": "error", "message": "No files"}), 400
+
+    # Un 'client_long_side' por archivo, en el mismo orden (0 = sin reducir),
+    # y lo mismo para 'skip_quality_check'
+    long_sides = request.form.getlist('client_long_side')
+    skip_checks = request.form.getlist('skip_quality_check')
+
+    pages = []
+    errors = []
+    for index, file in enumerate(files):
         image_bytes = file.read()
-        original_image = Image.open(io.BytesIO(image_bytes))
-        
         try:
-            image = ImageOps.exif_transpose(original_image)
+            header = Image.open(io.BytesIO(image_bytes))
+            long_side = long_sides[index] if index < len(long_sides) else None
+            prescaled = is_client_prescaled(header, long_side)
+        except Exception as e:
+            logger.error(f"Imagen invalida en lote ({file.filename}): {e}")
+            UPLOADS_TOTAL.inc(result="invalid")
+            errors.append({"index": index, "filename": file.filename, "status": "error", "message": "Imagen inválida"})
+            continue
+        skip_check = index < len(skip_checks) and skip_checks[index] == '1'
+        # Las que ya estan en cache no se miden: se resolvieron antes
+        retake = None if skip_check or ocr_cache.get(ocr_cache.key(image_bytes, prescaled)) is not None \
+            else quality_gate(image_bytes)
+        if retake is not None:
+            UPLOADS_TOTAL.inc(result="retake")
+            errors.append({"index": index, "filename": file.filename, **retake})
+            continue
+        pages.append((index, file.filename, image_bytes, prescaled))
+
+    request_id = current_request_id()
+
+    def generate():
+        for line in errors:
+            yield json.dumps(line) + "\n"
+
+        todo = list(pages)
+        pending = {}
+        while todo or pending:
+            # Encola lo que quepa; el resto espera a que se liberen cupos
+            while todo:
+                index, filename, image_bytes, prescaled = todo[0]
+                cache_key = ocr_cache.key(image_bytes, prescaled)
+                cached = ocr_cache.get(cache_key)
+                if cached is not None:
+                    todo.pop(0)
+                    job_id = uuid.uuid4().hex
+                    UPLOADS_TOTAL.inc(result="cached")
+                    broadcast_scan(job_id, cached, image_bytes)
+                    yield json.dumps({"index": index, "filename": filename, "job_id": job_id,
+                                      "status": "success", "data": cached["data"], "cached": True}) + "\n"
+                    continue
+                job_id = job_queue.submit(process_scan, image_bytes, prescaled,
+                                          on_done=cache_and_broadcast(cache_key, image_bytes, request_id))
+                if job_id is None:
+                    break
+                UPLOADS_TOTAL.inc(result="queued")
+                todo.pop(0)
+                pending[job_queue.future(job_id)] = (index, filename, job_id)
+
+            if not pending:
+                time.sleep(0.2)
+                continue
+
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, filename, job_id = pending.pop(future)
+                line = {"index": index, "filename": filename, "job_id": job_id}
+                if future.exception() is not None:
+                    line.update(status="error", message=str(future.exception()))
+                else:
+                    line.update(status="success", data=future.result()["data"])
+                yield json.dumps(line) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@app.route("/scans/<scan_id>/<name>", methods=["GET"])
+def scan_image(scan_id, name):
+    stored = scan_store.get(scan_id, name)
+    if stored is None:
+        return jsonify({"status": "error", "message": "Imagen no encontrada"}), 404
+    data, mimetype, etag = stored
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = SCAN_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+def search_args() -> dict:
+    """Filtros comunes de /api/scans y /api/scans/export."""
+    return {
+        "kind": request.args.get("kind") or None,
+        "filters": {field: request.args.get(field, "").strip() for field in SEARCH_FIELDS},
+        "query": request.args.get("q", "").strip(),
+    }
+
+@app.route("/api/scans", methods=["GET"])
+def list_scans():
+    try:
+        items, next_cursor = get_scan_db().search(limit=request.args.get("limit", 50, type=int),
+                                            before=request.args.get("before"), **search_args())
+    except ValueError:
+        return jsonify({"status": "error", "message": "Cursor inválido"}), 400
+    return jsonify({"status": "success", "items": items, "next": next_cursor})
+
+@app.route("/api/scans", methods=["POST"])
+def save_document():
+    """Documento terminado en el escritorio (campos ya revisados por el operador)."""
+    payload = request.get_json(silent=True)
+    data = payload.get("data") if isinstance(payload, dict) else None
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Faltan los datos del documento"}), 400
+    pages = payload.get("pages") or []
+    if not isinstance(pages, list):
+        return jsonify({"status": "error", "message": "pages debe ser una lista"}), 400
+    pages = [str(page) for page in pages]
+    item = get_scan_db().add(uuid.uuid4().hex, "document", {k: str(v) for k, v in data.items()}, pages=pages)
+    return jsonify({"status": "success", "item": item}), 201
+
+@app.route("/api/scans/export", methods=["GET"])
+def export_scans():
+    """Exporta el historial filtrado como CSV o XLSX, enviado por bloques."""
+    export_format = request.args.get("format", "csv")
+    rows = get_scan_db().iter_rows(**search_args())
+    filename = f"Escaneos_{time.strftime('%Y-%m-%d')}.{export_format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if export_format == "csv":
+        return Response(export_rows_csv(rows), mimetype="text/csv", headers=headers)
+    if export_format == "xlsx":
+        if openpyxl is None:
+            return jsonify({"status": "error", "message": "openpyxl no está instalado en el servidor"}), 501
+        return Response(export_rows_xlsx(rows), headers=headers,
+                        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    return jsonify({"status": "error", "message": "Formato no soportado (csv o xlsx)"}), 400
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    info = job_queue.status(job_id)
+    if info is None:
+        return jsonify({"status": "error", "message": "Trabajo no encontrado"}), 404
+    return jsonify({"status": "success", **info})
+
+def scan_files(paths: List[str]):
+    """
+    Modo linea de comandos: python main.py --scan expediente.pdf foto.jpg ...
+    Procesa sin servidor e imprime una linea JSON por pagina.
+    """
+    tasks = []
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        if is_pdf(content):
+            if fitz is None:
+                print(json.dumps({"file": path, "error": "PyMuPDF no está instalado"}, ensure_ascii=False))
+                continue
+            for number, page_bytes in enumerate(split_pdf_pages(content), start=1):
+                tasks.append((path, number, process_pdf_page, page_bytes))
+        else:
+            tasks.append((path, 1, process_scan, content))
+
+    with ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=_init_ocr_worker,
+                             initargs=(new_busy_counter(),)) as executor:
+        futures = [executor.submit(_run_counted, fn, payload) for _, _, fn, payload in tasks]
+        for (path, number, _, _), future in zip(tasks, futures):
+            line = {"file": path, "page": number}
+            try:
+                result = future.result()
+                line.update(data=result["data"], rotation=result["rotation"])
+            except Exception as e:
+                line["error"] = str(e)
+            print(json.dumps(line, ensure_ascii=False))
+
+# --- Modo Produccion (varios workers) ---
+PROD_WORKERS = min(4, os.cpu_count() or 1)
+SERVER_PORT = 8000
+
+def fork_child(target: Callable[[], None]) -> int:
+    """Ejecuta target en un proceso hijo (fork) y devuelve su pid."""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            target()
+        except (KeyboardInterrupt, SystemExit):
+            pass
         except Exception:
-            image = original_image
-
-        # 1. Preprocesamiento SIMPLE (El que funcionaba bien)
-        processed_image = preprocess_image(image)
-        
-        img_str = to_base64_img(processed_image)
-
-        # 2. OCR Loop
-        rotations = [0, 180, 270, 90]
-        best_data = {}
-        best_text = ""
-        max_score = -1 
-
-        for angle in rotations:
-            if angle == 0:
-                img_to_process = processed_image
-            else:
-                img_to_process = processed_image.rotate(angle, expand=True)
-
-            custom_config = r'--oem 3 --psm 6' 
-            text = pytesseract.image_to_string(img_to_process, config=custom_config)
-            
-            data = extract_data_from_text(text)
-            
-            score = 0
-            if "exp_sigad" in data: score += 5
-            if "ruc_contribuyente" in data: score += 4
-            if "res_coactiva" in data: score += 4
-            score += len(data) 
-            
-            logger.info(f"Rotación {angle}° - Score: {score} - Datos: {data}")
-
-            if score > max_score:
-                max_score = score
-                best_data = data
-                best_text = f"[Rotación {angle}°]\n" + text
-            
-            if score >= 15: 
-                break
-        
-        final_data = {
-            "exp_sigad": best_data.get("exp_sigad", ""),
-            "fecha_recepcion": best_data.get("fecha_recepcion", ""),
-            "ruc_contribuyente": best_data.get("ruc_contribuyente", ""),
-            "nombre_contribuyente": best_data.get("nombre_contribuyente", ""),
-            "res_coactiva": best_data.get("res_coactiva", ""),
-            "fecha_rc": best_data.get("fecha_rc", ""),
-            "expediente_rc": best_data.get("expediente_rc", ""),
-            "monto": best_data.get("monto", ""),
-            "ruc_tercero": best_data.get("ruc_tercero", ""),
-            "nombre_tercero": best_data.get("nombre_tercero", ""),
-            "cheque_boleta": best_data.get("cheque_boleta", "")
-        }
-
-        message = {
-            "type": "new_scan",
-            "data": final_data,
-            "raw_text": best_text,
-            "processed_image": img_str
-        }
-        ws_manager.broadcast(message)
+            logger.exception("Proceso hijo terminado con error")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+def prepare_production(workers: int) -> dict:
+    """
+    Lo que comparten los workers del modo produccion, creado una vez en el
+    proceso padre antes de lanzarlos: directorio temporal, almacen de
+    imagenes en disco, hub del bus y contador de escaneos en curso. Lo usan
+    serve_production y los hooks de gunicorn.conf.py.
+    """
+    global scan_store
+    runtime_dir = tempfile.mkdtemp(prefix="scan_server_")
+    # Las imagenes van a disco para que cualquier worker pueda servirlas
+    scan_store = ScanImageStore(directory=SCAN_STORE_DIR or os.path.join(runtime_dir, "scans"))
+    bus_address = os.path.join(runtime_dir, "bus.sock")
+    authkey = os.urandom(16)
+    listener = Listener(bus_address, family="AF_UNIX", authkey=authkey)
+    get_scan_db()  # El esquema se crea una vez, antes de lanzar los workers
+    runtime = {
+        "dir": runtime_dir,
+        "bus_address": bus_address,
+        "authkey": authkey,
+        "listener": listener,
+        "ocr_workers": max(1, OCR_WORKERS // workers),
+        # Un solo contador de escaneos en curso: las rotaciones se reparten la
+        # CPU libre entre los procesos OCR de todos los workers
+        "busy_scans": new_busy_counter(),
+    }
+    runtime["hub_pid"] = fork_child(lambda: run_bus_hub(listener))
+    return runtime
 
-        return jsonify({"status": "success", "data": final_data})
+def start_worker_services(runtime: dict):
+    """Worker HTTP recien creado: su propio JobQueue, conectado al bus."""
+    global job_queue
+    get_scan_db().reset_connections()
+    ocr_workers = runtime["ocr_workers"]
+    job_queue = JobQueue(workers=ocr_workers, limit=ocr_workers * 4, busy_scans=runtime["busy_scans"])
+    scan_bus.connect(runtime["bus_address"], runtime["authkey"])
+    job_queue.publish = scan_bus.publish
+    job_queue.start()
+    threading.Thread(target=share_metrics, name="metrics", daemon=True).start()
+    logger.info(f"Worker {os.getpid()} atendiendo ({ocr_workers} procesos OCR)")
 
-    except Exception as e:
-        logger.error(f"Error procesando imagen: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+def stop_production(runtime: dict):
+    """Detiene el hub y borra el directorio temporal (proceso padre)."""
+    if runtime["hub_pid"]:
+        try:
+            os.kill(runtime["hub_pid"], signal.SIGTERM)
+            os.waitpid(runtime["hub_pid"], 0)
+        except (OSError, ChildProcessError):
+            pass
+        runtime["hub_pid"] = 0
+    runtime["listener"].close()  # Antes de borrar el directorio: al cerrar borra bus.sock
+    shutil.rmtree(runtime["dir"], ignore_errors=True)
+
+def run_http_worker(listen_fd: int, runtime: dict):
+    """
+    Worker HTTP del supervisor propio (--prod), con el servidor threaded de
+    Werkzeug aceptando en el socket compartido. Para gunicorn ver
+    gunicorn.conf.py.
+    """
+    from werkzeug.serving import make_server
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    start_worker_services(runtime)
+    server = make_server("0.0.0.0", SERVER_PORT, app, threaded=True, fd=listen_fd)
+    try:
+        server.serve_forever()
+    finally:
+        job_queue.shutdown()
+
+def serve_production(workers: int = PROD_WORKERS):
+    """
+    Supervisor del modo produccion (solo Linux/macOS, usa fork). Abre el
+    socket de escucha una sola vez y lanza el hub del bus y `workers`
+    procesos HTTP que aceptan conexiones de ese mismo socket; el kernel
+    reparte las conexiones. Si un worker muere se relanza.
+    """
+    if not hasattr(os, "fork"):
+        sys.exit("--prod necesita fork (Linux); en Windows usa el modo normal")
+
+    listen_socket = socket.create_server(("0.0.0.0", SERVER_PORT), backlog=128)
+    runtime = prepare_production(workers)
+    start_worker = lambda: fork_child(lambda: run_http_worker(listen_socket.fileno(), runtime))
+    worker_pids = {start_worker() for _ in range(workers)}
+
+    stopping = False
+    def terminate(pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    def stop(signum=None, frame=None):
+        # El hub se detiene cuando ya no quedan workers que publiquen
+        nonlocal stopping
+        stopping = True
+        terminate(worker_pids if worker_pids else {runtime["hub_pid"]} - {0})
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        while worker_pids or runtime["hub_pid"]:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except KeyboardInterrupt:
+                stop()
+                continue
+            if pid == runtime["hub_pid"]:
+                runtime["hub_pid"] = 0
+                if not stopping:
+                    logger.error("El bus de eventos termino, deteniendo el servidor")
+                    stop()
+            elif pid in worker_pids:
+                worker_pids.discard(pid)
+                if not stopping:
+                    logger.warning(f"Worker {pid} termino (estado {status}), relanzando")
+                    worker_pids.add(start_worker())
+                elif not worker_pids:
+                    terminate({runtime["hub_pid"]} - {0})
+    finally:
+        listen_socket.close()
+        stop_production(runtime)
 
 if __name__ == "__main__":
+    if "--scan" in sys.argv:
+        scan_files(sys.argv[sys.argv.index("--scan") + 1:])
+        sys.exit(0)
+
+    if "--prod" in sys.argv:
+        workers = PROD_WORKERS
+        if "--workers" in sys.argv:
+            workers = max(1, int(sys.argv[sys.argv.index("--workers") + 1]))
+        print(f"--- SERVIDOR (produccion, {workers} workers) ---")
+        print(f"URL PC: http://{get_ip()}:{SERVER_PORT}")
+        serve_production(workers)
+        sys.exit(0)
+
     ip = get_ip()
     print(f"--- SERVIDOR FLASK (Sweet Spot) ---")
     print(f"URL PC: http://{ip}:8000")
     print(f"URL Local: http://127.0.0.1:8000")
+    # Con debug=True el reloader relanza este script: solo el proceso hijo
+    # (WERKZEUG_RUN_MAIN) atiende requests, el padre no necesita el pool
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        job_queue.start()  # Cada worker carga los modelos de idioma una sola vez
     app.run(host="0.0.0.0", port=8000, debug=True)
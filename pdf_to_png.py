@@ -5,11 +5,192 @@ Convierte archivos PDF a imágenes PNG de alta calidad
 
 import os
 import sys
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from pdf2image import convert_from_path
 from PIL import Image
 
-def pdf_to_png(pdf_path, output_folder=None, dpi=300):
+# pdf2image solo hace falta para renderizar; la GUI (PyMuPDF) reutiliza
+# save_page sin necesitar pdf2image ni Poppler
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path
+except ImportError:
+    convert_from_path = pdfinfo_from_path = None
+
+# Páginas que se renderizan a la vez: la memoria queda acotada a este tramo
+CHUNK_PAGES = 8
+
+# Formatos de salida y su extensión
+OUTPUT_FORMATS = {
+    "png": ".png",
+    "tiff-g4": ".tif",   # CCITT Group 4, 1 bit: el más compacto para OCR/archivo
+    "webp": ".webp",     # WebP sin pérdida
+}
+# color: RGB tal cual | gray: 8 bits | bw: 1 bit con umbral fijo (sin tramado)
+COLOR_MODES = ("color", "gray", "bw")
+BW_THRESHOLD = 160
+BW_TABLE = [255 if value >= BW_THRESHOLD else 0 for value in range(256)]
+
+
+def output_options(fmt="png", color="color", compress_level=6):
+    """
+    Opciones de guardado de las páginas.
+    
+    Args:
+        fmt (str): Formato de OUTPUT_FORMATS
+        color (str): Modo de COLOR_MODES (TIFF Group 4 siempre es 1 bit)
+        compress_level (int): 0 (rápido, más grande) a 9 (lento, más chico)
+    
+    Returns:
+        dict: Opciones para save_page
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt} (usa {', '.join(OUTPUT_FORMATS)})")
+    if color not in COLOR_MODES:
+        raise ValueError(f"Modo de color desconocido: {color} (usa {', '.join(COLOR_MODES)})")
+    if fmt == "tiff-g4":
+        color = "bw"
+    return {"format": fmt, "color": color, "compress_level": max(0, min(9, int(compress_level)))}
+
+
+DEFAULT_OUTPUT = output_options()
+
+
+def save_page(image, output_path, output=DEFAULT_OUTPUT):
+    """Guarda una página con el formato, color y compresión de output"""
+    if output["color"] == "gray" and image.mode != "L":
+        image = image.convert("L")
+    elif output["color"] == "bw":
+        image = image.convert("L").point(BW_TABLE, mode="1")
+    
+    level = output["compress_level"]
+    if output["format"] == "png":
+        image.save(output_path, "PNG", compress_level=level)
+    elif output["format"] == "tiff-g4":
+        image.save(output_path, "TIFF", compression="group4")
+    else:
+        if image.mode == "1":
+            image = image.convert("L")
+        # En WebP sin pérdida 'method' es el esfuerzo de compresión (0-6)
+        image.save(output_path, "WEBP", lossless=True, method=round(level * 6 / 9))
+
+
+def page_output_path(output_folder, pdf_name, page, total_pages, extension=".png"):
+    """Ruta de la imagen de una página (sin sufijo si el PDF tiene una sola)"""
+    if total_pages == 1:
+        return os.path.join(output_folder, f"{pdf_name}{extension}")
+    return os.path.join(output_folder, f"{pdf_name}_pagina_{page}{extension}")
+
+
+def render_page_range(pdf_path, output_folder, dpi, first_page, last_page, total_pages, thread_count=1,
+                      output=DEFAULT_OUTPUT):
+    """
+    Renderiza y guarda las páginas first_page..last_page de un PDF.
+    
+    Yields:
+        tuple: (página, ruta de la imagen) por cada página guardada
+    """
+    pdf_name = Path(pdf_path).stem
+    extension = OUTPUT_FORMATS[output["format"]]
+    # Poppler renderiza directo en gris: menos memoria y menos trabajo al guardar
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                               thread_count=thread_count, grayscale=output["color"] != "color")
+    
+    for page, image in enumerate(images, start=first_page):
+        output_path = page_output_path(output_folder, pdf_name, page, total_pages, extension)
+        save_page(image, output_path, output)
+        image.close()
+        yield page, output_path
+
+
+def iter_pdf_pages(pdf_path, output_folder, dpi=300, chunk_size=CHUNK_PAGES, thread_count=1,
+                   output=DEFAULT_OUTPUT):
+    """
+    Renderiza y guarda el PDF por tramos de páginas (first_page/last_page),
+    de modo que nunca hay más de chunk_size imágenes en memoria.
+    
+    Args:
+        pdf_path (str): Ruta al archivo PDF
+        output_folder (str): Carpeta de salida (debe existir)
+        dpi (int): Resolución de las imágenes
+        chunk_size (int): Páginas por tramo
+        thread_count (int): Procesos pdftoppm por tramo
+        output (dict): Opciones de guardado (ver output_options)
+    
+    Yields:
+        tuple: (página, total de páginas, ruta del PNG) por cada página guardada
+    """
+    total_pages = pdfinfo_from_path(pdf_path)["Pages"]
+    chunk_size = max(1, chunk_size)
+
+    for first_page in range(1, total_pages + 1, chunk_size):
+        last_page = min(first_page + chunk_size - 1, total_pages)
+        for page, output_path in render_page_range(pdf_path, output_folder, dpi, first_page, last_page,
+                                                   total_pages, thread_count, output):
+            yield page, total_pages, output_path
+
+
+def _convert_range_worker(pdf_path, output_folder, dpi, first_page, last_page, total_pages, output):
+    """Tarea del pool de procesos: un tramo de páginas de un PDF"""
+    return list(render_page_range(pdf_path, output_folder, dpi, first_page, last_page, total_pages,
+                                  output=output))
+
+
+def convert_parallel(pdf_files, output_folder=None, dpi=300, chunk_size=CHUNK_PAGES, workers=2, progress=None,
+                     output=DEFAULT_OUTPUT):
+    """
+    Reparte las páginas de varios PDFs entre un pool de procesos. Cada
+    tarea es un tramo de páginas, así un PDF grande también se reparte.
+    
+    Returns:
+        dict: {pdf: lista de PNGs en orden de página} (vacía si el PDF falló)
+    """
+    results = {}
+    tasks = []
+    for pdf_file in pdf_files:
+        pdf_path = str(pdf_file)
+        folder = output_folder if output_folder is not None else str(Path(pdf_path).parent)
+        try:
+            total_pages = pdfinfo_from_path(pdf_path)["Pages"]
+        except Exception as e:
+            print(f"❌ Error leyendo {pdf_path}: {str(e)}")
+            results[pdf_path] = []
+            continue
+        results[pdf_path] = {}
+        # Tramos más cortos si hay pocos PDFs, para que todos los procesos trabajen
+        step = max(1, min(chunk_size, -(-total_pages // workers)))
+        for first_page in range(1, total_pages + 1, step):
+            last_page = min(first_page + step - 1, total_pages)
+            tasks.append((pdf_path, folder, dpi, first_page, last_page, total_pages, output))
+
+    failed = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_convert_range_worker, *task): task for task in tasks}
+        for future in as_completed(futures):
+            pdf_path, _, _, first_page, last_page, total_pages, _ = futures[future]
+            try:
+                pages = future.result()
+            except Exception as e:
+                print(f"❌ Error en {pdf_path} (páginas {first_page}-{last_page}): {str(e)}")
+                failed.add(pdf_path)
+                continue
+            for page, output_path in pages:
+                results[pdf_path][page] = output_path
+                print(f"✅ {Path(pdf_path).name}: página {page}/{total_pages} guardada: {output_path}")
+                if progress is not None:
+                    progress(page, total_pages, output_path)
+
+    # Un PDF con algún tramo fallido cuenta como error completo
+    return {
+        pdf_path: [] if pdf_path in failed else [pages[page] for page in sorted(pages)]
+        for pdf_path, pages in results.items()
+    }
+
+
+def pdf_to_png(pdf_path, output_folder=None, dpi=300, chunk_size=CHUNK_PAGES, progress=None, thread_count=1,
+               output=DEFAULT_OUTPUT):
     """
     Convierte un archivo PDF a imágenes PNG
     
@@ -17,9 +198,13 @@ def pdf_to_png(pdf_path, output_folder=None, dpi=300):
         pdf_path (str): Ruta al archivo PDF
         output_folder (str): Carpeta de salida (opcional, por defecto usa la misma carpeta del PDF)
         dpi (int): Resolución de las imágenes (por defecto 300 DPI para alta calidad)
+        chunk_size (int): Páginas renderizadas a la vez (acota la memoria)
+        progress (callable): Opcional, se llama con (página, total, ruta) por cada página
+        thread_count (int): Procesos pdftoppm por tramo
+        output (dict): Formato, color y compresión (ver output_options)
     
     Returns:
-        list: Lista de rutas a las imágenes PNG generadas
+        list: Lista de rutas a las imágenes generadas
     """
     try:
         # Validar que el archivo existe
@@ -27,9 +212,6 @@ def pdf_to_png(pdf_path, output_folder=None, dpi=300):
             print(f"❌ Error: El archivo '{pdf_path}' no existe")
             return []
         
-        # Obtener nombre base del PDF
-        pdf_name = Path(pdf_path).stem
-        
         # Definir carpeta de salida
         if output_folder is None:
             output_folder = Path(pdf_path).parent
@@ -39,30 +221,21 @@ def pdf_to_png(pdf_path, output_folder=None, dpi=300):
         print(f"📄 Convirtiendo: {pdf_path}")
         print(f"📁 Carpeta de salida: {output_folder}")
         print(f"🎯 Resolución: {dpi} DPI")
-        
-        # Convertir PDF a imágenes
-        images = convert_from_path(pdf_path, dpi=dpi)
+        print(f"🗜️  Salida: {output['format']} · {output['color']} · compresión {output['compress_level']}")
         
         output_paths = []
-        total_pages = len(images)
+        total_pages = 0
         
-        print(f"📊 Total de páginas: {total_pages}")
-        
-        # Guardar cada página como PNG
-        for i, image in enumerate(images, start=1):
-            # Nombre del archivo de salida
-            if total_pages == 1:
-                output_path = os.path.join(output_folder, f"{pdf_name}.png")
-            else:
-                output_path = os.path.join(output_folder, f"{pdf_name}_pagina_{i}.png")
-            
-            # Guardar imagen
-            image.save(output_path, 'PNG', optimize=True)
+        # Renderizar y guardar por tramos (las páginas no se acumulan en memoria)
+        for page, total_pages, output_path in iter_pdf_pages(pdf_path, output_folder, dpi, chunk_size, thread_count, output):
+            if page == 1:
+                print(f"📊 Total de páginas: {total_pages}")
             output_paths.append(output_path)
-            
-            print(f"✅ Página {i}/{total_pages} guardada: {output_path}")
+            print(f"✅ Página {page}/{total_pages} guardada: {output_path}")
+            if progress is not None:
+                progress(page, total_pages, output_path)
         
-        print(f"\n🎉 ¡Conversión completada! {total_pages} imagen(es) generada(s)")
+        print(f"\n🎉 ¡Conversión completada! {len(output_paths)} imagen(es) generada(s)")
         return output_paths
         
     except Exception as e:
@@ -70,7 +243,91 @@ def pdf_to_png(pdf_path, output_folder=None, dpi=300):
         return []
 
 
-def batch_convert(input_folder, output_folder=None, dpi=300):
+# --- Manifiesto de conversión incremental ---
+# Un archivo por carpeta de salida: qué PDF generó qué páginas y con qué opciones
+MANIFEST_NAME = ".pdf_to_png_manifest.json"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def conversion_settings(dpi, output):
+    """Opciones que, si cambian, obligan a reconvertir"""
+    return {"dpi": dpi, **output}
+
+
+def load_manifest(folder):
+    """Lee el manifiesto de una carpeta de salida (vacío si no existe o está dañado)"""
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get("files"), dict):
+            return manifest
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {"files": {}}
+
+
+def save_manifest(folder, manifest):
+    """Escritura atómica: un corte a mitad no deja un manifiesto a medias"""
+    path = os.path.join(folder, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(manifest, folder, pdf_path, settings):
+    """
+    True si el PDF ya se convirtió con estas opciones, no cambió y sus
+    salidas siguen en disco. Tamaño+mtime es el filtro rápido; el hash
+    solo se calcula si el archivo fue tocado (y si coincide, se anota el
+    nuevo mtime para no volver a calcularlo).
+    """
+    entry = manifest["files"].get(os.path.abspath(pdf_path))
+    if entry is None or entry.get("settings") != settings:
+        return False
+    if not all(os.path.exists(os.path.join(folder, name)) for name in entry.get("outputs", [])):
+        return False
+    stat = os.stat(pdf_path)
+    if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+        return True
+    if entry.get("size") != stat.st_size or entry.get("sha256") != file_sha256(pdf_path):
+        return False
+    entry["mtime"] = stat.st_mtime
+    return True
+
+
+def record_outputs(manifest, folder, pdf_path, settings, outputs):
+    """
+    Anota una conversión terminada y borra las salidas de la conversión
+    anterior que ya no corresponden (páginas eliminadas, cambio de formato).
+    """
+    key = os.path.abspath(pdf_path)
+    names = [os.path.basename(path) for path in outputs]
+    previous = manifest["files"].get(key, {}).get("outputs", [])
+    for name in set(previous) - set(names):
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass
+    stat = os.stat(pdf_path)
+    manifest["files"][key] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": file_sha256(pdf_path),
+        "settings": settings,
+        "outputs": names,
+    }
+
+
+def batch_convert(input_folder, output_folder=None, dpi=300, chunk_size=CHUNK_PAGES, progress=None, workers=1,
+                  output=DEFAULT_OUTPUT, incremental=True):
     """
     Convierte todos los PDFs de una carpeta a PNG
     
@@ -78,21 +335,93 @@ def batch_convert(input_folder, output_folder=None, dpi=300):
         input_folder (str): Carpeta con archivos PDF
         output_folder (str): Carpeta de salida (opcional)
         dpi (int): Resolución de las imágenes
+        chunk_size (int): Páginas renderizadas a la vez por PDF
+        progress (callable): Opcional, se llama con (página, total, ruta) por cada página
+        workers (int): Procesos en paralelo (reparte páginas, no solo archivos)
+        output (dict): Formato, color y compresión (ver output_options)
+        incremental (bool): Omitir PDFs sin cambios según el manifiesto de la carpeta de salida
+    
+    Returns:
+        dict: {pdf: lista de imágenes generadas} (solo los PDFs convertidos en esta corrida)
     """
-    pdf_files = list(Path(input_folder).glob("*.pdf"))
+    pdf_files = sorted(Path(input_folder).glob("*.pdf"))
     
     if not pdf_files:
         print(f"❌ No se encontraron archivos PDF en '{input_folder}'")
-        return
+        return {}
     
     print(f"📂 Encontrados {len(pdf_files)} archivo(s) PDF")
+    
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+    settings = conversion_settings(dpi, output)
+    manifests = {}
+    
+    def folder_of(pdf_file):
+        return output_folder if output_folder is not None else str(Path(pdf_file).parent)
+    
+    skipped = 0
+    if incremental:
+        pending = []
+        for pdf_file in pdf_files:
+            folder = folder_of(pdf_file)
+            if folder not in manifests:
+                manifests[folder] = load_manifest(folder)
+            try:
+                up_to_date = is_up_to_date(manifests[folder], folder, pdf_file, settings)
+            except OSError as e:
+                # No se pudo comprobar (p. ej. borrado a mitad): que lo intente la conversión
+                print(f"⚠️  {pdf_file.name}: {str(e)}")
+                up_to_date = False
+            if up_to_date:
+                skipped += 1
+            else:
+                pending.append(pdf_file)
+        pdf_files = pending
+        print(f"⏭️  {skipped} sin cambios, {len(pdf_files)} por convertir")
     print("=" * 60)
     
-    for pdf_file in pdf_files:
-        pdf_to_png(str(pdf_file), output_folder, dpi)
+    start = time.perf_counter()
+    if workers > 1 and pdf_files:
+        print(f"⚡ Convirtiendo con {workers} procesos")
+        results = convert_parallel(pdf_files, output_folder, dpi, chunk_size, workers, progress, output)
         print("=" * 60)
+    else:
+        results = {}
+        for pdf_file in pdf_files:
+            results[str(pdf_file)] = pdf_to_png(str(pdf_file), output_folder, dpi, chunk_size, progress, output=output)
+            print("=" * 60)
+    elapsed = time.perf_counter() - start
+    
+    if incremental:
+        for pdf_path, paths in results.items():
+            manifest = manifests[folder_of(pdf_path)]
+            if paths:
+                try:
+                    record_outputs(manifest, folder_of(pdf_path), pdf_path, settings, paths)
+                    continue
+                except OSError as e:
+                    print(f"⚠️  {os.path.basename(pdf_path)}: no se pudo anotar en el manifiesto: {str(e)}")
+            # Falló (o no se pudo anotar): se vuelve a intentar en la próxima corrida
+            manifest["files"].pop(os.path.abspath(pdf_path), None)
+        for folder, manifest in manifests.items():
+            try:
+                save_manifest(folder, manifest)
+            except OSError as e:
+                print(f"⚠️  No se pudo guardar el manifiesto en {folder}: {str(e)}")
     
-    print(f"\n✨ ¡Proceso completado! {len(pdf_files)} PDF(s) convertido(s)")
+    # Resumen combinado
+    total_pages = sum(len(paths) for paths in results.values())
+    failed = [pdf_path for pdf_path, paths in results.items() if not paths]
+    print(f"\n✨ ¡Proceso completado! {len(results) - len(failed)} PDF(s) convertido(s)")
+    if skipped:
+        print(f"⏭️  {skipped} PDF(s) sin cambios omitido(s)")
+    print(f"📊 {total_pages} página(s) en {elapsed:.1f}s ({total_pages / max(elapsed, 1e-6):.1f} pág/s)")
+    if failed:
+        print(f"⚠️  {len(failed)} PDF(s) con errores:")
+        for pdf_path in failed:
+            print(f"   - {pdf_path}")
+    return results
 
 
 if __name__ == "__main__":
@@ -100,6 +429,45 @@ if __name__ == "__main__":
     print("🖼️  PDF to PNG Converter")
     print("=" * 60)
     
+    # Opciones con nombre (se retiran de argv antes de leer los posicionales)
+    def pop_int_option(name, default):
+        if name not in sys.argv:
+            return default
+        index = sys.argv.index(name)
+        try:
+            value = int(sys.argv[index + 1])
+        except (IndexError, ValueError):
+            print(f"❌ Error: {name} requiere un número")
+            sys.exit(1)
+        del sys.argv[index:index + 2]
+        return value
+    
+    def pop_option(name, default):
+        if name not in sys.argv:
+            return default
+        index = sys.argv.index(name)
+        if index + 1 >= len(sys.argv):
+            print(f"❌ Error: {name} requiere un valor")
+            sys.exit(1)
+        value = sys.argv[index + 1]
+        del sys.argv[index:index + 2]
+        return value
+    
+    force = "--force" in sys.argv
+    if force:
+        sys.argv.remove("--force")
+    chunk_size = pop_int_option("--chunk", CHUNK_PAGES)
+    workers = pop_int_option("--workers", 1)
+    try:
+        output = output_options(
+            pop_option("--format", "png"),
+            pop_option("--color", "color"),
+            pop_int_option("--compress", 6)
+        )
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
+    
     # Modo de uso
     if len(sys.argv) < 2:
         print("\n📖 Uso:")
@@ -112,6 +480,13 @@ if __name__ == "__main__":
         print("  python pdf_to_png.py documento.pdf ./imagenes 600")
         print("\n💡 Para convertir todos los PDFs de una carpeta:")
         print("  python pdf_to_png.py --batch <carpeta_entrada> [carpeta_salida] [dpi]")
+        print("\n⚙️  Opciones:")
+        print(f"  --chunk <n>     Páginas renderizadas a la vez (por defecto {CHUNK_PAGES})")
+        print("  --workers <n>   Procesos en paralelo (por defecto 1)")
+        print(f"  --format <f>    {' | '.join(OUTPUT_FORMATS)} (por defecto png)")
+        print(f"  --color <m>     {' | '.join(COLOR_MODES)} (por defecto color)")
+        print("  --compress <n>  0 (rápido) a 9 (más chico), por defecto 6")
+        print("  --force         Reconvertir también los PDFs sin cambios (modo batch)")
         sys.exit(1)
     
     # Modo batch
@@ -124,7 +499,8 @@ if __name__ == "__main__":
         output_folder = sys.argv[3] if len(sys.argv) > 3 else None
         dpi = int(sys.argv[4]) if len(sys.argv) > 4 else 300
         
-        batch_convert(input_folder, output_folder, dpi)
+        batch_convert(input_folder, output_folder, dpi, chunk_size, workers=workers, output=output,
+                      incremental=not force)
     
     # Modo archivo único
     else:
@@ -132,4 +508,5 @@ if __name__ == "__main__":
         output_folder = sys.argv[2] if len(sys.argv) > 2 else None
         dpi = int(sys.argv[3]) if len(sys.argv) > 3 else 300
         
-        pdf_to_png(pdf_path, output_folder, dpi)
+        # Un solo PDF: los procesos se usan como hilos de pdftoppm
+        pdf_to_png(pdf_path, output_folder, dpi, chunk_size, thread_count=workers, output=output)
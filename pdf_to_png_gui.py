@@ -5,13 +5,66 @@ Usa PyMuPDF (fitz) - No requiere Poppler
 
 import os
 import sys
+import time
+import queue
+import multiprocessing
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from tkinter.scrolledtext import ScrolledText
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from PIL import Image
 import threading
 
+from pdf_to_png import (
+    OUTPUT_FORMATS, COLOR_MODES, output_options, page_output_path, save_page,
+    conversion_settings, load_manifest, save_manifest, is_up_to_date, record_outputs
+)
+
+# Procesos de renderizado (una página por tarea)
+RENDER_WORKERS = os.cpu_count() or 1
+# Documentos abiertos que cada proceso mantiene en cache
+WORKER_OPEN_DOCS = 4
+# Cada cuánto la UI vacía la cola de eventos del hilo coordinador (ms)
+UI_POLL_MS = 100
+
+# Estado propio de cada proceso del pool
+_worker_docs = {}
+_worker_matrices = {}
+
+
+def render_pdf_page(pdf_path, output_folder, zoom, page_num, total_pages, output):
+    """
+    Renderiza una página dentro de un proceso del pool. El documento fitz
+    y la matriz de zoom se abren una vez por proceso y se reutilizan.
+    """
+    import fitz  # PyMuPDF
+
+    doc = _worker_docs.get(pdf_path)
+    if doc is None:
+        if len(_worker_docs) >= WORKER_OPEN_DOCS:
+            oldest = next(iter(_worker_docs))
+            _worker_docs.pop(oldest).close()
+        doc = _worker_docs[pdf_path] = fitz.open(pdf_path)
+
+    mat = _worker_matrices.get(zoom)
+    if mat is None:
+        mat = _worker_matrices[zoom] = fitz.Matrix(zoom, zoom)
+
+    output_path = page_output_path(output_folder, Path(pdf_path).stem, page_num + 1, total_pages,
+                                   OUTPUT_FORMATS[output["format"]])
+
+    # En gris/1 bit se renderiza directo en un canal
+    if output["color"] == "color":
+        pix = doc[page_num].get_pixmap(matrix=mat)
+        image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    else:
+        pix = doc[page_num].get_pixmap(matrix=mat, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    save_page(image, output_path, output)
+    return output_path
+
+
 class PDFtoPNGConverter:
     def __init__(self, root):
         self.root = root
@@ -23,7 +76,14 @@ class PDFtoPNGConverter:
         self.pdf_files = []
         self.output_folder = None
         self.dpi_var = tk.IntVar(value=300)
+        self.format_var = tk.StringVar(value="png")
+        self.color_var = tk.StringVar(value="color")
+        self.compress_var = tk.IntVar(value=6)
+        self.incremental_var = tk.BooleanVar(value=True)
         self.is_converting = False
+        # El hilo coordinador no toca widgets: publica eventos en esta cola
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
         
         self.setup_ui()
     
@@ -189,6 +249,63 @@ class PDFtoPNGConverter:
                 activebackground="white"
             ).pack(side=tk.LEFT, padx=10)
         
+        # Formato de salida
+        tk.Label(
+            config_inner,
+            text="🗜️ Formato:",
+            font=("Segoe UI", 10),
+            bg="white",
+            fg="#334155"
+        ).grid(row=2, column=0, sticky=tk.W, pady=5)
+        
+        format_frame = tk.Frame(config_inner, bg="white")
+        format_frame.grid(row=2, column=1, columnspan=2, sticky=tk.W, padx=10)
+        
+        ttk.Combobox(
+            format_frame,
+            textvariable=self.format_var,
+            values=list(OUTPUT_FORMATS),
+            state="readonly",
+            width=8
+        ).pack(side=tk.LEFT, padx=(10, 5))
+        
+        ttk.Combobox(
+            format_frame,
+            textvariable=self.color_var,
+            values=list(COLOR_MODES),
+            state="readonly",
+            width=7
+        ).pack(side=tk.LEFT, padx=5)
+        
+        tk.Label(
+            format_frame,
+            text="Compresión (0-9):",
+            font=("Segoe UI", 9),
+            bg="white",
+            fg="#334155"
+        ).pack(side=tk.LEFT, padx=(10, 5))
+        
+        tk.Spinbox(
+            format_frame,
+            from_=0,
+            to=9,
+            textvariable=self.compress_var,
+            width=3,
+            font=("Segoe UI", 9)
+        ).pack(side=tk.LEFT)
+        
+        # Conversión incremental
+        tk.Checkbutton(
+            config_inner,
+            text="⏭️ Omitir PDFs sin cambios (ya convertidos con estas opciones)",
+            variable=self.incremental_var,
+            font=("Segoe UI", 9),
+            bg="white",
+            fg="#334155",
+            selectcolor="#e4f3ff",
+            activebackground="white"
+        ).grid(row=3, column=0, columnspan=3, sticky=tk.W, pady=5)
+        
         # Botón de conversión
         self.btn_convert = tk.Button(
             main_frame,
@@ -204,13 +321,37 @@ class PDFtoPNGConverter:
         )
         self.btn_convert.pack(fill=tk.X, pady=(0, 10))
         
+        self.btn_cancel = tk.Button(
+            main_frame,
+            text="⛔ Cancelar",
+            command=self.cancel_conversion,
+            bg="#64748b",
+            fg="white",
+            font=("Segoe UI", 10, "bold"),
+            relief=tk.FLAT,
+            padx=20,
+            pady=8,
+            cursor="hand2",
+            state=tk.DISABLED
+        )
+        self.btn_cancel.pack(fill=tk.X, pady=(0, 10))
+        
         # Barra de progreso
         self.progress = ttk.Progressbar(
             main_frame,
-            mode='indeterminate',
+            mode='determinate',
             length=300
         )
-        self.progress.pack(fill=tk.X, pady=(0, 10))
+        self.progress.pack(fill=tk.X, pady=(0, 5))
+        
+        self.progress_label = tk.Label(
+            main_frame,
+            text="",
+            font=("Segoe UI", 9),
+            bg="#f0f4f8",
+            fg="#334155"
+        )
+        self.progress_label.pack(fill=tk.X, pady=(0, 10))
         
         # Log de salida
         log_section = tk.LabelFrame(
@@ -288,7 +429,7 @@ class PDFtoPNGConverter:
             self.log(f"📁 Carpeta de salida: {folder}")
     
     def start_conversion(self):
-        """Iniciar conversión en un hilo separado"""
+        """Iniciar conversión en un hilo coordinador + pool de procesos"""
         if not self.pdf_files:
             messagebox.showwarning("Sin archivos", "Por favor selecciona al menos un archivo PDF")
             return
@@ -297,88 +438,195 @@ class PDFtoPNGConverter:
             messagebox.showinfo("En proceso", "Ya hay una conversión en progreso")
             return
         
-        # Iniciar conversión en hilo separado
-        thread = threading.Thread(target=self.convert_pdfs, daemon=True)
-        thread.start()
-    
-    def convert_pdfs(self):
-        """Convertir todos los PDFs seleccionados usando PyMuPDF"""
-        self.is_converting = True
-        self.btn_convert.config(state=tk.DISABLED, bg="#64748b")
-        self.progress.start()
-        
         # Verificar PyMuPDF
         try:
             import fitz  # PyMuPDF
         except ImportError:
             self.log("❌ Error: PyMuPDF no está instalado")
             self.log("   Ejecuta: pip install PyMuPDF")
-            self.progress.stop()
-            self.btn_convert.config(state=tk.NORMAL, bg="#10b981")
-            self.is_converting = False
             messagebox.showerror(
                 "PyMuPDF Requerido",
                 "PyMuPDF no está instalado.\n\nEjecuta:\npip install PyMuPDF"
             )
             return
         
-        dpi = self.dpi_var.get()
-        zoom = dpi / 72  # 72 DPI es la resolución base de PDF
-        total_files = len(self.pdf_files)
-        successful = 0
+        try:
+            output = output_options(self.format_var.get(), self.color_var.get(), self.compress_var.get())
+        except (ValueError, tk.TclError) as e:
+            messagebox.showerror("Formato inválido", str(e))
+            return
         
-        self.log("\n" + "="*60)
-        self.log(f"🚀 Iniciando conversión de {total_files} archivo(s)")
-        self.log(f"🎯 Calidad: {dpi} DPI (zoom: {zoom:.2f}x)")
-        self.log("="*60 + "\n")
+        self.is_converting = True
+        self.cancel_event.clear()
+        self.btn_convert.config(state=tk.DISABLED, bg="#64748b")
+        self.btn_cancel.config(state=tk.NORMAL, bg="#dc2626")
+        self.progress.config(value=0, maximum=1)
+        self.progress_label.config(text="")
+        
+        # Los widgets/variables Tk se leen aquí, en el hilo principal
+        thread = threading.Thread(
+            target=self.convert_pdfs,
+            args=(list(self.pdf_files), self.output_folder, self.dpi_var.get(), output,
+                  self.incremental_var.get()),
+            daemon=True
+        )
+        thread.start()
+        self.root.after(UI_POLL_MS, self.poll_events)
+    
+    def cancel_conversion(self):
+        """Detener la conversión: las páginas pendientes se descartan"""
+        if self.is_converting and not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.btn_cancel.config(state=tk.DISABLED, bg="#64748b")
+            self.log("⛔ Cancelando... esperando las páginas en curso")
+    
+    def poll_events(self):
+        """Aplica en la UI los eventos publicados por el hilo coordinador"""
+        try:
+            while True:
+                self.handle_event(*self.events.get_nowait())
+        except queue.Empty:
+            pass
+        if self.is_converting:
+            self.root.after(UI_POLL_MS, self.poll_events)
+    
+    def handle_event(self, kind, *args):
+        if kind == "log":
+            self.log(args[0])
+        elif kind == "start":
+            total_pages, = args
+            self.progress.config(maximum=max(1, total_pages), value=0)
+            self.started_at = time.perf_counter()
+        elif kind == "page":
+            done, total_pages = args
+            elapsed = max(time.perf_counter() - self.started_at, 1e-6)
+            self.progress.config(value=done)
+            self.progress_label.config(
+                text=f"{done}/{total_pages} páginas · {done / elapsed:.1f} pág/s"
+            )
+        elif kind == "error":
+            pdf_path, message = args
+            self.log(f"❌ {os.path.basename(pdf_path)}: {message}")
+        elif kind == "finish":
+            self.finish_conversion(*args)
+    
+    def convert_pdfs(self, pdf_files, output_folder, dpi, output, incremental=True):
+        """
+        Hilo coordinador: reparte las páginas de todos los PDFs entre
+        RENDER_WORKERS procesos y publica el avance en self.events.
+        Un error en un archivo se informa y se sigue con el resto; "finish"
+        se publica siempre para que la UI salga del modo conversión.
+        """
+        import fitz  # PyMuPDF
+        
+        post = self.events.put
+        zoom = dpi / 72  # 72 DPI es la resolución base de PDF
+        total_files = len(pdf_files)
+        pages_left = {}
+        failed = set()
+        skipped = 0
+        cancelled = False
         
-        for i, pdf_path in enumerate(self.pdf_files, 1):
-            try:
-                self.log(f"📄 [{i}/{total_files}] Procesando: {os.path.basename(pdf_path)}")
-                
-                # Determinar carpeta de salida
-                output_folder = self.output_folder if self.output_folder else str(Path(pdf_path).parent)
-                pdf_name = Path(pdf_path).stem
-                
-                # Abrir PDF
-                doc = fitz.open(pdf_path)
-                total_pages = len(doc)
-                
-                # Convertir cada página
+        try:
+            post(("log", "\n" + "="*60))
+            post(("log", f"🚀 Iniciando conversión de {total_files} archivo(s)"))
+            post(("log", f"🎯 Calidad: {dpi} DPI (zoom: {zoom:.2f}x) · {RENDER_WORKERS} proceso(s)"))
+            post(("log", f"🗜️ Salida: {output['format']} · {output['color']} · compresión {output['compress_level']}"))
+            post(("log", "="*60 + "\n"))
+            
+            # Contar páginas de cada PDF (abrir un documento es barato)
+            tasks = []
+            outputs = {}
+            settings = conversion_settings(dpi, output)
+            manifests = {}
+            for pdf_path in pdf_files:
+                folder = output_folder if output_folder else str(Path(pdf_path).parent)
+                try:
+                    if incremental:
+                        if folder not in manifests:
+                            manifests[folder] = load_manifest(folder)
+                        if is_up_to_date(manifests[folder], folder, pdf_path, settings):
+                            skipped += 1
+                            continue
+                    with fitz.open(pdf_path) as doc:
+                        total_pages = doc.page_count
+                except Exception as e:
+                    post(("error", pdf_path, str(e)))
+                    failed.add(pdf_path)
+                    continue
+                pages_left[pdf_path] = total_pages
+                outputs[pdf_path] = {}
                 for page_num in range(total_pages):
-                    page = doc[page_num]
-                    
-                    # Crear matriz de transformación para el zoom
-                    mat = fitz.Matrix(zoom, zoom)
-                    
-                    # Renderizar página a imagen
-                    pix = page.get_pixmap(matrix=mat)
-                    
-                    # Nombre del archivo de salida
-                    if total_pages == 1:
-                        output_path = os.path.join(output_folder, f"{pdf_name}.png")
+                    tasks.append((pdf_path, folder, zoom, page_num, total_pages, output))
+            
+            if skipped:
+                post(("log", f"⏭️ {skipped} archivo(s) sin cambios omitido(s)"))
+            total_pages_all = len(tasks)
+            post(("start", total_pages_all))
+            done = 0
+            
+            executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+            try:
+                futures = {executor.submit(render_pdf_page, *task): task for task in tasks}
+                for future in as_completed(futures):
+                    if self.cancel_event.is_set():
+                        cancelled = True
+                        break
+                    pdf_path, _, _, page_num, total_pages, _ = futures[future]
+                    try:
+                        outputs[pdf_path][page_num] = future.result()
+                    except Exception as e:
+                        post(("log", f"   ❌ {os.path.basename(pdf_path)} página {page_num + 1}: {str(e)}"))
+                        failed.add(pdf_path)
                     else:
-                        output_path = os.path.join(output_folder, f"{pdf_name}_pagina_{page_num + 1}.png")
-                    
-                    # Guardar como PNG
-                    pix.save(output_path)
-                    self.log(f"   ✅ Página {page_num + 1}/{total_pages} guardada")
-                
-                doc.close()
-                successful += 1
-                self.log(f"   🎉 Completado: {total_pages} imagen(es) generada(s)\n")
-                
-            except Exception as e:
-                self.log(f"   ❌ Error: {str(e)}\n")
-        
+                        pages_left[pdf_path] -= 1
+                        if pages_left[pdf_path] == 0 and pdf_path not in failed:
+                            post(("log", f"🎉 {os.path.basename(pdf_path)}: {total_pages} imagen(es) generada(s)"))
+                            if incremental:
+                                folder = output_folder if output_folder else str(Path(pdf_path).parent)
+                                pages = outputs[pdf_path]
+                                try:
+                                    record_outputs(manifests[folder], folder, pdf_path, settings,
+                                                   [pages[number] for number in sorted(pages)])
+                                except OSError as e:
+                                    # Las imágenes están bien; sin anotar se reconvierte la próxima vez
+                                    manifests[folder]["files"].pop(os.path.abspath(pdf_path), None)
+                                    post(("error", pdf_path, f"no se pudo anotar en el manifiesto: {str(e)}"))
+                    done += 1
+                    post(("page", done, total_pages_all))
+            finally:
+                # Las páginas en curso terminan; las pendientes se descartan
+                executor.shutdown(wait=True, cancel_futures=True)
+                # Solo quedan anotados los PDFs completos; el resto se reintenta
+                for folder, manifest in manifests.items():
+                    for pdf_path in failed:
+                        manifest["files"].pop(os.path.abspath(pdf_path), None)
+                    try:
+                        save_manifest(folder, manifest)
+                    except OSError as e:
+                        post(("log", f"⚠️ No se pudo guardar el manifiesto en {folder}: {str(e)}"))
+        except Exception as e:
+            post(("log", f"❌ Error inesperado en la conversión: {str(e)}"))
+        finally:
+            successful = skipped + sum(1 for pdf_path, left in pages_left.items()
+                                       if left == 0 and pdf_path not in failed)
+            post(("finish", successful, total_files, cancelled))
+    
+    def finish_conversion(self, successful, total_files, cancelled):
+        """Cierre de la conversión (hilo principal)"""
         self.log("="*60)
-        self.log(f"✨ Proceso completado: {successful}/{total_files} archivo(s) convertido(s)")
+        if cancelled:
+            self.log(f"⛔ Conversión cancelada: {successful}/{total_files} archivo(s) completo(s)")
+        else:
+            self.log(f"✨ Proceso completado: {successful}/{total_files} archivo(s) convertido(s)")
         self.log("="*60 + "\n")
         
-        self.progress.stop()
         self.btn_convert.config(state=tk.NORMAL, bg="#10b981")
+        self.btn_cancel.config(state=tk.DISABLED, bg="#64748b")
         self.is_converting = False
         
+        if cancelled:
+            return
         if successful > 0:
             messagebox.showinfo(
                 "Conversión Completada",
@@ -392,6 +640,8 @@ class PDFtoPNGConverter:
 
 
 if __name__ == "__main__":
+    # Necesario para el pool de procesos en ejecutables congelados (Windows)
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = PDFtoPNGConverter(root)
     root.mainloop()
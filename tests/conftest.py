@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Historial en un archivo temporal: los tests no tocan la base real
+os.environ.setdefault("SCAN_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="test_scans_"), "scans.db"))
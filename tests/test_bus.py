@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import main
+
+
+def start_hub(tmp_path):
+    address = os.path.join(tmp_path, "bus.sock")
+    authkey = os.urandom(16)
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    threading.Thread(target=main.run_bus_hub, args=(listener,), daemon=True).start()
+    return lambda: Client(address, family="AF_UNIX", authkey=authkey)
+
+
+def collect(conn, received, count):
+    while len(received) < count:
+        event = conn.recv()
+        if event["message"]["type"] == "new_scan":
+            received.append(event["message"]["n"])
+
+
+def test_hub_relays_to_everyone_while_a_worker_is_stuck(tmp_path):
+    connect = start_hub(tmp_path)
+    stuck = connect()  # Nunca lee: su socket se llena enseguida
+    publisher, reader = connect(), connect()
+    # El hub saluda con las metricas al registrar cada conexion
+    for conn in (publisher, reader):
+        assert conn.recv()["message"]["type"] == "metrics_all"
+    count = 200
+    # ~12 MB en total, mucho mas que el buffer del socket del worker trabado
+    padding = "x" * 64 * 1024
+    received = {"publisher": [], "reader": []}
+    readers = [threading.Thread(target=collect, args=(conn, received[name], count), daemon=True)
+               for name, conn in (("publisher", publisher), ("reader", reader))]
+    def publish():
+        for n in range(count):
+            publisher.send({"origin": "1", "message": {"type": "new_scan", "n": n, "padding": padding}})
+    # Si el hub se traba, tambien se traba el envio: el test falla en vez de colgarse
+    threads = [threading.Thread(target=publish, daemon=True)] + readers
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=20)
+
+    assert received["publisher"] == list(range(count))
+    assert received["reader"] == list(range(count))
+    assert time.time() - started < 20
+    stuck.close()
+
+
+def test_hub_shares_the_metrics_of_every_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_SHARE_INTERVAL", 0.1)
+    connect = start_hub(tmp_path)
+    first, second = connect(), connect()
+    first.send({"origin": "1", "message": {"type": "metrics", "snapshot": {"a": 1}}})
+    second.send({"origin": "2", "message": {"type": "metrics", "snapshot": {"b": 2}}})
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        event = first.recv()
+        if event["message"]["type"] == "metrics_all" and len(event["message"]["snapshots"]) == 2:
+            break
+    else:
+        raise AssertionError("el hub no repartio las metricas")
+    assert sorted(event["message"]["snapshots"], key=list) == [{"a": 1}, {"b": 2}]
+    first.close()
+    second.close()
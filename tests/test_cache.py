@@ -0,0 +1,26 @@
+import main
+
+
+def result(image_size):
+    return {"data": {"exp_sigad": "045"}, "raw_text": "texto", "rotation": 0,
+            "processed_image": b"\xff" * image_size}
+
+
+def test_memory_cache_stays_under_its_byte_budget():
+    cache = main.OCRCache(max_entries=256, directory=None, max_bytes=1_000_000)
+    for number in range(50):
+        cache.put(f"k{number}", result(100_000))
+        assert cache.total_bytes <= cache.max_bytes
+    assert cache.get("k49")["processed_image"]
+    # Las mas viejas salen primero
+    assert cache.get("k0") is None
+    assert cache.total_bytes == sum(cache.entry_size(cache.get(key)) for key in list(cache._entries))
+
+
+def test_oversized_image_keeps_only_the_data():
+    cache = main.OCRCache(directory=None, max_bytes=1_000)
+    cache.put("grande", result(10_000))
+    cached = cache.get("grande")
+    assert cached["data"] == {"exp_sigad": "045"}
+    assert "processed_image" not in cached
+    assert cache.total_bytes <= cache.max_bytes
@@ -0,0 +1,54 @@
+import io
+import tracemalloc
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize("body", [[1, 2], "texto", 3, {"data": [1]}, {"data": {}, "pages": "p1"}])
+def test_save_document_rejects_malformed_json(client, body):
+    response = client.post("/api/scans", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+
+def test_csv_export_neutralises_formulas(client):
+    data = {"exp_sigad": "=cmd|' /C calc'!A0", "monto": "-1+2", "nombre_contribuyente": "@SUM(A1)",
+            "ruc_contribuyente": "20100047218"}
+    assert client.post("/api/scans", json={"data": data}).status_code == 201
+    body = client.get("/api/scans/export?format=csv&kind=document&q=20100047218").get_data(as_text=True)
+    assert "'=cmd|" in body and "'-1+2" in body and "'@SUM(A1)" in body
+    assert ",=cmd|" not in body
+    assert ",20100047218," in body
+
+
+def test_xlsx_export_writes_formulas_as_text():
+    openpyxl = pytest.importorskip("openpyxl")
+    row = {key: "" for _, key in main.EXPORT_COLUMNS}
+    content = b"".join(main.export_rows_xlsx([{**row, "created": 1.7e9, "exp_sigad": "=1+1"}]))
+    sheet = openpyxl.load_workbook(io.BytesIO(content)).active
+    cells = [cell for cell in sheet[2] if cell.value]
+    assert "'=1+1" in [cell.value for cell in cells]
+    assert all(cell.data_type != "f" for cell in cells)
+
+
+def test_xlsx_export_does_not_hold_the_rows_in_memory():
+    pytest.importorskip("openpyxl")
+    # ~10 MB de texto en celdas
+    row = {key: "x" * 200 for _, key in main.EXPORT_COLUMNS}
+    rows = ({**row, "created": 1.7e9} for _ in range(4000))
+    tracemalloc.start()
+    try:
+        size = sum(len(chunk) for chunk in main.export_rows_xlsx(rows))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # write_only: cada fila va al archivo temporal al agregarla
+    assert size > 0
+    assert peak < 3 * 1024 * 1024
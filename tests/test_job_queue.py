@@ -0,0 +1,40 @@
+import time
+
+import main
+
+
+def slow_page(number):
+    time.sleep(0.1)
+    return {"data": {"page": number}}
+
+
+def wait_done(queue, job_ids, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        states = [queue.status(job_id)["state"] for job_id in job_ids]
+        if all(state != "queued" and state != "processing" for state in states):
+            return states
+        time.sleep(0.05)
+    raise AssertionError(f"trabajos sin terminar: {states}")
+
+
+def test_reserved_jobs_wait_for_a_slot_instead_of_failing():
+    queue = main.JobQueue(workers=1, limit=1)
+    delivered = []
+    try:
+        first = queue.submit(slow_page, 1, on_done=lambda job_id, result: delivered.append(result["data"]["page"]))
+        assert queue.submit(slow_page, 2) is None  # sin cupo
+
+        waiting = []
+        for number in range(2, 6):
+            job_id = queue.reserve()
+            assert queue.status(job_id)["state"] == "queued"
+            waiting.append((job_id, (number,), lambda job_id, result: delivered.append(result["data"]["page"])))
+        queue.feed(slow_page, waiting)
+
+        job_ids = [first] + [job_id for job_id, _, _ in waiting]
+        assert wait_done(queue, job_ids) == ["done"] * 5
+        assert [queue.status(job_id)["data"]["page"] for job_id in job_ids] == [1, 2, 3, 4, 5]
+    finally:
+        queue.shutdown()
+    assert sorted(delivered) == [1, 2, 3, 4, 5]
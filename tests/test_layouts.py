@@ -0,0 +1,52 @@
+import re
+
+import numpy as np
+
+import main
+
+
+def zone(pattern, validate=None, strip_spaces=True):
+    return main.LayoutZone("campo", (0, 0, 1, 1), 7, None, re.compile(pattern), validate, strip_spaces)
+
+
+def test_example_template_is_disabled():
+    assert main.load_layouts(main.LAYOUT_DIR) == []
+
+
+def test_free_text_zone_is_not_verified():
+    value, verified = main.parse_zone_value("COMERCIALIZADORA ANDINA", zone(r"[A-Z ]{5,}", strip_spaces=False))
+    assert value == "COMERCIALIZADORA ANDINA"
+    assert not verified
+
+
+def test_zone_validators():
+    assert main.parse_zone_value("20100047218", zone(r"\d{11}", "ruc")) == ("20100047218", True)
+    assert main.parse_zone_value("20100047219", zone(r"\d{11}", "ruc")) == (None, False)
+    assert main.parse_zone_value("31/02/2024", zone(r"\d{1,2}/\d{1,2}/20\d{2}", "date")) == (None, False)
+    assert main.parse_zone_value("0230045678901", zone(r"\d{10,}", "format")) == ("0230045678901", True)
+    # Texto de mas en la region: el valor sirve pero no se da por verificado
+    assert main.parse_zone_value("N0230045678901", zone(r"\d{10,}", "format")) == ("0230045678901", False)
+
+
+def test_unverified_fields_need_full_page_ocr():
+    data = {"exp_sigad": "045-SGD-2024-1234567-8", "ruc_contribuyente": "20100047218", "nombre_contribuyente": "X"}
+    assert main.ZoneReading(data, "plantilla").resolves_page
+    assert not main.ZoneReading(data, "plantilla", ("nombre_contribuyente",)).resolves_page
+
+
+def test_no_anchor_pass_without_layouts(monkeypatch):
+    def fail():
+        raise AssertionError("OCR sin plantillas activas")
+    monkeypatch.setattr(main, "LAYOUTS", [])
+    monkeypatch.setattr(main, "get_ocr_pool", fail)
+    assert main.read_layout_zones(np.zeros((40, 20), np.uint8), 0) == main.ZoneReading({})
+
+
+def test_anchor_words_are_regrouped_into_lines():
+    words = [
+        {"text": "20100047218", "left": 60, "top": 41, "width": 50, "height": 10},
+        {"text": "RESOLUCION", "left": 0, "top": 10, "width": 50, "height": 10},
+        {"text": "RUC", "left": 0, "top": 40, "width": 20, "height": 10},
+        {"text": "COACTIVA", "left": 55, "top": 12, "width": 40, "height": 10},
+    ]
+    assert main.words_to_text(words) == "RESOLUCION COACTIVA\nRUC 20100047218"
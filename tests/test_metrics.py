@@ -0,0 +1,87 @@
+import io
+import logging
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+def metric_value(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_scan_timings_are_exported(client):
+    before = client.get("/metrics").get_data(as_text=True)
+    timings = main.begin_scan_timings()
+    with main.timed_stage("test_stage"):
+        time.sleep(0.02)
+    timings.add_pass(180, 0.3)
+    timings.events.update(resolved_by="ocr", resolved_level=0.5, early_exit=True)
+    main.observe_scan({"rotation": 180, "timings": timings.as_dict()})
+
+    after = client.get("/metrics").get_data(as_text=True)
+    for prefix in ('scan_stage_seconds_count{stage="test_stage"}',
+                   'scan_ocr_pass_seconds_bucket{rotation="180",le="0.5"}',
+                   'scan_rotation_total{rotation="180"}',
+                   'scan_resolved_level_total{level="0.5"}',
+                   "scan_early_exit_total"):
+        assert metric_value(after, prefix) == metric_value(before, prefix) + 1, prefix
+    # Buckets acumulativos: 0.02 s cae en 0.025 y en todos los mayores
+    assert metric_value(after, 'scan_stage_seconds_bucket{stage="test_stage",le="0.01"}') == 0
+    assert metric_value(after, 'scan_stage_seconds_bucket{stage="test_stage",le="+Inf"}') == 1
+
+
+def test_http_requests_are_counted_by_endpoint_and_status(client):
+    prefix = 'http_request_seconds_count{endpoint="job_status",method="GET",status="404"}'
+    before = metric_value(client.get("/metrics").get_data(as_text=True), prefix)
+    assert client.get("/jobs/no-existe").status_code == 404
+    assert metric_value(client.get("/metrics").get_data(as_text=True), prefix) == before + 1
+
+
+def test_metrics_of_every_worker_are_added():
+    counter = main.Counter("test_total", "prueba", ("kind",))
+    histogram = main.Histogram("test_seconds", "prueba", buckets=(1.0,))
+    try:
+        counter.inc(kind="a")
+        histogram.observe(0.5)
+        snapshots = [main.metrics_snapshot(), main.metrics_snapshot()]
+        text = main.render_metrics(snapshots)
+    finally:
+        main.METRICS.remove(counter)
+        main.METRICS.remove(histogram)
+    assert 'test_total{kind="a"} 2' in text
+    assert 'test_seconds_bucket{le="1"} 2' in text
+    assert "test_seconds_count 2" in text
+
+
+def test_log_lines_carry_the_request_id(client, caplog):
+    caplog.set_level(logging.INFO, logger=main.logger.name)
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("[%(request_id)s] %(message)s"))
+    handler.addFilter(main.RequestIdFilter())
+    main.logger.addHandler(handler)
+    try:
+        response = client.get("/api/scans", headers={"X-Request-ID": "proxy-123"})
+        main.logger.info("fuera de un request")
+    finally:
+        main.logger.removeHandler(handler)
+    assert response.headers["X-Request-ID"] == "proxy-123"
+    lines = stream.getvalue().splitlines()
+    assert any(line.startswith("[proxy-123] request method=GET path=/api/scans") for line in lines)
+    assert lines[-1] == "[-] fuera de un request"
+
+
+def test_request_id_is_generated_without_a_proxy(client):
+    first = client.get("/api/scans").headers["X-Request-ID"]
+    second = client.get("/api/scans").headers["X-Request-ID"]
+    assert len(first) == 12 and first != second
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+import main
+
+
+def test_pool_builds_a_tesserocr_engine():
+    pytest.importorskip("tesserocr")
+    pool = main.OCREnginePool(size=1, preload=1)
+    assert pool.persistent
+    with pool.engine() as api:
+        assert main.OCR_LANG.split("+")[0] in api.GetInitLanguagesAsString()
+    # PSM por parametro (lectura de pagina y de palabras) sobre el mismo motor
+    blank = np.full((60, 200), 255, np.uint8)
+    assert pool.image_to_string(blank, psm=main.OCR_PSM).strip() == ""
+    assert pool.image_to_words(blank) == []
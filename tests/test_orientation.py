@@ -0,0 +1,183 @@
+import time
+
+import numpy as np
+import pytest
+
+import main
+
+DOCUMENT_TEXT = """EXPEDIENTE SIGAD 045-SGD-2024-1234567-8
+RESOLUCION COACTIVA N° 0230045678901
+DEUDOR: COMERCIALIZADORA ANDINA S.A.C.
+RUC 20100047218
+USUARIO RUC 20512345671 - BANCO DE CREDITO DEL PERU"""
+
+
+class FakeOCRPool:
+    """Devuelve el texto del documento solo si la imagen llega derecha."""
+    def __init__(self):
+        self.calls = 0
+        self.text = DOCUMENT_TEXT
+
+    def image_to_string(self, image, psm=main.OCR_PSM, whitelist=None, cancel=None):
+        self.calls += 1
+        if image[0, 0] == 255:
+            return self.text
+        # Las rotaciones equivocadas tardan: da tiempo a cancelarlas
+        time.sleep(0.2)
+        if cancel is not None and cancel.is_set():
+            raise main.OCRCancelled()
+        return "~~ ilegible ~~"
+
+
+@pytest.fixture
+def page():
+    # Marca en la esquina superior izquierda: solo la rotacion 0 la deja ahi
+    # (2x2 para que siga ahi al reducir la pagina a la mitad)
+    image = np.zeros((40, 20), np.uint8)
+    image[:2, :2] = 255
+    return image
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    fake = FakeOCRPool()
+    monkeypatch.setattr(main, "get_ocr_pool", lambda: fake)
+    return fake
+
+
+def test_extracts_rucs_from_separated_numbers():
+    data = main.extract_data_from_text(DOCUMENT_TEXT)
+    assert data["ruc_contribuyente"] == "20100047218"
+    assert data["ruc_tercero"] == "20512345671"
+    assert main.has_key_fields(data)
+
+
+def test_confident_osd_reads_a_single_rotation(page, pool):
+    timings = main.begin_scan_timings()
+    data, _, angle = main.ocr_best_rotation(page, [0, 180, 270, 90], osd_confident=True)
+    assert angle == 0
+    assert data["ruc_contribuyente"] == "20100047218"
+    assert pool.calls == 1
+    assert timings.as_dict()["early_exit"] is True
+
+
+def test_race_stops_at_the_first_confident_rotation(page, pool, monkeypatch):
+    # Un solo hilo: las rotaciones corren en orden y las restantes se cancelan
+    monkeypatch.setattr(main, "_rotation_executor", main.ThreadPoolExecutor(max_workers=1))
+    timings = main.begin_scan_timings()
+    data, _, angle = main.ocr_best_rotation(page, [0, 180, 270, 90], osd_confident=False)
+    assert angle == 0
+    assert main.is_confident(data)
+    assert pool.calls < 4
+    assert timings.as_dict()["early_exit"] is True
+
+
+def test_late_rotation_does_not_leak_into_next_scan(page, monkeypatch):
+    class UncancellablePool(FakeOCRPool):
+        """Como tesserocr: una lectura en curso no se puede cortar."""
+        def image_to_string(self, image, psm=main.OCR_PSM, whitelist=None, cancel=None):
+            if image[0, 0] == 255:
+                return DOCUMENT_TEXT
+            time.sleep(0.2)
+            return "~~ ilegible ~~"
+
+    monkeypatch.setattr(main, "get_ocr_pool", UncancellablePool)
+    monkeypatch.setattr(main, "_rotation_executor", main.ThreadPoolExecutor(max_workers=2))
+    main.begin_scan_timings()
+    main.ocr_best_rotation(page, [0, 180, 270, 90], osd_confident=False)
+    following = main.begin_scan_timings()
+    main._rotation_executor.shutdown(wait=True)
+    assert following.as_dict()["ocr_passes"] == []
+    assert following.as_dict()["stages"] == {}
+
+
+def test_rotation_threads_never_oversubscribe(monkeypatch):
+    monkeypatch.setattr(main.os, "cpu_count", lambda: 8)
+    assert main.rotation_threads_for(8) == 1
+    assert main.rotation_threads_for(2) == 4
+    assert main.rotation_threads_for(16) == 1
+
+
+def test_ladder_reuses_the_anchor_pass_text_read_with_the_page_psm(page, pool, monkeypatch):
+    monkeypatch.setattr(main, "LAYOUT_ANCHOR_PSM", main.OCR_PSM)
+    timings = main.begin_scan_timings()
+    data, _, angle, level = main.ocr_ladder(page, [0, 180, 270, 90], osd_confident=True, anchor_text=DOCUMENT_TEXT)
+    assert (angle, level) == (0, main.OCR_LADDER[0])
+    assert data["res_coactiva"] == "0230045678901"
+    assert pool.calls == 0
+    assert timings.as_dict()["anchor_reused"] is True
+
+
+def test_ladder_reads_again_when_the_anchor_pass_used_another_psm(page, pool):
+    assert main.LAYOUT_ANCHOR_PSM != main.OCR_PSM
+    timings = main.begin_scan_timings()
+    main.ocr_ladder(page, [0, 180, 270, 90], osd_confident=True, anchor_text="texto del pase de anclas")
+    assert pool.calls == 1
+    assert "anchor_reused" not in timings.as_dict()
+
+
+def test_page_without_coactiva_resolves_at_the_coarse_level(page, pool):
+    pool.text = DOCUMENT_TEXT.replace("RESOLUCION COACTIVA N° 0230045678901\n", "")
+    main.begin_scan_timings()
+    data, _, _, level = main.ocr_ladder(page, [0], osd_confident=True, fields=main.ZoneReading({}).ladder_fields)
+    assert "res_coactiva" not in data
+    assert level == main.OCR_LADDER[0]
+    assert pool.calls == 1
+
+
+def test_ladder_fields_follow_the_matched_template():
+    assert main.ZoneReading({}).ladder_fields == main.KEY_FIELDS
+    zones = main.ZoneReading({}, "coactiva", fields=("res_coactiva", "exp_sigad", "monto"))
+    assert zones.ladder_fields == ("exp_sigad", "res_coactiva")
+
+
+def test_ocr_ladder_always_ends_at_full_resolution():
+    assert main.parse_ocr_ladder("0.5,1") == (0.5, 1.0)
+    assert main.parse_ocr_ladder("0.5") == (0.5, 1.0)
+    assert main.parse_ocr_ladder("1, 0.25 ,0.5") == (0.25, 0.5, 1.0)
+    assert main.parse_ocr_ladder("") == main.DEFAULT_OCR_LADDER
+    assert main.parse_ocr_ladder("abc,-1,0") == main.DEFAULT_OCR_LADDER
+
+
+class SlowOCRPool(FakeOCRPool):
+    """Cada lectura tarda lo mismo, acierte o no la rotacion."""
+    def image_to_string(self, image, psm=main.OCR_PSM, whitelist=None, cancel=None):
+        time.sleep(0.3)
+        if cancel is not None and cancel.is_set():
+            raise main.OCRCancelled()
+        return DOCUMENT_TEXT if image[0, 0] == 255 else "~~ ilegible ~~"
+
+
+def read_upside_down_page():
+    # Marca abajo a la derecha: solo la rotacion de 180 la deja arriba a la izquierda
+    image = np.zeros((40, 20), np.uint8)
+    image[-1, -1] = 255
+    main.begin_scan_timings()
+    start = time.perf_counter()
+    _, _, angle = main.ocr_best_rotation(image, [0, 180, 270, 90], osd_confident=False)
+    return {"data": {"angle": angle, "elapsed": time.perf_counter() - start}}
+
+
+def test_lone_page_races_every_rotation_with_the_default_queue(monkeypatch):
+    # Maquina de 4 nucleos con la configuracion por defecto (un proceso OCR por nucleo)
+    monkeypatch.setattr(main.os, "cpu_count", lambda: 4)
+    monkeypatch.setattr(main, "get_ocr_pool", lambda: SlowOCRPool())
+    queue = main.JobQueue(workers=4)
+    try:
+        job_id = queue.submit(read_upside_down_page)
+        result = queue.future(job_id).result(timeout=30)["data"]
+    finally:
+        queue.shutdown()
+    assert result["angle"] == 180
+    # Una sola pasada (0.3 s), no 0 y luego 180 en orden (0.6 s)
+    assert result["elapsed"] < 0.5
+
+
+def test_race_narrows_when_every_core_is_busy(monkeypatch):
+    monkeypatch.setattr(main.os, "cpu_count", lambda: 4)
+    busy = main.new_busy_counter()
+    busy.value = 4
+    monkeypatch.setattr(main, "_busy_scans", busy)
+    assert main.race_width() == 1
+    busy.value = 1
+    assert main.race_width() == 4
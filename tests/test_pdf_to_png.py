@@ -0,0 +1,201 @@
+import multiprocessing
+import os
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+import pdf_to_png
+
+
+class FakePoppler:
+    """
+    pdfinfo/pdftoppm de mentira: el "PDF" es un archivo de texto con
+    "pages=N[,broken=P]" y cada pagina sale como una imagen cuyo gris es su
+    numero. Renderizar un tramo que incluye la pagina P falla.
+    """
+    def __init__(self):
+        self.calls = []
+
+    @staticmethod
+    def read(pdf_path):
+        text = Path(pdf_path).read_text()
+        if not text.startswith("pages="):
+            raise ValueError("no es un PDF")
+        return {key: int(value) for key, value in (item.split("=") for item in text.split(","))}
+
+    def info(self, pdf_path):
+        return {"Pages": self.read(pdf_path)["pages"]}
+
+    def convert(self, pdf_path, dpi, first_page, last_page, thread_count=1, grayscale=False):
+        self.calls.append((first_page, last_page))
+        if first_page <= self.read(pdf_path).get("broken", 0) <= last_page:
+            raise RuntimeError("pagina danada")
+        return [Image.new("L", (20, 10), page) for page in range(first_page, last_page + 1)]
+
+
+@pytest.fixture
+def poppler(monkeypatch):
+    fake = FakePoppler()
+    monkeypatch.setattr(pdf_to_png, "convert_from_path", fake.convert)
+    monkeypatch.setattr(pdf_to_png, "pdfinfo_from_path", fake.info)
+    return fake
+
+
+def fake_pdf(folder, name, pages, broken=None):
+    path = folder / name
+    path.write_text(f"pages={pages}" + (f",broken={broken}" if broken else ""))
+    return path
+
+
+def test_pages_are_rendered_in_bounded_chunks(tmp_path, poppler):
+    pdf = fake_pdf(tmp_path, "expediente.pdf", 20)
+    pages = pdf_to_png.iter_pdf_pages(str(pdf), str(tmp_path), chunk_size=8)
+    # Perezoso: la primera pagina solo renderiza el primer tramo
+    assert next(pages)[:2] == (1, 20)
+    assert poppler.calls == [(1, 8)]
+
+    rest = list(pages)
+    assert poppler.calls == [(1, 8), (9, 16), (17, 20)]
+    assert [page for page, _, _ in rest] == list(range(2, 21))
+    assert Path(rest[-1][2]).name == "expediente_pagina_20.png"
+    assert Image.open(rest[-1][2]).getpixel((0, 0)) == 20
+
+
+def test_single_page_pdf_has_no_page_suffix(tmp_path, poppler):
+    pdf = fake_pdf(tmp_path, "oficio.pdf", 1)
+    assert pdf_to_png.pdf_to_png(str(pdf), str(tmp_path / "salida")) == [str(tmp_path / "salida" / "oficio.png")]
+
+
+# Los procesos del pool heredan el Poppler de mentira solo con fork
+needs_fork = pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                                reason="los workers no heredan el monkeypatch")
+
+
+@needs_fork
+def test_parallel_conversion_returns_pages_in_order(tmp_path, poppler):
+    long, short = fake_pdf(tmp_path, "largo.pdf", 7), fake_pdf(tmp_path, "corto.pdf", 3)
+    output = tmp_path / "salida"
+    output.mkdir()
+    results = pdf_to_png.convert_parallel([long, short], str(output), chunk_size=2, workers=3)
+    assert [Path(path).name for path in results[str(long)]] == [f"largo_pagina_{page}.png" for page in range(1, 8)]
+    assert [Image.open(path).getpixel((0, 0)) for path in results[str(long)]] == list(range(1, 8))
+    assert len(results[str(short)]) == 3
+
+
+@needs_fork
+def test_failed_range_only_fails_its_own_pdf(tmp_path, poppler):
+    good = fake_pdf(tmp_path, "bueno.pdf", 4)
+    broken = fake_pdf(tmp_path, "danado.pdf", 6, broken=5)
+    unreadable = tmp_path / "ilegible.pdf"
+    unreadable.write_text("%PDF roto")
+    results = pdf_to_png.convert_parallel([good, broken, unreadable], str(tmp_path), chunk_size=2, workers=2)
+    assert len(results[str(good)]) == 4
+    # Los otros tramos del PDF se convirtieron, pero el PDF cuenta como fallido
+    assert results[str(broken)] == []
+    assert results[str(unreadable)] == []
+
+
+def gradient():
+    """Pagina RGB de 256 tonos de gris, de negro (arriba) a blanco (abajo)."""
+    return Image.linear_gradient("L").resize((64, 64)).convert("RGB")
+
+
+@pytest.mark.parametrize("fmt, color, format, mode", [
+    ("png", "color", "PNG", "RGB"),
+    ("png", "gray", "PNG", "L"),
+    ("png", "bw", "PNG", "1"),
+    ("tiff-g4", "color", "TIFF", "1"),
+    ("webp", "gray", "WEBP", "RGB"),
+])
+def test_save_page_format_and_color(tmp_path, fmt, color, format, mode):
+    output = pdf_to_png.output_options(fmt, color)
+    path = tmp_path / f"pagina{pdf_to_png.OUTPUT_FORMATS[fmt]}"
+    pdf_to_png.save_page(gradient(), path, output)
+    with Image.open(path) as image:
+        assert (image.format, image.mode) == (format, mode)
+        if fmt == "tiff-g4":
+            assert image.info["compression"] == "group4"
+        if fmt == "webp":
+            # Sin perdida: el gris vuelve identico
+            assert image.convert("L").tobytes() == gradient().convert("L").tobytes()
+
+
+def test_bw_uses_a_fixed_threshold(tmp_path):
+    path = tmp_path / "pagina.png"
+    pdf_to_png.save_page(gradient(), path, pdf_to_png.output_options("png", "bw"))
+    with Image.open(path) as image:
+        column = [image.getpixel((32, y)) for y in range(64)]
+    assert set(column) == {0, 255}
+    assert column == sorted(column)  # Un solo corte, sin tramado
+
+
+def test_output_options():
+    assert pdf_to_png.output_options("tiff-g4", "gray")["color"] == "bw"
+    assert pdf_to_png.output_options(compress_level=42)["compress_level"] == 9
+    with pytest.raises(ValueError):
+        pdf_to_png.output_options("jpg")
+    with pytest.raises(ValueError):
+        pdf_to_png.output_options(color="sepia")
+
+
+SETTINGS = pdf_to_png.conversion_settings(300, pdf_to_png.DEFAULT_OUTPUT)
+
+
+def converted(tmp_path, pages=2):
+    """PDF ya convertido y anotado en un manifiesto en memoria."""
+    pdf = fake_pdf(tmp_path, "acta.pdf", pages)
+    outputs = []
+    for page in range(1, pages + 1):
+        outputs.append(tmp_path / f"acta_pagina_{page}.png")
+        outputs[-1].write_bytes(b"png")
+    manifest = {"files": {}}
+    pdf_to_png.record_outputs(manifest, str(tmp_path), pdf, SETTINGS, [str(path) for path in outputs])
+    return pdf, outputs, manifest
+
+
+def test_manifest_skips_only_unchanged_conversions(tmp_path):
+    pdf, outputs, manifest = converted(tmp_path)
+    assert pdf_to_png.is_up_to_date(manifest, str(tmp_path), pdf, SETTINGS)
+    assert not pdf_to_png.is_up_to_date(manifest, str(tmp_path), pdf, pdf_to_png.conversion_settings(600, pdf_to_png.DEFAULT_OUTPUT))
+
+    outputs[1].unlink()
+    assert not pdf_to_png.is_up_to_date(manifest, str(tmp_path), pdf, SETTINGS)
+
+
+def test_touched_pdf_is_compared_by_hash(tmp_path):
+    pdf, _, manifest = converted(tmp_path)
+    entry = manifest["files"][os.path.abspath(pdf)]
+    os.utime(pdf, (1, 1))
+    # Mismo contenido: sigue al dia y se anota el nuevo mtime
+    assert pdf_to_png.is_up_to_date(manifest, str(tmp_path), pdf, SETTINGS)
+    assert entry["mtime"] == 1
+
+    pdf.write_text("pages=3")
+    assert not pdf_to_png.is_up_to_date(manifest, str(tmp_path), pdf, SETTINGS)
+
+
+def test_record_outputs_removes_stale_pages(tmp_path):
+    pdf, outputs, manifest = converted(tmp_path, pages=3)
+    pdf_to_png.record_outputs(manifest, str(tmp_path), pdf, SETTINGS, [str(outputs[0])])
+    assert [path.exists() for path in outputs] == [True, False, False]
+    assert manifest["files"][os.path.abspath(pdf)]["outputs"] == ["acta_pagina_1.png"]
+
+
+def test_damaged_manifest_starts_empty(tmp_path):
+    (tmp_path / pdf_to_png.MANIFEST_NAME).write_text("{roto")
+    assert pdf_to_png.load_manifest(str(tmp_path)) == {"files": {}}
+    (tmp_path / pdf_to_png.MANIFEST_NAME).write_text("[]")
+    assert pdf_to_png.load_manifest(str(tmp_path)) == {"files": {}}
+
+
+def test_batch_converts_only_new_or_changed_pdfs(tmp_path, poppler):
+    source, output = tmp_path / "pdfs", tmp_path / "png"
+    source.mkdir()
+    first = fake_pdf(source, "a.pdf", 2)
+    assert list(pdf_to_png.batch_convert(str(source), str(output))) == [str(first)]
+
+    second = fake_pdf(source, "b.pdf", 1)
+    assert list(pdf_to_png.batch_convert(str(source), str(output))) == [str(second)]
+    assert pdf_to_png.batch_convert(str(source), str(output)) == {}
+    assert len(pdf_to_png.batch_convert(str(source), str(output), incremental=False)) == 2
@@ -0,0 +1,42 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import main
+
+
+def page(paper, ink, blur=0, noise=0, format="PNG"):
+    """Hoja que llena todo el cuadro, con texto fino y mucho papel alrededor, como un oficio."""
+    image = np.full((1600, 1200), paper, np.uint8)
+    for line, y in enumerate(range(200, 1400, 90)):
+        cv2.putText(image, f"RUC 20512345671 EXP. {line:04d}", (120, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, ink, 1, cv2.LINE_AA)
+    if blur:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    if noise:
+        image = np.clip(image + np.random.default_rng(0).normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format)
+    return buffer.getvalue()
+
+
+def test_clean_white_page_passes():
+    report = main.check_image_quality(page(255, 0))
+    assert report["issues"] == []
+    assert report["metrics"]["clipped"] > main.QUALITY_MAX_CLIPPED
+
+
+def test_full_frame_photo_of_grey_paper_passes():
+    report = main.check_image_quality(page(215, 60, noise=3, format="JPEG"))
+    assert report["issues"] == []
+    assert report["metrics"]["contrast"] >= main.QUALITY_MIN_CONTRAST
+
+
+def test_washed_out_page_is_overexposed():
+    assert main.check_image_quality(page(255, 238))["issues"][0] == "overexposed"
+
+
+def test_blurred_photo_is_rejected():
+    assert main.check_image_quality(page(215, 60, blur=3, format="JPEG"))["issues"] == ["blurry"]
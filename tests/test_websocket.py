@@ -0,0 +1,36 @@
+import time
+
+import main
+
+
+class BrokenSocket:
+    def __init__(self):
+        self.shut = False
+
+    def shutdown(self, how):
+        self.shut = True
+
+
+class BrokenWS:
+    """Escritorio que se cayo sin cerrar: cada envio falla."""
+    connected = True
+
+    def __init__(self):
+        self.sock = BrokenSocket()
+
+    def send(self, frame):
+        raise ConnectionResetError("conexion reiniciada")
+
+
+def test_failed_send_unregisters_and_closes_the_client():
+    manager = main.WebSocketManager()
+    ws = BrokenWS()
+    manager.register(ws)
+    dropped = main.WS_DROPPED_TOTAL.snapshot().get((), 0)
+    manager.broadcast({"type": "new_scan"})
+    deadline = time.time() + 5
+    while ws in manager.clients and time.time() < deadline:
+        time.sleep(0.01)
+    assert ws not in manager.clients
+    assert ws.sock.shut
+    assert main.WS_DROPPED_TOTAL.snapshot()[()] == dropped + 1